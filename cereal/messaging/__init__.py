@@ -1,6 +1,7 @@
 # must be build with scons
 from .messaging_pyx import Context, Poller, SubSocket, PubSocket  # pylint: disable=no-name-in-module, import-error
 from .messaging_pyx import MultiplePublishersError, MessagingError  # pylint: disable=no-name-in-module, import-error
+import struct
 import capnp
 
 assert MultiplePublishersError
@@ -50,57 +51,19 @@ def sub_sock(endpoint, poller=None, addr="127.0.0.1", conflate=False, timeout=No
 
 def drain_sock_raw(sock, wait_for_one=False):
   """Receive all message currently available on the queue"""
-  ret = []
-  while 1:
-    if wait_for_one and len(ret) == 0:
-      dat = sock.receive()
-    else:
-      dat = sock.receive(non_blocking=True)
-
-    if dat is None:
-      break
-
-    ret.append(dat)
-
-  return ret
+  return sock.receive_many(wait_for_one=wait_for_one, contiguous=False)
 
 def drain_sock(sock, wait_for_one=False):
   """Receive all message currently available on the queue"""
-  ret = []
-  while 1:
-    if wait_for_one and len(ret) == 0:
-      dat = sock.receive()
-    else:
-      dat = sock.receive(non_blocking=True)
-
-    if dat is None: # Timeout hit
-      break
-
-    dat = log.Event.from_bytes(dat)
-    ret.append(dat)
-
-  return ret
+  return [log.Event.from_bytes(dat) for dat in sock.receive_many(wait_for_one=wait_for_one)]
 
 
 # TODO: print when we drop packets?
 def recv_sock(sock, wait=False):
   """Same as drain sock, but only returns latest message. Consider using conflate instead."""
-  dat = None
-
-  while 1:
-    if wait and dat is None:
-      rcv = sock.receive()
-    else:
-      rcv = sock.receive(non_blocking=True)
-
-    if rcv is None: # Timeout hit
-      break
-
-    dat = rcv
-
+  dat = sock.receive_latest(wait=wait)
   if dat is not None:
     dat = log.Event.from_bytes(dat)
-
   return dat
 
 def recv_one(sock):
@@ -212,6 +175,173 @@ class SubMaster():
     return self.all_alive(service_list=service_list) and self.all_valid(service_list=service_list)
 
 
+# where logMonoTime and valid are in the data section of an Event
+_LOG_MONO_TIME_BYTE = 8 * log.Event.schema.fields['logMonoTime'].proto.slot.offset
+_VALID_BIT = log.Event.schema.fields['valid'].proto.slot.offset
+
+
+def event_header(dat):
+  """Reads (logMonoTime, valid) of a serialized Event without decoding it.
+
+  Returns None when the root struct is not in the first segment."""
+  segments = struct.unpack_from('<I', dat)[0] + 1
+  root = (4 * (segments + 1) + 7) & ~7  # the segment table is padded to a word
+  ptr = struct.unpack_from('<Q', dat, root)[0]
+  if ptr & 3 != 0:
+    # far pointer
+    return None
+
+  # signed 30 bit offset in words from the end of the pointer, then the data section size in words
+  offset = (ptr & 0xffffffff) >> 2
+  if offset & (1 << 29):
+    offset -= 1 << 30
+  data = root + 8 * (offset + 1)
+  data_size = 8 * ((ptr >> 32) & 0xffff)
+
+  log_mono_time = 0
+  if _LOG_MONO_TIME_BYTE + 8 <= data_size:
+    log_mono_time = struct.unpack_from('<Q', dat, data + _LOG_MONO_TIME_BYTE)[0]
+  # valid defaults to true, so it is stored inverted
+  valid = True
+  if _VALID_BIT // 8 < data_size:
+    valid = not (dat[data + _VALID_BIT // 8] >> (_VALID_BIT % 8)) & 1
+  return log_mono_time, valid
+
+
+class _ServiceView():
+  """Read-only dict-like view of a per-service list, indexed by service name"""
+  def __init__(self, idx, vals, decode=None):
+    self._idx = idx
+    self._vals = vals
+    self._decode = decode
+
+  def __getitem__(self, s):
+    i = self._idx[s]
+    if self._decode is not None:
+      self._decode(i)
+    return self._vals[i]
+
+  def __contains__(self, s):
+    return s in self._idx
+
+  def __iter__(self):
+    return iter(self._idx)
+
+  def __len__(self):
+    return len(self._idx)
+
+  def keys(self):
+    return self._idx.keys()
+
+  def values(self):
+    return [self[s] for s in self._idx]
+
+  def items(self):
+    return [(s, self[s]) for s in self._idx]
+
+
+class LazySubMaster(SubMaster):
+  """SubMaster that keeps the raw received buffers and only decodes a service
+  the first time it is accessed in a frame. logMonoTime and valid are read from
+  the raw buffers without decoding them. Per-service bookkeeping lives in
+  preallocated lists indexed by service, exposed through dict-like views."""
+  def __init__(self, services, ignore_alive=None, addr="127.0.0.1"):
+    super(LazySubMaster, self).__init__(services, ignore_alive=ignore_alive, addr=addr)
+
+    self.services = list(services)
+    self._idx = {s: i for i, s in enumerate(self.services)}
+    self._sock_idx = {sock: self._idx[s] for s, sock in self.sock.items()}
+    n = len(self.services)
+
+    # alive timeout per service, None if the service has no expected frequency
+    self._alive_dt = [10. / self.freq[s] if self.freq[s] > 1e-5 else None for s in self.services]
+
+    self._raw = [None] * n
+    self._updated_idx = []
+    self._updated = [False] * n
+    self._rcv_time = [0.] * n
+    self._rcv_frame = [0] * n
+    self._alive = [False] * n
+    self._data = [self.data[s] for s in self.services]
+    self._log_mono_time = [0] * n
+    self._valid = [self.valid[s] for s in self.services]
+
+    self.updated = _ServiceView(self._idx, self._updated)
+    self.rcv_time = _ServiceView(self._idx, self._rcv_time)
+    self.rcv_frame = _ServiceView(self._idx, self._rcv_frame)
+    self.alive = _ServiceView(self._idx, self._alive)
+    self.data = _ServiceView(self._idx, self._data, self._decode)
+    self.logMonoTime = _ServiceView(self._idx, self._log_mono_time)
+    self.valid = _ServiceView(self._idx, self._valid)
+
+  def _decode(self, i):
+    raw = self._raw[i]
+    if raw is not None:
+      self._raw[i] = None
+      msg = log.Event.from_bytes(raw)
+      self._data[i] = getattr(msg, self.services[i])
+      self._log_mono_time[i] = msg.logMonoTime
+      self._valid[i] = msg.valid
+
+  def __getitem__(self, s):
+    i = self._idx[s]
+    if self._raw[i] is not None:
+      self._decode(i)
+    return self._data[i]
+
+  def update(self, timeout=1000):
+    raw_msgs = []
+    for sock in self.poller.poll(timeout):
+      dat = sock.receive(non_blocking=True)
+      if dat is not None:
+        raw_msgs.append((self._sock_idx[sock], dat))
+    self.update_raw(sec_since_boot(), raw_msgs)
+
+  def _start_frame(self):
+    self.frame += 1
+    for i in self._updated_idx:
+      self._updated[i] = False
+    self._updated_idx = []
+
+  def _mark_updated(self, i, cur_time):
+    self._updated[i] = True
+    self._updated_idx.append(i)
+    self._rcv_time[i] = cur_time
+    self._rcv_frame[i] = self.frame
+
+  def _update_alive(self, cur_time):
+    for i, dt in enumerate(self._alive_dt):
+      self._alive[i] = dt is None or (cur_time - self._rcv_time[i]) < dt
+
+  def update_raw(self, cur_time, raw_msgs):
+    """Update from (service index, raw bytes) pairs without decoding them"""
+    self._start_frame()
+    for i, dat in raw_msgs:
+      self._raw[i] = dat
+      header = event_header(dat)
+      if header is None:
+        self._decode(i)
+      else:
+        self._log_mono_time[i], self._valid[i] = header
+      self._mark_updated(i, cur_time)
+    self._update_alive(cur_time)
+
+  def update_msgs(self, cur_time, msgs):
+    self._start_frame()
+    for msg in msgs:
+      if msg is None:
+        continue
+
+      s = msg.which()
+      i = self._idx[s]
+      self._raw[i] = None
+      self._data[i] = getattr(msg, s)
+      self._log_mono_time[i] = msg.logMonoTime
+      self._valid[i] = msg.valid
+      self._mark_updated(i, cur_time)
+    self._update_alive(cur_time)
+
+
 class PubMaster():
   def __init__(self, services):
     self.sock = {}
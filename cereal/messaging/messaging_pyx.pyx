@@ -3,8 +3,11 @@
 
 import sys
 from libcpp.string cimport string
+from libcpp.vector cimport vector
 from libcpp cimport bool
 from libc cimport errno
+from libc.string cimport memcpy
+from cpython.bytes cimport PyBytes_FromStringAndSize, PyBytes_AS_STRING
 
 
 from messaging cimport Context as cppContext
@@ -42,9 +45,11 @@ cdef class Context:
 cdef class Poller:
   cdef cppPoller * poller
   cdef list sub_sockets
+  cdef dict registered
 
   def __cinit__(self):
     self.sub_sockets = []
+    self.registered = {}
     self.poller = cppPoller.create()
 
   def __dealloc__(self):
@@ -52,6 +57,7 @@ cdef class Poller:
 
   def registerSocket(self, SubSocket socket):
     self.sub_sockets.append(socket)
+    self.registered[<size_t>socket.socket] = socket
     self.poller.registerSocket(socket.socket)
 
   def poll(self, timeout):
@@ -61,10 +67,9 @@ cdef class Poller:
     with nogil:
         result = self.poller.poll(t)
 
+    # Return the registered socket objects, so callers can key on them
     for s in result:
-        socket = SubSocket()
-        socket.setPtr(s)
-        sockets.append(socket)
+        sockets.append(self.registered[<size_t>s])
 
     return sockets
 
@@ -119,6 +124,80 @@ cdef class SubSocket:
 
       return m
 
+  cdef vector[cppMessage*] receive_msgs(self, int max_msgs, bool wait_for_one):
+    cdef vector[cppMessage*] msgs
+    cdef cppMessage * msg
+
+    while max_msgs <= 0 or msgs.size() < <size_t>max_msgs:
+      msg = self.socket.receive(not (wait_for_one and msgs.size() == 0))
+      if msg == NULL:
+        break
+      msgs.push_back(msg)
+
+    if msgs.size() == 0 and wait_for_one and errno.errno == errno.EINTR:
+      print("SIGINT received, exiting")
+      sys.exit(1)
+
+    return msgs
+
+  def receive_many(self, int max_msgs=0, bool wait_for_one=False, bool contiguous=True):
+    """Receive all queued messages (at most max_msgs if > 0) in one call.
+
+    With contiguous=True the messages are copied into one buffer and returned as
+    a list of memoryviews into it, otherwise as a list of bytes objects."""
+    cdef vector[cppMessage*] msgs = self.receive_msgs(max_msgs, wait_for_one)
+    cdef size_t total = 0
+    cdef size_t offset = 0
+    cdef size_t sz
+    cdef char * buf_ptr
+    cdef cppMessage * msg
+
+    if not contiguous:
+      ret = []
+      for msg in msgs:
+        ret.append(PyBytes_FromStringAndSize(msg.getData(), msg.getSize()))
+        del msg
+      return ret
+
+    for msg in msgs:
+      total += msg.getSize()
+
+    buf = PyBytes_FromStringAndSize(NULL, total)
+    buf_ptr = PyBytes_AS_STRING(buf)
+    offsets = []
+    for msg in msgs:
+      sz = msg.getSize()
+      memcpy(buf_ptr + offset, msg.getData(), sz)
+      offsets.append((offset, offset + sz))
+      offset += sz
+      del msg
+
+    view = memoryview(buf)
+    return [view[start:end] for start, end in offsets]
+
+  def receive_latest(self, bool wait=False):
+    """Drain the queue and only return the latest message, intermediate messages are not copied"""
+    cdef cppMessage * latest = NULL
+    cdef cppMessage * msg
+
+    while True:
+      msg = self.socket.receive(not (wait and latest == NULL))
+      if msg == NULL:
+        break
+      if latest != NULL:
+        del latest
+      latest = msg
+
+    if latest == NULL:
+      if wait and errno.errno == errno.EINTR:
+        print("SIGINT received, exiting")
+        sys.exit(1)
+      return None
+
+    m = latest.getData()[:latest.getSize()]
+    del latest
+    return m
+
 
 cdef class PubSocket:
   cdef cppPubSocket * socket
@@ -137,6 +137,50 @@ class TestPoller(unittest.TestCase):
     del sub
     context.term()
 
+  def test_receive_many(self):
+    context = messaging.Context()
+
+    pub = messaging.PubSocket()
+    pub.connect(context, 'controlsState')
+
+    sub = messaging.SubSocket()
+    sub.connect(context, 'controlsState')
+
+    time.sleep(0.1)  # Slow joiner
+    for i in range(10):
+      pub.send(str(i))
+    time.sleep(0.1)
+
+    msgs = sub.receive_many(max_msgs=4)
+    self.assertEqual([bytes(m) for m in msgs], [b'0', b'1', b'2', b'3'])
+    self.assertEqual(sub.receive_many(contiguous=False), [str(i).encode('utf8') for i in range(4, 10)])
+    self.assertEqual(sub.receive_many(), [])
+
+    del pub
+    del sub
+    context.term()
+
+  def test_receive_latest(self):
+    context = messaging.Context()
+
+    pub = messaging.PubSocket()
+    pub.connect(context, 'controlsState')
+
+    sub = messaging.SubSocket()
+    sub.connect(context, 'controlsState')
+
+    time.sleep(0.1)  # Slow joiner
+    for i in range(10):
+      pub.send(str(i))
+    time.sleep(0.1)
+
+    self.assertEqual(b'9', sub.receive_latest())
+    self.assertIsNone(sub.receive_latest())
+
+    del pub
+    del sub
+    context.term()
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import cereal.messaging as messaging
+
+
+def thermal_msg(free_space, valid=True):
+  msg = messaging.new_message('thermal')
+  msg.valid = valid
+  msg.thermal.freeSpace = free_space
+  return msg
+
+
+class TestLazySubMaster(unittest.TestCase):
+  def test_update_raw_decodes_on_access(self):
+    sm = messaging.LazySubMaster(['thermal', 'health'], addr=None)
+    msg = thermal_msg(0.5, valid=False)
+
+    sm.update_raw(1., [(sm._idx['thermal'], msg.to_bytes())])
+    self.assertTrue(sm.updated['thermal'])
+    self.assertFalse(sm.updated['health'])
+    self.assertIsNotNone(sm._raw[sm._idx['thermal']])
+
+    # the header is read without decoding
+    self.assertEqual(sm.logMonoTime['thermal'], msg.logMonoTime)
+    self.assertFalse(sm.all_valid())
+    self.assertIsNotNone(sm._raw[sm._idx['thermal']])
+
+    self.assertAlmostEqual(sm['thermal'].freeSpace, 0.5)
+    self.assertIsNone(sm._raw[sm._idx['thermal']])
+
+  def test_event_header(self):
+    for valid in [True, False]:
+      for log_mono_time in [0, 1, 2**63 + 12345]:
+        msg = thermal_msg(0.5, valid=valid)
+        msg.logMonoTime = log_mono_time
+        self.assertEqual(messaging.event_header(msg.to_bytes()), (log_mono_time, valid))
+
+    # a message without a data section has the defaults
+    self.assertEqual(messaging.event_header(messaging.log.Event.new_message().to_bytes()), (0, True))
+
+  def test_matches_submaster(self):
+    services = ['thermal', 'health']
+    sm = messaging.SubMaster(services, addr=None)
+    lazy_sm = messaging.LazySubMaster(services, addr=None)
+
+    for t, msgs in [(1., [thermal_msg(0.1)]), (1.01, []), (10., [thermal_msg(0.2)])]:
+      sm.update_msgs(t, [m.as_reader() for m in msgs])
+      lazy_sm.update_raw(t, [(lazy_sm._idx['thermal'], m.to_bytes()) for m in msgs])
+
+      self.assertEqual(sm.frame, lazy_sm.frame)
+      for s in services:
+        self.assertEqual(sm.updated[s], lazy_sm.updated[s])
+        self.assertEqual(sm.rcv_time[s], lazy_sm.rcv_time[s])
+        self.assertEqual(sm.rcv_frame[s], lazy_sm.rcv_frame[s])
+        self.assertEqual(sm.alive[s], lazy_sm.alive[s])
+        self.assertEqual(sm.valid[s], lazy_sm.valid[s])
+        self.assertEqual(sm.logMonoTime[s], lazy_sm.logMonoTime[s])
+      self.assertAlmostEqual(sm['thermal'].freeSpace, lazy_sm['thermal'].freeSpace)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -9,3 +9,6 @@ else:
   PERSIST = os.path.join(BASEDIR, "persist")
   PARAMS = os.path.join(BASEDIR, "persist", "params")
 
+# allow isolated params, e.g. for running several process replays at once
+PARAMS = os.getenv("PARAMS_PATH", PARAMS)
+
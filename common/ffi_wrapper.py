@@ -1,8 +1,11 @@
 import os
 import sys
 import fcntl
+import shutil
 import hashlib
 import platform
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from cffi import FFI
 
 def suffix():
@@ -53,3 +56,29 @@ def wrap_compiled(name, directory):
   sys.path.append(directory)
   mod = __import__(name)
   return mod.ffi, mod.lib
+
+
+def dlopen_private(ffi, lib_fn):
+  """dlopen a private copy of a shared library. Its globals are not shared with other
+  copies, so solvers that keep their state in globals can run in parallel"""
+  fd, fn = tempfile.mkstemp(suffix=suffix())
+  try:
+    with os.fdopen(fd, 'wb') as dst, open(lib_fn, 'rb') as src:
+      shutil.copyfileobj(src, dst)
+    return ffi.dlopen(fn)
+  finally:
+    os.unlink(fn)
+
+
+def run_parallel(libs, n, fn):
+  """Splits the range n into one contiguous chunk per lib and calls fn(lib, start, end)
+  for each chunk in its own thread. cffi releases the GIL during calls."""
+  bounds = [n * i // len(libs) for i in range(len(libs) + 1)]
+  jobs = [(lib, lo, hi) for lib, lo, hi in zip(libs, bounds[:-1], bounds[1:]) if hi > lo]
+  if len(jobs) <= 1:
+    for job in jobs:
+      fn(*job)
+  else:
+    with ThreadPoolExecutor(len(jobs)) as pool:
+      for f in [pool.submit(fn, *job) for job in jobs]:
+        f.result()
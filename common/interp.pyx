@@ -0,0 +1,95 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+from libc.stdlib cimport malloc, free
+
+
+cdef inline Py_ssize_t search(double xv, const double *xp, Py_ssize_t n):
+  # index of the first breakpoint that is not below xv, xp must be increasing
+  cdef Py_ssize_t lo = 0, hi = n, mid
+  while lo < hi:
+    mid = (lo + hi) >> 1
+    if xv > xp[mid]:
+      lo = mid + 1
+    else:
+      hi = mid
+  return lo
+
+
+cdef double interp_seq(double xv, object xp, object fp, Py_ssize_t n) except? -1:
+  # only touches the breakpoints it needs, converting the whole table costs more for a single point
+  cdef Py_ssize_t lo = 0, hi = n, mid
+  cdef double x0, x1, f0, f1
+  while lo < hi:
+    mid = (lo + hi) >> 1
+    if xv > <double>xp[mid]:
+      lo = mid + 1
+    else:
+      hi = mid
+
+  if hi == n:
+    return fp[n - 1]
+  elif hi == 0:
+    return fp[0]
+  x0, x1, f0, f1 = xp[hi - 1], xp[hi], fp[hi - 1], fp[hi]
+  return (xv - x0) * (f1 - f0) / (x1 - x0) + f0
+
+
+def interp(x, xp, fp):
+  """Linear interpolation of x on the table xp, fp, which is clamped at both ends.
+
+  xp has to be increasing. Returns a float, or a list when x is iterable."""
+  cdef Py_ssize_t n = len(xp)
+  if n == 0 or len(fp) != n:
+    raise ValueError("xp and fp must be non empty and of the same length")
+  if not hasattr(x, '__iter__'):
+    return interp_seq(x, xp, fp, n)
+
+  cdef InterpTable table = InterpTable(xp, fp)
+  return [table.exact(xv) for xv in x]
+
+
+cdef class InterpTable:
+  """A compiled interp table, for tables that are used more than once. The breakpoints
+  are converted once, the result is bit for bit the one of interp.
+
+  table = InterpTable(xp, fp)
+  table(x) == interp(x, xp, fp)
+  """
+  cdef double *xp
+  cdef double *fp
+  cdef Py_ssize_t n
+
+  def __cinit__(self, xp, fp):
+    cdef Py_ssize_t i
+    self.n = len(xp)
+    if self.n == 0 or len(fp) != self.n:
+      raise ValueError("xp and fp must be non empty and of the same length")
+
+    self.xp = <double *>malloc(2 * self.n * sizeof(double))
+    if self.xp == NULL:
+      raise MemoryError()
+    self.fp = self.xp + self.n
+
+    for i in range(self.n):
+      self.xp[i] = xp[i]
+      self.fp[i] = fp[i]
+
+  def __dealloc__(self):
+    free(self.xp)
+
+  def __len__(self):
+    return self.n
+
+  cdef inline double exact(self, double xv):
+    # same expression as interp on a single point, a precomputed slope differs in the last bit
+    cdef Py_ssize_t hi = search(xv, self.xp, self.n)
+    if hi == self.n:
+      return self.fp[self.n - 1]
+    elif hi == 0:
+      return self.fp[0]
+    return (xv - self.xp[hi - 1]) * (self.fp[hi] - self.fp[hi - 1]) / (self.xp[hi] - self.xp[hi - 1]) + self.fp[hi - 1]
+
+  def __call__(self, x):
+    """Returns a float, or a list when x is iterable"""
+    if not hasattr(x, '__iter__'):
+      return self.exact(x)
+    return [self.exact(xv) for xv in x]
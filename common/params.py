@@ -19,17 +19,25 @@ before deleting the old <params_dir>/<d> directory.
 
 Writers that only modify a single key can simply take the lock, then swap the corresponding value
 file in place without messing with <params_dir>/d.
+
+Readers in the same process share an in-memory cache per params_dir. It is kept coherent with inotify:
+a watch on <params_dir> catches the <params_dir>/d symlink being swapped (which drops the whole cache),
+and a watch on the directory <params_dir>/d points to catches single keys being replaced.
 """
 import time
 import os
+import atexit
 import string
 import binascii
 import errno
 import sys
 import shutil
 import fcntl
+import struct
+import ctypes
 import tempfile
 import threading
+import traceback
 from enum import Enum
 from common.basedir import PARAMS
 
@@ -117,6 +125,17 @@ def fsync_dir(path):
     os.close(fd)
 
 
+def sync_files(dir_path, file_names):
+  """Make the given files in dir_path and dir_path itself durable"""
+  for name in file_names:
+    fd = os.open(os.path.join(dir_path, name), os.O_RDONLY)
+    try:
+      os.fsync(fd)
+    finally:
+      os.close(fd)
+  fsync_dir(dir_path)
+
+
 class FileLock():
   def __init__(self, path, create):
     self._path = path
@@ -204,9 +223,11 @@ class DBWriter(DBAccessor):
     super(DBWriter, self).__init__(path)
     self._lock = None
     self._prev_umask = None
+    self._changed = set()
 
   def put(self, key, value):
     self._vals[key] = value
+    self._changed.add(key)
 
   def delete(self, key):
     self._vals.pop(key, None)
@@ -250,15 +271,6 @@ class DBWriter(DBAccessor):
       tempdir_path = tempfile.mkdtemp(prefix=".tmp", dir=self._path)
 
       try:
-        # Write back all keys.
-        os.chmod(tempdir_path, 0o777)
-        for k, v in self._vals.items():
-          with open(os.path.join(tempdir_path, k), "wb") as f:
-            f.write(v)
-            f.flush()
-            os.fsync(f.fileno())
-        fsync_dir(tempdir_path)
-
         data_path = self._data_path()
         try:
           old_data_path = os.path.join(self._path, os.readlink(data_path))
@@ -267,6 +279,23 @@ class DBWriter(DBAccessor):
           #                 copies to be left behind, but we still want to overwrite.
           pass
 
+        # Write back all keys. Unchanged values are hard linked from the old data directory, they
+        # are already on disk. Everything written is made durable with a single barrier.
+        os.chmod(tempdir_path, 0o777)
+        written = []
+        for k, v in self._vals.items():
+          if k not in self._changed and old_data_path is not None:
+            try:
+              os.link(os.path.join(old_data_path, k), os.path.join(tempdir_path, k))
+              continue
+            except OSError:
+              pass
+
+          with open(os.path.join(tempdir_path, k), "wb") as f:
+            f.write(v)
+          written.append(k)
+        sync_files(tempdir_path, written)
+
         new_data_path = "{}.link".format(tempdir_path)
         os.symlink(os.path.basename(tempdir_path), new_data_path)
         os.rename(new_data_path, data_path)
@@ -277,6 +306,10 @@ class DBWriter(DBAccessor):
           os.readlink(data_path) == os.path.basename(tempdir_path))
 
         if success:
+          # the inotify event comes later, our own reads have to see the write right away
+          cache = _caches.get(self._path)
+          if cache is not None:
+            cache.invalidate_all()
           if old_data_path is not None:
             shutil.rmtree(old_data_path)
         else:
@@ -324,9 +357,174 @@ def write_db(params_path, key, value):
     os.umask(prev_umask)
     lock.release()
 
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_EVENT = struct.Struct("iIII")
+KEY_CHANGED_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+DB_CHANGED_MASK = IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+try:
+  _libc = ctypes.CDLL(None, use_errno=True)
+  _inotify_init1 = _libc.inotify_init1
+  _inotify_add_watch = _libc.inotify_add_watch
+  _inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+  _inotify_rm_watch = _libc.inotify_rm_watch
+  _inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+except (OSError, AttributeError):
+  # No inotify (e.g. macOS), params are always read from disk
+  _inotify_init1 = None
+
+
+class ParamsCache():
+  """Read-through cache of the values in one params_dir, invalidated by inotify events.
+
+  Invalidations bump a generation counter before dropping values, and a value read from disk
+  is only stored if no invalidation happened while it was being read.
+  """
+  def __init__(self, db):
+    self.db = db
+    self.enabled = True
+    self.hits = 0
+    self.misses = 0
+
+    self._vals = {}
+    self._gen = 0
+    self._lock = threading.Lock()
+    self._db_wd = None
+    self._data_wd = None
+
+    self._fd = _inotify_init1(IN_CLOEXEC)
+    if self._fd < 0:
+      raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    try:
+      self._db_wd = self._add_watch(self.db, DB_CHANGED_MASK)
+      self._watch_data_dir()
+    except OSError:
+      os.close(self._fd)
+      raise
+
+    self._thread = threading.Thread(target=self._watch_thread, name="params_cache")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _add_watch(self, path, mask):
+    wd = _inotify_add_watch(self._fd, path.encode('utf8'), mask)
+    if wd < 0:
+      raise OSError(ctypes.get_errno(), "inotify_add_watch failed", path)
+    return wd
+
+  def _watch_data_dir(self):
+    # Watch the new target of the d symlink first, then drop everything read through the old one.
+    old_wd = self._data_wd
+    self._data_wd = self._add_watch(os.path.realpath(os.path.join(self.db, "d")), KEY_CHANGED_MASK)
+    if old_wd is not None and old_wd != self._data_wd:
+      _inotify_rm_watch(self._fd, old_wd)
+    self.invalidate_all()
+
+  def _watch_thread(self):
+    while self.enabled:
+      try:
+        buf = os.read(self._fd, 4096)
+      except OSError:
+        self.disable()
+        break
+      self._handle_events(buf)
+    os.close(self._fd)
+
+  def _handle_events(self, buf):
+    i = 0
+    while i < len(buf):
+      wd, mask, _, name_len = INOTIFY_EVENT.unpack_from(buf, i)
+      name = buf[i + INOTIFY_EVENT.size:i + INOTIFY_EVENT.size + name_len].rstrip(b"\0").decode('utf8')
+      i += INOTIFY_EVENT.size + name_len
+
+      if mask & IN_Q_OVERFLOW:
+        self.invalidate_all()
+      elif wd == self._data_wd:
+        if mask & IN_IGNORED:
+          continue
+        self.invalidate(name)
+      elif wd == self._db_wd:
+        if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+          # params_dir itself is gone (clear_all), stop caching
+          self.disable()
+          return
+        if name == "d":
+          try:
+            self._watch_data_dir()
+          except OSError:
+            self.disable()
+            return
+
+  def invalidate(self, key):
+    with self._lock:
+      self._gen += 1
+      self._vals.pop(key, None)
+
+  def invalidate_all(self):
+    with self._lock:
+      self._gen += 1
+      self._vals = {}
+
+  def disable(self):
+    self.enabled = False
+    self.invalidate_all()
+    if _caches.get(self.db) is self:
+      del _caches[self.db]
+
+  def get(self, key):
+    try:
+      ret = self._vals[key]
+      self.hits += 1
+      return ret
+    except KeyError:
+      pass
+
+    self.misses += 1
+    gen = self._gen
+    ret = read_db(self.db, key)
+    with self._lock:
+      if self.enabled and gen == self._gen:
+        self._vals[key] = ret
+    return ret
+
+
+_caches = {}
+
+def _drop_caches():
+  for cache in list(_caches.values()):
+    cache.enabled = False
+  _caches.clear()
+
+if hasattr(os, "register_at_fork"):
+  # The watch thread does not survive a fork
+  os.register_at_fork(after_in_child=_drop_caches)
+
+def get_params_cache(db):
+  """Returns the process wide cache for params_dir db, or None if caching is not possible"""
+  cache = _caches.get(db)
+  if cache is None and _inotify_init1 is not None and os.path.isdir(os.path.join(db, "d")):
+    try:
+      cache = _caches[db] = ParamsCache(db)
+    except OSError:
+      cache = None
+  return cache
+
+
 class Params():
-  def __init__(self, db=PARAMS):
+  def __init__(self, db=PARAMS, cache=True):
     self.db = db
+    self.cache = cache
 
     # create the database if it doesn't exist...
     if not os.path.exists(self.db+"/d"):
@@ -334,10 +532,18 @@ class Params():
         pass
 
   def clear_all(self):
+    cache = _caches.get(self.db)
+    if cache is not None:
+      cache.disable()
     shutil.rmtree(self.db, ignore_errors=True)
     with self.transaction(write=True):
       pass
 
+  def _invalidate(self, key):
+    cache = _caches.get(self.db)
+    if cache is not None:
+      cache.invalidate(key)
+
   def transaction(self, write=False):
     if write:
       return DBWriter(self.db)
@@ -360,12 +566,38 @@ class Params():
     with self.transaction(write=True) as txn:
       txn.delete(key)
 
+  def put_many(self, entries):
+    """
+    Writes (or deletes, for None values) several keys in one transaction. The new values become
+    visible atomically with a single directory swap.
+    """
+    if not entries:
+      return
+
+    for key in entries:
+      if key not in keys:
+        raise UnknownKeyName(key)
+
+    with self.transaction(write=True) as txn:
+      for key, dat in entries.items():
+        if dat is None:
+          txn.delete(key)
+        else:
+          if isinstance(dat, str):
+            dat = dat.encode('utf8')
+          txn.put(key, dat)
+
   def get(self, key, block=False, encoding=None):
     if key not in keys:
       raise UnknownKeyName(key)
 
+    cache = get_params_cache(self.db) if self.cache else None
+
     while 1:
-      ret = read_db(self.db, key)
+      if cache is not None and cache.enabled:
+        ret = cache.get(key)
+      else:
+        ret = read_db(self.db, key)
       if not block or ret is not None:
         break
       # is polling really the best we can do?
@@ -389,16 +621,108 @@ class Params():
       raise UnknownKeyName(key)
 
     write_db(self.db, key, dat)
+    self._invalidate(key)
 
 
-def put_nonblocking(key, val):
-  def f(key, val):
-    params = Params()
-    params.put(key, val)
+class ParamsWriter():
+  """
+  Writes params from a single long lived background thread. Writes to a key that is still pending
+  are coalesced, only the latest value gets written. Pending writes are flushed at exit.
+  """
+  def __init__(self, db=PARAMS, max_pending=len(keys)):
+    self.db = db
+    self.max_pending = max_pending
 
-  t = threading.Thread(target=f, args=(key, val))
-  t.start()
-  return t
+    # stats
+    self.writes = 0
+    self.errors = 0
+    self.coalesced = 0
+    self.last_write_time = 0.
+    self.max_write_time = 0.
+    self.total_write_time = 0.
+
+    self._pending = {}
+    self._writing = False
+    self._cv = threading.Condition()
+    self._thread = None
+
+  @property
+  def queue_depth(self):
+    return len(self._pending) + int(self._writing)
+
+  def put(self, key, dat):
+    if key not in keys:
+      raise UnknownKeyName(key)
+
+    with self._cv:
+      if key in self._pending:
+        # move to the back of the queue with the latest value
+        del self._pending[key]
+        self.coalesced += 1
+      else:
+        self._cv.wait_for(lambda: len(self._pending) < self.max_pending)
+      self._pending[key] = dat
+
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._writer_thread, name="params_writer")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.flush, 5.)
+      self._cv.notify_all()
+
+  def flush(self, timeout=None):
+    """Blocks until all pending writes are on disk. Returns False on timeout."""
+    with self._cv:
+      return self._cv.wait_for(lambda: not self._pending and not self._writing, timeout)
+
+  def _writer_thread(self):
+    params = Params(self.db)
+    while True:
+      with self._cv:
+        self._cv.wait_for(lambda: self._pending)
+        key = next(iter(self._pending))
+        dat = self._pending.pop(key)
+        self._writing = True
+        self._cv.notify_all()
+
+      t = time.monotonic()
+      try:
+        params.put(key, dat)
+      except Exception:
+        # keep the writer alive for the other keys
+        self.errors += 1
+        traceback.print_exc()
+
+      dt = time.monotonic() - t
+      with self._cv:
+        self._writing = False
+        self.writes += 1
+        self.last_write_time = dt
+        self.max_write_time = max(self.max_write_time, dt)
+        self.total_write_time += dt
+        self._cv.notify_all()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def _drop_writer():
+  global _writer
+  _writer = None
+
+if hasattr(os, "register_at_fork"):
+  # The writer thread does not survive a fork
+  os.register_at_fork(after_in_child=_drop_writer)
+
+def get_params_writer():
+  global _writer
+  with _writer_lock:
+    if _writer is None:
+      _writer = ParamsWriter()
+    return _writer
+
+def put_nonblocking(key, val):
+  get_params_writer().put(key, val)
 
 
 if __name__ == "__main__":
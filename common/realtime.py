@@ -7,6 +7,7 @@ import multiprocessing
 from cffi import FFI
 
 from common.common_pyx import sec_since_boot  # pylint: disable=no-name-in-module, import-error
+from common.tracing import counter
 
 
 # time step for each process
@@ -66,6 +67,7 @@ class Ratekeeper():
     lagged = False
     remaining = self._next_frame_time - sec_since_boot()
     self._next_frame_time += self._interval
+    counter("lag_ms", -remaining * 1000)
     if self._print_delay_threshold is not None and remaining < -self._print_delay_threshold:
       print("%s lagging by %.2f ms" % (self._process_name, -remaining * 1000))
       lagged = True
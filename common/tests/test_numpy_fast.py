@@ -0,0 +1,64 @@
+import unittest
+import numpy as np
+
+from common.numpy_fast import interp, InterpTable
+
+
+def ref_interp(x, xp, fp):
+  # the pure python version that the compiled one replaced
+  N = len(xp)
+  def get_interp(xv):
+    hi = 0
+    while hi < N and xv > xp[hi]:
+      hi += 1
+    low = hi - 1
+    return fp[-1] if hi == N and xv > xp[low] else (
+      fp[0] if hi == 0 else
+      (xv - xp[low]) * (fp[hi] - fp[low]) / (xp[hi] - xp[low]) + fp[low])
+  return [get_interp(v) for v in x] if hasattr(
+    x, '__iter__') else get_interp(x)
+
+
+class TestInterp(unittest.TestCase):
+  def test_matches_reference(self):
+    np.random.seed(0)
+    for n in [1, 2, 3, 5, 10, 50]:
+      for _ in range(20):
+        xp = np.sort(np.random.uniform(-10., 10., n))
+        if n > 3:
+          xp[2] = xp[1]  # repeated breakpoint
+        fp = np.random.uniform(-5., 5., n)
+        x = np.concatenate([np.random.uniform(-12., 12., 50), xp])
+        xp, fp = xp.tolist(), fp.tolist()
+        table = InterpTable(xp, fp)
+
+        for xv in x:
+          expected = ref_interp(xv, xp, fp)
+          self.assertEqual(interp(xv, xp, fp), expected)
+          self.assertEqual(table(xv), expected)
+        self.assertEqual(interp(x, xp, fp), ref_interp(x, xp, fp))
+        self.assertEqual(table(x), ref_interp(x, xp, fp))
+
+  def test_controls_tables(self):
+    # process replay compares the outputs exactly, the tables have to match interp bit for bit
+    from selfdrive.controls.lib import planner
+    x = np.linspace(-5., 50., 10001).tolist()
+    for table, bp, v in [(planner._A_CRUISE_MIN, planner._A_CRUISE_MIN_BP, planner._A_CRUISE_MIN_V),
+                         (planner._A_CRUISE_MAX, planner._A_CRUISE_MAX_BP, planner._A_CRUISE_MAX_V),
+                         (planner._A_CRUISE_MAX_FOLLOWING, planner._A_CRUISE_MAX_BP, planner._A_CRUISE_MAX_V_FOLLOWING),
+                         (planner._A_TOTAL_MAX, planner._A_TOTAL_MAX_BP, planner._A_TOTAL_MAX_V)]:
+      self.assertEqual([table(xv) for xv in x], ref_interp(x, bp, v))
+
+  def test_inputs(self):
+    self.assertEqual(interp(1.5, (0, 1, 2), np.array([0., 10., 30.])), 20.)
+    self.assertEqual(interp(np.float32(-1.), [0, 1], [3, 4]), 3.)
+    self.assertEqual(interp(float('nan'), [0, 1], [3, 4]), 3.)
+    self.assertEqual(len(InterpTable([0, 1], [3, 4])), 2)
+    with self.assertRaises(ValueError):
+      interp(0., [], [])
+    with self.assertRaises(ValueError):
+      InterpTable([0., 1.], [0.])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,163 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import common.params as params
+from common.params import Params
+
+
+class TestParams(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.params = Params(self.tmpdir)
+
+  def tearDown(self):
+    self.params.clear_all()
+    shutil.rmtree(self.tmpdir)
+
+  def wait_for_cache(self, key, val):
+    for _ in range(100):
+      if self.params.get(key) == val:
+        break
+      time.sleep(0.01)
+    self.assertEqual(self.params.get(key), val)
+
+  def test_params_put_and_get(self):
+    self.params.put("DongleId", "cb38263377b873ee")
+    self.assertEqual(self.params.get("DongleId"), b"cb38263377b873ee")
+    self.assertEqual(self.params.get("DongleId", encoding='utf8'), "cb38263377b873ee")
+
+  def test_params_unknown_key(self):
+    with self.assertRaises(params.UnknownKeyName):
+      self.params.get("swag")
+
+  def test_params_delete(self):
+    self.params.put("CarParams", "test")
+    self.params.delete("CarParams")
+    self.assertIsNone(self.params.get("CarParams"))
+
+  def test_params_manager_start(self):
+    self.params.put("CarParams", "test")
+    self.params.put("DongleId", "cb38263377b873ee")
+    self.params.manager_start()
+    self.assertIsNone(self.params.get("CarParams"))
+    self.assertEqual(self.params.get("DongleId"), b"cb38263377b873ee")
+
+  def test_params_put_many(self):
+    self.params.put("DongleId", "cb38263377b873ee")
+    self.params.put("CarParams", "test")
+    self.params.put_many({"IsMetric": "1", "IsRHD": b"0", "CarParams": None})
+    self.assertEqual(self.params.get("IsMetric"), b"1")
+    self.assertEqual(self.params.get("IsRHD"), b"0")
+    self.assertIsNone(self.params.get("CarParams"))
+    self.assertEqual(self.params.get("DongleId"), b"cb38263377b873ee")
+
+    with self.assertRaises(params.UnknownKeyName):
+      self.params.put_many({"IsMetric": "0", "swag": "1"})
+    self.assertEqual(self.params.get("IsMetric"), b"1")
+
+  def test_put_many_is_atomic(self):
+    keys = ["IsMetric", "IsRHD", "IsLdwEnabled", "IsGeofenceEnabled", "RecordFront"]
+    n = 50
+
+    def write():
+      for i in range(n):
+        self.params.put_many({k: str(i) for k in keys})
+    writer = threading.Thread(target=write)
+    writer.start()
+
+    # a reader that resolves d once sees all keys of one put_many, or none of them
+    snapshots = set()
+    while writer.is_alive():
+      data_path = os.path.realpath(os.path.join(self.tmpdir, "d"))
+      try:
+        vals = tuple(open(os.path.join(data_path, k), "rb").read() for k in keys)
+      except FileNotFoundError:
+        # already replaced and removed, or before the first write
+        continue
+      self.assertEqual(len(set(vals)), 1, vals)
+      snapshots.add(vals[0])
+    writer.join()
+
+    self.assertGreater(len(snapshots), 1)
+    for k in keys:
+      self.assertEqual(self.params.get(k), str(n - 1).encode('utf8'))
+
+  def test_put_many_empty(self):
+    data_path = os.path.realpath(os.path.join(self.tmpdir, "d"))
+    self.params.put_many({})
+    self.assertEqual(os.path.realpath(os.path.join(self.tmpdir, "d")), data_path)
+
+  def test_params_writer_coalesces(self):
+    writer = params.ParamsWriter(self.tmpdir)
+
+    # holding the condition keeps the writer thread from taking anything off the queue
+    with writer._cv:
+      for i in range(10):
+        writer.put("IsRHD", str(i))
+      writer.put("IsMetric", "1")
+      self.assertEqual(writer.queue_depth, 2)
+      self.assertEqual(writer.coalesced, 9)
+
+    self.assertTrue(writer.flush(5.))
+    self.assertEqual(writer.queue_depth, 0)
+    self.assertEqual(writer.writes, 2)
+    self.assertEqual(self.params.get("IsRHD"), b"9")
+    self.assertEqual(self.params.get("IsMetric"), b"1")
+
+    with self.assertRaises(params.UnknownKeyName):
+      writer.put("swag", "1")
+
+  def test_cache_sees_external_writes(self):
+    if params.get_params_cache(self.tmpdir) is None:
+      raise unittest.SkipTest("inotify not available")
+
+    self.assertIsNone(self.params.get("DongleId"))
+
+    # single key swap in place
+    params.write_db(self.tmpdir, "DongleId", "a")
+    self.wait_for_cache("DongleId", b"a")
+
+  def test_cache_sees_own_transactions(self):
+    cache = params.get_params_cache(self.tmpdir)
+    if cache is None:
+      raise unittest.SkipTest("inotify not available")
+
+    # only the writes of this process invalidate the cache
+    cache._handle_events = lambda buf: None
+    self.assertIsNone(self.params.get("DongleId"))
+
+    # whole directory swap through the d symlink, visible before the inotify event arrives
+    with self.params.transaction(write=True) as txn:
+      txn.put("DongleId", b"b")
+    self.assertEqual(self.params.get("DongleId"), b"b")
+
+    with self.params.transaction(write=True) as txn:
+      txn.delete("DongleId")
+    self.assertIsNone(self.params.get("DongleId"))
+
+  def test_cached_get_skips_read(self):
+    if params.get_params_cache(self.tmpdir) is None:
+      raise unittest.SkipTest("inotify not available")
+
+    self.params.put("DongleId", "cb38263377b873ee")
+    self.assertEqual(self.params.get("DongleId"), b"cb38263377b873ee")
+
+    # once cached, a get does not touch the params dir
+    uncached = Params(self.tmpdir, cache=False)
+    with mock.patch.object(params, "read_db", wraps=params.read_db) as read_db, \
+         mock.patch("builtins.open", side_effect=AssertionError("cached get opened a file")):
+      for _ in range(10):
+        self.assertEqual(self.params.get("DongleId"), b"cb38263377b873ee")
+      read_db.assert_not_called()
+    with mock.patch.object(params, "read_db", wraps=params.read_db) as read_db:
+      self.assertEqual(uncached.get("DongleId"), b"cb38263377b873ee")
+      read_db.assert_called_once_with(self.tmpdir, "DongleId")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,106 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import common.tracing as tracing
+from common.tracing import KIND_SPAN, KIND_COUNTER, TraceRing, read_ring, trace, counter
+from selfdrive.debug.trace_dump import build_stacks, summarize, chrome_trace
+
+
+class TestTracing(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.trace_dir = tracing.TRACE_DIR
+    tracing.TRACE_DIR = self.tmpdir
+    tracing._drop_ring()
+
+  def tearDown(self):
+    tracing.set_enabled(False)
+    tracing._close_ring()
+    tracing.TRACE_DIR = self.trace_dir
+    shutil.rmtree(self.tmpdir)
+
+  def test_disabled(self):
+    tracing.set_enabled(False)
+    with trace("foo"):
+      counter("bar", 1.)
+    self.assertEqual(os.listdir(self.tmpdir), [])
+
+  def test_disabled_null_span(self):
+    # disabled tracing hands out one shared no-op span instead of allocating
+    tracing.set_enabled(False)
+    self.assertIs(trace("foo"), tracing._NULL_SPAN)
+    self.assertIs(trace("bar"), tracing._NULL_SPAN)
+
+  def test_spans_and_counters(self):
+    tracing.set_enabled(True)
+    with trace("outer"):
+      with trace("inner"):
+        counter("lag_ms", 2.5)
+      with trace("inner"):
+        pass
+
+    rings = os.listdir(self.tmpdir)
+    self.assertEqual(len(rings), 1)
+    process_name, pid, records = read_ring(os.path.join(self.tmpdir, rings[0]))
+    self.assertEqual(pid, os.getpid())
+    self.assertEqual(process_name, "MainProcess")
+    self.assertEqual([(r[0], r[1]) for r in records],
+                     [(KIND_COUNTER, "lag_ms"), (KIND_SPAN, "inner"), (KIND_SPAN, "inner"), (KIND_SPAN, "outer")])
+    self.assertEqual(records[0][4], 2.5)
+
+    stacks = build_stacks(process_name, records)
+    self.assertEqual(sorted(s[0] for s in stacks),
+                     [("MainProcess", "outer"), ("MainProcess", "outer", "inner"), ("MainProcess", "outer", "inner")])
+    outer = [s for s in stacks if s[0] == ("MainProcess", "outer")][0]
+    inner = sum(s[1] for s in stacks if s[0][-1] == "inner")
+    self.assertEqual(outer[2], outer[1] - inner)
+
+    stats = summarize([(process_name, pid, records)])
+    self.assertEqual(stats[("MainProcess", "outer", "inner")][0], 2)
+
+    events = chrome_trace([(process_name, pid, records)])["traceEvents"]
+    self.assertEqual(sorted(e["ph"] for e in events), ["C", "M", "X", "X", "X"])
+
+  def test_ring_removed_at_exit(self):
+    tracing.set_enabled(True)
+    with trace("foo"):
+      pass
+    self.assertEqual(len(os.listdir(self.tmpdir)), 1)
+    tracing._close_ring()
+    self.assertEqual(os.listdir(self.tmpdir), [])
+
+  def test_stale_rings_removed(self):
+    proc = subprocess.Popen(["true"])
+    proc.wait()
+    TraceRing(os.path.join(self.tmpdir, "dead.%d" % proc.pid), "dead", capacity=16).close()
+    TraceRing(os.path.join(self.tmpdir, "alive.1"), "alive", capacity=16).close()
+
+    tracing.set_enabled(True)
+    counter("foo", 1.)
+    self.assertEqual(sorted(os.listdir(self.tmpdir)), sorted(["alive.1", "MainProcess.%d" % os.getpid()]))
+
+  def test_ring_wraps(self):
+    path = os.path.join(self.tmpdir, "test.1")
+    ring = TraceRing(path, "test", capacity=16)
+    name_id = ring.name_id("foo")
+    for i in range(40):
+      ring.write(KIND_COUNTER, name_id, i, 0, float(i))
+    ring.close()
+
+    _, pid, records = read_ring(path)
+    self.assertEqual(pid, 1)
+    self.assertEqual([r[4] for r in records], [float(i) for i in range(24, 40)])
+
+  def test_name_overflow(self):
+    ring = TraceRing(os.path.join(self.tmpdir, "test.1"), "test", capacity=16)
+    ids = [ring.name_id("name%d" % i) for i in range(tracing.MAX_NAMES + 10)]
+    self.assertEqual(ids[:tracing.MAX_NAMES - 1], list(range(tracing.MAX_NAMES - 1)))
+    self.assertTrue(all(i == tracing.MAX_NAMES - 1 for i in ids[tracing.MAX_NAMES - 1:]))
+    ring.close()
+
+
+if __name__ == "__main__":
+  unittest.main()
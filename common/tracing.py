@@ -0,0 +1,268 @@
+"""Low overhead tracing of spans and counters.
+
+  from common.tracing import trace, counter
+
+  with trace("stateControl"):
+    ...
+  counter("lag_ms", lag)
+
+Tracing is off unless the TRACE environment variable is set; when off trace() hands out a shared
+no-op context manager, so spans can stay in the control loops permanently.
+
+When on, every process writes into its own ring of fixed size records in shared memory,
+<TRACE_DIR>/<process name>.<pid>. The ring is removed when the process exits, and rings left behind
+by processes that died are removed when the next ring is created, so dump the rings while the
+processes run. There is a single ring per process, records are claimed with an atomic sequence
+counter and each record carries its sequence number, which is written last. Readers
+(selfdrive/debug/trace_dump.py) never lock: a record is only accepted if its sequence number matches
+the slot before and after reading it. Timestamps are CLOCK_MONOTONIC in ns, so rings of different
+processes share a time base.
+
+Ring layout:
+  header   magic, version, capacity, max names, write index, process name
+  names    max names x NAME_SIZE bytes, the id of a name is its slot
+  records  capacity x RECORD_SIZE bytes
+"""
+import os
+import mmap
+import atexit
+import struct
+import threading
+import itertools
+import multiprocessing
+from time import monotonic_ns
+
+TRACE_DIR = os.getenv("TRACE_DIR", "/dev/shm/optrace")
+TRACE_CAPACITY = int(os.getenv("TRACE_CAPACITY", "65536"))
+
+MAGIC = b"OPTR"
+VERSION = 1
+MAX_NAMES = 1024
+NAME_SIZE = 64
+
+KIND_SPAN = 0
+KIND_COUNTER = 1
+
+_HEADER = struct.Struct("<4sIIIQ32s")
+_WRITE_IDX = struct.Struct("<Q")
+_WRITE_IDX_OFFSET = 16
+_NAME = struct.Struct("<%ds" % NAME_SIZE)
+# seq is written last, zero marks a slot that was never written
+_SEQ = struct.Struct("<Q")
+_PAYLOAD = struct.Struct("<QqdIHBx")
+RECORD_SIZE = _SEQ.size + _PAYLOAD.size
+
+HEADER_SIZE = 64
+NAMES_OFFSET = HEADER_SIZE
+RECORDS_OFFSET = NAMES_OFFSET + MAX_NAMES * NAME_SIZE
+
+OVERFLOW_NAME = "(other)"
+
+
+class _NullSpan():
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    return False
+
+
+class _Span():
+  __slots__ = ('ring', 'name_id', 'start')
+
+  def __init__(self, ring, name_id):
+    self.ring = ring
+    self.name_id = name_id
+
+  def __enter__(self):
+    self.start = monotonic_ns()
+    return self
+
+  def __exit__(self, *args):
+    start = self.start
+    self.ring.write(KIND_SPAN, self.name_id, start, monotonic_ns() - start, 0.)
+    return False
+
+
+class TraceRing():
+  """Writer side of a process' trace ring"""
+  def __init__(self, path, process_name, capacity=TRACE_CAPACITY):
+    self.path = path
+    self.capacity = capacity
+
+    size = RECORDS_OFFSET + capacity * RECORD_SIZE
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+      os.ftruncate(fd, size)
+      self.buf = mmap.mmap(fd, size)
+    finally:
+      os.close(fd)
+
+    _HEADER.pack_into(self.buf, 0, MAGIC, VERSION, capacity, MAX_NAMES, 0, process_name.encode('utf8')[:32])
+
+    self._seq = itertools.count(1)
+    self._names = {}
+    self._names_lock = threading.Lock()
+
+  def name_id(self, name):
+    name_id = self._names.get(name)
+    if name_id is None:
+      with self._names_lock:
+        name_id = self._names.get(name)
+        if name_id is None:
+          name_id = len(self._names)
+          label = name
+          if name_id >= MAX_NAMES - 1:
+            # the last slot is shared by everything that does not fit
+            name_id = MAX_NAMES - 1
+            label = OVERFLOW_NAME
+          _NAME.pack_into(self.buf, NAMES_OFFSET + name_id * NAME_SIZE, label.encode('utf8')[:NAME_SIZE])
+          self._names[name] = name_id
+    return name_id
+
+  def write(self, kind, name_id, start_ns, dur_ns, value):
+    seq = next(self._seq)
+    offset = RECORDS_OFFSET + ((seq - 1) % self.capacity) * RECORD_SIZE
+    _SEQ.pack_into(self.buf, offset, 0)
+    _PAYLOAD.pack_into(self.buf, offset + _SEQ.size, start_ns, dur_ns, value, threading.get_ident() & 0xffffffff,
+                       name_id, kind)
+    _SEQ.pack_into(self.buf, offset, seq)
+    _WRITE_IDX.pack_into(self.buf, _WRITE_IDX_OFFSET, seq)
+
+  def close(self):
+    self.buf.close()
+
+
+_enabled = os.getenv("TRACE") is not None
+_ring = None
+_ring_lock = threading.Lock()
+_NULL_SPAN = _NullSpan()
+
+
+def _drop_ring():
+  global _ring
+  # the child has a new pid and gets its own ring on first use
+  _ring = None
+
+if hasattr(os, "register_at_fork"):
+  os.register_at_fork(after_in_child=_drop_ring)
+
+
+def _close_ring():
+  global _ring
+  ring, _ring = _ring, None
+  if ring is not None:
+    ring.close()
+    try:
+      os.unlink(ring.path)
+    except OSError:
+      pass
+
+atexit.register(_close_ring)
+
+
+def _pid_alive(pid):
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+
+def remove_stale_rings(trace_dir=TRACE_DIR):
+  """Removes the rings of processes that are not running anymore"""
+  for path in list_rings(trace_dir):
+    try:
+      pid = int(path.rsplit('.', 1)[-1])
+    except ValueError:
+      continue
+    if not _pid_alive(pid):
+      try:
+        os.unlink(path)
+      except OSError:
+        pass
+
+
+def get_ring():
+  """Returns the ring of this process, creating it on first use"""
+  global _ring
+  if _ring is None:
+    with _ring_lock:
+      if _ring is None:
+        name = multiprocessing.current_process().name
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        remove_stale_rings(TRACE_DIR)
+        _ring = TraceRing(os.path.join(TRACE_DIR, "%s.%d" % (name, os.getpid())), name)
+  return _ring
+
+
+def set_enabled(enabled):
+  global _enabled
+  _enabled = enabled
+
+
+def trace(name):
+  """Context manager recording a span named name"""
+  if not _enabled:
+    return _NULL_SPAN
+  ring = get_ring()
+  return _Span(ring, ring.name_id(name))
+
+
+def record_span(name, start_ns, dur_ns):
+  """Records a span that was timed by the caller, with monotonic_ns"""
+  if not _enabled:
+    return
+  ring = get_ring()
+  ring.write(KIND_SPAN, ring.name_id(name), start_ns, dur_ns, 0.)
+
+
+def counter(name, value):
+  """Records the value of a counter named name"""
+  if not _enabled:
+    return
+  ring = get_ring()
+  ring.write(KIND_COUNTER, ring.name_id(name), monotonic_ns(), 0, value)
+
+
+def read_ring(path):
+  """Reads the valid records of a ring, oldest first.
+
+  Returns (process name, pid, records) where records is a list of
+  (kind, name, start_ns, dur_ns, value, tid)."""
+  with open(path, 'rb') as f:
+    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  try:
+    magic, version, capacity, max_names, write_idx, process_name = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError("%s is not a trace ring" % path)
+
+    names = []
+    for i in range(max_names):
+      names.append(_NAME.unpack_from(buf, NAMES_OFFSET + i * NAME_SIZE)[0].rstrip(b'\0').decode('utf8', 'replace'))
+
+    records = []
+    for seq in range(max(write_idx - capacity, 0) + 1, write_idx + 1):
+      offset = RECORDS_OFFSET + ((seq - 1) % capacity) * RECORD_SIZE
+      if _SEQ.unpack_from(buf, offset)[0] != seq:
+        continue
+      start_ns, dur_ns, value, tid, name_id, kind = _PAYLOAD.unpack_from(buf, offset + _SEQ.size)
+      # the writer may have lapped us while reading
+      if _SEQ.unpack_from(buf, offset)[0] != seq:
+        continue
+      records.append((kind, names[name_id], start_ns, dur_ns, value, tid))
+  finally:
+    buf.close()
+
+  pid = int(path.rsplit('.', 1)[-1])
+  return process_name.rstrip(b'\0').decode('utf8', 'replace'), pid, records
+
+
+def list_rings(trace_dir=TRACE_DIR):
+  if not os.path.isdir(trace_dir):
+    return []
+  return sorted(os.path.join(trace_dir, f) for f in os.listdir(trace_dir))
@@ -4,7 +4,17 @@ import os
 import sys
 from panda.tests.safety import libpandasafety_py
 from panda.tests.safety_replay.helpers import package_can_msg, init_segment
-from tools.lib.logreader import LogReader  # pylint: disable=import-error
+
+try:
+  # within openpilot, only the can and sendcan msgs are decoded, through the log index
+  from selfdrive.loggerd.logreader import LogReader
+  LOG_SERVICES = {"services": ["can", "sendcan"]}
+except ImportError:
+  from tools.lib.logreader import LogReader  # pylint: disable=import-error
+  LOG_SERVICES = {}
+
+def load_drive(fn):
+  return LogReader(fn, **LOG_SERVICES)
 
 # replay a drive to check for safety violations
 def replay_drive(lr, safety_mode, param):
@@ -67,7 +77,7 @@ def replay_drive(lr, safety_mode, param):
 if __name__ == "__main__":
   mode = int(sys.argv[2])
   param = 0 if len(sys.argv) < 4 else int(sys.argv[3])
-  lr = LogReader(sys.argv[1])
+  lr = load_drive(sys.argv[1])
 
   print("replaying drive %s with safety mode %d and param %d" % (sys.argv[1], mode, param))
 
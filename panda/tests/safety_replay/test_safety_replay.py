@@ -4,8 +4,7 @@ import os
 import requests
 
 from panda import Panda
-from replay_drive import replay_drive
-from tools.lib.logreader import LogReader  # pylint: disable=import-error
+from replay_drive import replay_drive, load_drive
 
 BASE_URL = "https://commadataci.blob.core.windows.net/openpilotci/"
 
@@ -30,7 +29,7 @@ if __name__ == "__main__":
 
   failed = []
   for route, mode, param in logs:
-    lr = LogReader(route)
+    lr = load_drive(route)
 
     print("\nreplaying %s with safety mode %d and param %s" % (route, mode, param))
     if not replay_drive(lr, mode, int(param)):
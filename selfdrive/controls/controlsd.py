@@ -1,11 +1,9 @@
 #!/usr/bin/env python3
 import os
 import gc
-import capnp
 from cereal import car, log
 from common.numpy_fast import clip
 from common.realtime import sec_since_boot, set_realtime_priority, Ratekeeper, DT_CTRL
-from common.profiler import Profiler
 from common.params import Params
 import cereal.messaging as messaging
 from selfdrive.config import Conversions as CV
@@ -22,6 +20,7 @@ from selfdrive.controls.lib.latcontrol_pid import LatControlPID
 from selfdrive.controls.lib.latcontrol_indi import LatControlINDI
 from selfdrive.controls.lib.latcontrol_lqr import LatControlLQR
 from selfdrive.controls.lib.alertmanager import AlertManager
+from selfdrive.controls.lib.latency_tracker import LatencyTracker
 from selfdrive.controls.lib.vehicle_model import VehicleModel
 from selfdrive.controls.lib.planner import LON_MPC_STEP
 from selfdrive.locationd.calibration_helpers import Calibration, Filter
@@ -55,23 +54,26 @@ def isEnabled(state):
   """Check if openpilot is engaged"""
   return (isActive(state) or state == State.preEnabled)
 
-def events_to_bytes(events):
-  # optimization when comparing capnp structs: str() or tree traverse are much slower
-  ret = []
+EVENT_TYPES = [t for t in car.CarEvent.schema.non_union_fields if t != 'name']
+EVENT_BITS = len(EVENT_TYPES) + 1
+
+def events_to_bitset(events):
+  """Encode events as an int with a bit per event name and per (name, type),
+  comparing two of them is much cheaper than serializing the capnp structs"""
+  bits = 0
   for e in events:
-    if isinstance(e, capnp.lib.capnp._DynamicStructReader):
-      e = e.as_builder()
-    if not e.is_root:
-      e = e.copy()
-    ret.append(e.to_bytes())
-  return ret
+    base = e.name.raw * EVENT_BITS
+    bits |= 1 << base
+    for i, t in enumerate(EVENT_TYPES, 1):
+      if getattr(e, t):
+        bits |= 1 << (base + i)
+  return bits
 
 
-def data_sample(CI, CC, sm, can_sock, state, mismatch_counter, can_error_counter, params):
+def data_sample(CI, CC, sm, can_strs, state, mismatch_counter, can_error_counter, params):
   """Receive data from sockets and create events for battery, temperature and disk space"""
 
   # Update carstate from CAN and create events
-  can_strs = messaging.drain_sock_raw(can_sock, wait_for_one=True)
   CS = CI.update(CC, can_strs)
 
   sm.update(0)
@@ -406,8 +408,8 @@ def data_send(sm, pm, CS, CI, CP, VM, state, events, actuators, v_cruise_kph, rk
   pm.send('carState', cs_send)
 
   # carEvents - logged every second or on change
-  events_bytes = events_to_bytes(events)
-  if (sm.frame % int(1. / DT_CTRL) == 0) or (events_bytes != events_prev):
+  events_bits = events_to_bitset(events)
+  if (sm.frame % int(1. / DT_CTRL) == 0) or (events_bits != events_prev):
     ce_send = messaging.new_message('carEvents', len(events))
     ce_send.carEvents = events
     pm.send('carEvents', ce_send)
@@ -424,110 +426,118 @@ def data_send(sm, pm, CS, CI, CP, VM, state, events, actuators, v_cruise_kph, rk
   cc_send.carControl = CC
   pm.send('carControl', cc_send)
 
-  return CC, events_bytes
-
-
-def controlsd_thread(sm=None, pm=None, can_sock=None):
-  gc.disable()
-
-  # start the loop
-  set_realtime_priority(3)
-
-  params = Params()
-
-  is_metric = params.get("IsMetric", encoding='utf8') == "1"
-  is_ldw_enabled = params.get("IsLdwEnabled", encoding='utf8') == "1"
-  passive = params.get("Passive", encoding='utf8') == "1"
-  openpilot_enabled_toggle = params.get("OpenpilotEnabledToggle", encoding='utf8') == "1"
-  community_feature_toggle = params.get("CommunityFeaturesToggle", encoding='utf8') == "1"
-
-  passive = passive or not openpilot_enabled_toggle
-
-  # Pub/Sub Sockets
-  if pm is None:
-    pm = messaging.PubMaster(['sendcan', 'controlsState', 'carState', 'carControl', 'carEvents', 'carParams'])
-
-  if sm is None:
-    sm = messaging.SubMaster(['thermal', 'health', 'liveCalibration', 'dMonitoringState', 'plan', 'pathPlan', \
-                              'model'])
-
-
-  if can_sock is None:
-    can_timeout = None if os.environ.get('NO_CAN_TIMEOUT', False) else 100
-    can_sock = messaging.sub_sock('can', timeout=can_timeout)
-
-  # wait for health and CAN packets
-  hw_type = messaging.recv_one(sm.sock['health']).health.hwType
-  has_relay = hw_type in [HwType.blackPanda, HwType.uno]
-  print("Waiting for CAN messages...")
-  messaging.get_one_can(can_sock)
-
-  CI, CP = get_car(can_sock, pm.sock['sendcan'], has_relay)
-
-  car_recognized = CP.carName != 'mock'
-  # If stock camera is disconnected, we loaded car controls and it's not chffrplus
-  controller_available = CP.enableCamera and CI.CC is not None and not passive
-  community_feature_disallowed = CP.communityFeature and not community_feature_toggle
-  read_only = not car_recognized or not controller_available or CP.dashcamOnly or community_feature_disallowed
-  if read_only:
-    CP.safetyModel = car.CarParams.SafetyModel.noOutput
-
-  # Write CarParams for radard and boardd safety mode
-  cp_bytes = CP.to_bytes()
-  params.put("CarParams", cp_bytes)
-  params.put("CarParamsCache", cp_bytes)
-  params.put("LongitudinalControl", "1" if CP.openpilotLongitudinalControl else "0")
-
-  CC = car.CarControl.new_message()
-  AM = AlertManager()
-
-  startup_alert = get_startup_alert(car_recognized, controller_available)
-  AM.add(sm.frame, startup_alert, False)
-
-  LoC = LongControl(CP, CI.compute_gb)
-  VM = VehicleModel(CP)
+  return CC, events_bits
+
+
+class Controlsd():
+  def __init__(self, sm=None, pm=None, can_sock=None):
+    self.params = Params()
+
+    self.is_metric = self.params.get("IsMetric", encoding='utf8') == "1"
+    self.is_ldw_enabled = self.params.get("IsLdwEnabled", encoding='utf8') == "1"
+    passive = self.params.get("Passive", encoding='utf8') == "1"
+    openpilot_enabled_toggle = self.params.get("OpenpilotEnabledToggle", encoding='utf8') == "1"
+    community_feature_toggle = self.params.get("CommunityFeaturesToggle", encoding='utf8') == "1"
+
+    self.passive = passive or not openpilot_enabled_toggle
+
+    # Pub/Sub Sockets
+    self.pm = pm
+    if self.pm is None:
+      self.pm = messaging.PubMaster(['sendcan', 'controlsState', 'carState', 'carControl', 'carEvents', 'carParams',
+                                     'controlsLatency'])
+
+    self.sm = sm
+    if self.sm is None:
+      self.sm = messaging.LazySubMaster(['thermal', 'health', 'liveCalibration', 'dMonitoringState', 'plan', 'pathPlan', \
+                                         'model'])
+
+    self.can_sock = can_sock
+    if self.can_sock is None:
+      can_timeout = None if os.environ.get('NO_CAN_TIMEOUT', False) else 100
+      self.can_sock = messaging.sub_sock('can', timeout=can_timeout)
+
+    # wait for health and CAN packets
+    hw_type = messaging.recv_one(self.sm.sock['health']).health.hwType
+    has_relay = hw_type in [HwType.blackPanda, HwType.uno]
+    print("Waiting for CAN messages...")
+    messaging.get_one_can(self.can_sock)
+
+    self.CI, self.CP = get_car(self.can_sock, self.pm.sock['sendcan'], has_relay)
+
+    car_recognized = self.CP.carName != 'mock'
+    # If stock camera is disconnected, we loaded car controls and it's not chffrplus
+    controller_available = self.CP.enableCamera and self.CI.CC is not None and not self.passive
+    self.community_feature_disallowed = self.CP.communityFeature and not community_feature_toggle
+    self.read_only = not car_recognized or not controller_available or \
+                     self.CP.dashcamOnly or self.community_feature_disallowed
+    if self.read_only:
+      self.CP.safetyModel = car.CarParams.SafetyModel.noOutput
+
+    # Write CarParams for radard and boardd safety mode
+    cp_bytes = self.CP.to_bytes()
+    self.params.put("CarParams", cp_bytes)
+    self.params.put("CarParamsCache", cp_bytes)
+    self.params.put("LongitudinalControl", "1" if self.CP.openpilotLongitudinalControl else "0")
+
+    self.CC = car.CarControl.new_message()
+    self.AM = AlertManager()
+
+    startup_alert = get_startup_alert(car_recognized, controller_available)
+    self.AM.add(self.sm.frame, startup_alert, False)
+
+    self.LoC = LongControl(self.CP, self.CI.compute_gb)
+    self.VM = VehicleModel(self.CP)
+
+    if self.CP.lateralTuning.which() == 'pid':
+      self.LaC = LatControlPID(self.CP)
+    elif self.CP.lateralTuning.which() == 'indi':
+      self.LaC = LatControlINDI(self.CP)
+    elif self.CP.lateralTuning.which() == 'lqr':
+      self.LaC = LatControlLQR(self.CP)
+
+    self.state = State.disabled
+    self.soft_disable_timer = 0
+    self.v_cruise_kph = 255
+    self.v_cruise_kph_last = 0
+    self.mismatch_counter = 0
+    self.can_error_counter = 0
+    self.last_blinker_frame = 0
+    self.events_prev = 0
+
+    self.sm['liveCalibration'].calStatus = Calibration.INVALID
+    self.sm['pathPlan'].sensorValid = True
+    self.sm['pathPlan'].posenetValid = True
+    self.sm['thermal'].freeSpace = 1.
+    self.sm['dMonitoringState'].events = []
+    self.sm['dMonitoringState'].awarenessStatus = 1.
+    self.sm['dMonitoringState'].faceDetected = False
+
+    # detect sound card presence
+    self.sounds_available = not os.path.isfile('/EON') or (os.path.isdir('/proc/asound/card0') and open('/proc/asound/card0/state').read().strip() == 'ONLINE')
+
+    # controlsd is driven by can recv, expected at 100Hz
+    self.rk = Ratekeeper(100, print_delay_threshold=None)
+
+    self.internet_needed = self.params.get("Offroad_ConnectivityNeeded", encoding='utf8') is not None
+
+    # always on stage timing, only published if the pm has a controlsLatency socket
+    self.latency = LatencyTracker(['dataSample', 'stateTransition', 'stateControl', 'dataSend'])
+
+  def step(self):
+    """Runs one iteration of the control loop, driven by the next CAN packet"""
+    sm, CP, AM = self.sm, self.CP, self.AM
 
-  if CP.lateralTuning.which() == 'pid':
-    LaC = LatControlPID(CP)
-  elif CP.lateralTuning.which() == 'indi':
-    LaC = LatControlINDI(CP)
-  elif CP.lateralTuning.which() == 'lqr':
-    LaC = LatControlLQR(CP)
-
-  state = State.disabled
-  soft_disable_timer = 0
-  v_cruise_kph = 255
-  v_cruise_kph_last = 0
-  mismatch_counter = 0
-  can_error_counter = 0
-  last_blinker_frame = 0
-  events_prev = []
-
-  sm['liveCalibration'].calStatus = Calibration.INVALID
-  sm['pathPlan'].sensorValid = True
-  sm['pathPlan'].posenetValid = True
-  sm['thermal'].freeSpace = 1.
-  sm['dMonitoringState'].events = []
-  sm['dMonitoringState'].awarenessStatus = 1.
-  sm['dMonitoringState'].faceDetected = False
-
-  # detect sound card presence
-  sounds_available = not os.path.isfile('/EON') or (os.path.isdir('/proc/asound/card0') and open('/proc/asound/card0/state').read().strip() == 'ONLINE')
-
-  # controlsd is driven by can recv, expected at 100Hz
-  rk = Ratekeeper(100, print_delay_threshold=None)
-
-  internet_needed = params.get("Offroad_ConnectivityNeeded", encoding='utf8') is not None
-
-  prof = Profiler(False)  # off by default
-
-  while True:
     start_time = sec_since_boot()
-    prof.checkpoint("Ratekeeper", ignore=True)
+
+    # stage timing starts once CAN arrived
+    can_strs = messaging.drain_sock_raw(self.can_sock, wait_for_one=True)
+    self.latency.start()
 
     # Sample data and compute car events
-    CS, events, cal_perc, mismatch_counter, can_error_counter = data_sample(CI, CC, sm, can_sock, state, mismatch_counter, can_error_counter, params)
-    prof.checkpoint("Sample")
+    with self.latency.stage("dataSample"):
+      CS, events, cal_perc, self.mismatch_counter, self.can_error_counter = \
+        data_sample(self.CI, self.CC, sm, can_strs, self.state, self.mismatch_counter, self.can_error_counter, self.params)
 
     # Create alerts
     if not sm.alive['plan'] and sm.alive['pathPlan']:  # only plan not being received: radar not communicating
@@ -548,40 +558,54 @@ def controlsd_thread(sm=None, pm=None, can_sock=None):
       events.append(create_event('radarCanError', [ET.NO_ENTRY, ET.SOFT_DISABLE]))
     if not CS.canValid:
       events.append(create_event('canError', [ET.NO_ENTRY, ET.IMMEDIATE_DISABLE]))
-    if not sounds_available:
+    if not self.sounds_available:
       events.append(create_event('soundsUnavailable', [ET.NO_ENTRY, ET.PERMANENT]))
-    if internet_needed:
+    if self.internet_needed:
       events.append(create_event('internetConnectivityNeeded', [ET.NO_ENTRY, ET.PERMANENT]))
-    if community_feature_disallowed:
+    if self.community_feature_disallowed:
       events.append(create_event('communityFeatureDisallowed', [ET.PERMANENT]))
-    if read_only and not passive:
+    if self.read_only and not self.passive:
       events.append(create_event('carUnrecognized', [ET.PERMANENT]))
 
     # Only allow engagement with brake pressed when stopped behind another stopped car
     if CS.brakePressed and sm['plan'].vTargetFuture >= STARTING_TARGET_SPEED and not CP.radarOffCan and CS.vEgo < 0.3:
       events.append(create_event('noTarget', [ET.NO_ENTRY, ET.IMMEDIATE_DISABLE]))
 
-    if not read_only:
+    if not self.read_only:
       # update control state
-      state, soft_disable_timer, v_cruise_kph, v_cruise_kph_last = \
-        state_transition(sm.frame, CS, CP, state, events, soft_disable_timer, v_cruise_kph, AM)
-      prof.checkpoint("State transition")
+      with self.latency.stage("stateTransition"):
+        self.state, self.soft_disable_timer, self.v_cruise_kph, self.v_cruise_kph_last = \
+          state_transition(sm.frame, CS, CP, self.state, events, self.soft_disable_timer, self.v_cruise_kph, AM)
 
     # Compute actuators (runs PID loops and lateral MPC)
-    actuators, v_cruise_kph, v_acc, a_acc, lac_log, last_blinker_frame = \
-      state_control(sm.frame, sm.rcv_frame, sm['plan'], sm['pathPlan'], CS, CP, state, events, v_cruise_kph, v_cruise_kph_last, AM, rk,
-                    LaC, LoC, read_only, is_metric, cal_perc, last_blinker_frame)
-
-    prof.checkpoint("State Control")
+    with self.latency.stage("stateControl"):
+      actuators, self.v_cruise_kph, v_acc, a_acc, lac_log, self.last_blinker_frame = \
+        state_control(sm.frame, sm.rcv_frame, sm['plan'], sm['pathPlan'], CS, CP, self.state, events, self.v_cruise_kph,
+                      self.v_cruise_kph_last, AM, self.rk, self.LaC, self.LoC, self.read_only, self.is_metric, cal_perc,
+                      self.last_blinker_frame)
 
     # Publish data
-    CC, events_prev = data_send(sm, pm, CS, CI, CP, VM, state, events, actuators, v_cruise_kph, rk, AM, LaC,
-                                LoC, read_only, start_time, v_acc, a_acc, lac_log, events_prev, last_blinker_frame,
-                                is_ldw_enabled, can_error_counter)
-    prof.checkpoint("Sent")
+    with self.latency.stage("dataSend"):
+      self.CC, self.events_prev = \
+        data_send(sm, self.pm, CS, self.CI, CP, self.VM, self.state, events, actuators, self.v_cruise_kph, self.rk, AM,
+                  self.LaC, self.LoC, self.read_only, start_time, v_acc, a_acc, lac_log, self.events_prev,
+                  self.last_blinker_frame, self.is_ldw_enabled, self.can_error_counter)
+
+    self.rk.monitor_time()
+    self.latency.end_frame(-self.rk.remaining)
+    if sm.frame % int(1. / DT_CTRL) == 0 and 'controlsLatency' in self.pm.sock:
+      self.pm.send('controlsLatency', self.latency.get_msg())
 
-    rk.monitor_time()
-    prof.display()
+
+def controlsd_thread(sm=None, pm=None, can_sock=None):
+  gc.disable()
+
+  # start the loop
+  set_realtime_priority(3)
+
+  controls = Controlsd(sm, pm, can_sock)
+  while True:
+    controls.step()
 
 
 def main(sm=None, pm=None, logcan=None):
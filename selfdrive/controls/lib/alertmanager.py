@@ -1,8 +1,9 @@
+import heapq
+
 from cereal import car, log
 from common.realtime import DT_CTRL
 from selfdrive.swaglog import cloudlog
 from selfdrive.controls.lib.alerts import ALERTS
-import copy
 
 
 AlertSize = log.ControlsState.AlertSize
@@ -11,38 +12,82 @@ VisualAlert = car.CarControl.HUDControl.VisualAlert
 AudibleAlert = car.CarControl.HUDControl.AudibleAlert
 
 class AlertManager():
+  """Tracks the active alerts by integer id. Alerts are never copied, their
+  per activation state lives in lists indexed by id, and the current alert
+  is the top of a max-heap on (priority, start_time, first added)."""
 
   def __init__(self):
-    self.activealerts = []
     self.alerts = {alert.alert_type: alert for alert in ALERTS}
+    self.alert_list = list(self.alerts.values())
+    self.alert_ids = {alert_type: i for i, alert_type in enumerate(self.alerts)}
+    n = len(self.alert_list)
+
+    self.priority = [a.alert_priority for a in self.alert_list]
+    self.duration = [max(a.duration_sound, a.duration_hud_alert, a.duration_text) for a in self.alert_list]
+
+    self.active = [False] * n
+    self.start_time = [0.] * n
+    self.seq = [0] * n
+    self.text_1 = [a.alert_text_1 for a in self.alert_list]
+    self.text_2 = [a.alert_text_2 for a in self.alert_list]
+
+    # entries are (-priority, -start_time, seq, id), stale entries are dropped lazily
+    self.heap = []
+    self.max_heap_size = 2 * n
+    self.next_seq = 0
+
+  def _is_current(self, entry):
+    i = entry[3]
+    return self.active[i] and self.seq[i] == entry[2] and self.start_time[i] == -entry[1]
+
+  def _top(self):
+    while self.heap and not self._is_current(self.heap[0]):
+      heapq.heappop(self.heap)
+    return self.heap[0][3] if self.heap else None
 
   def alertPresent(self):
-    return len(self.activealerts) > 0
+    return self._top() is not None
 
   def add(self, frame, alert_type, enabled=True, extra_text_1='', extra_text_2=''):
     alert_type = str(alert_type)
-    added_alert = copy.copy(self.alerts[alert_type])
-    added_alert.alert_text_1 += extra_text_1
-    added_alert.alert_text_2 += extra_text_2
-    added_alert.start_time = frame * DT_CTRL
+    i = self.alert_ids[alert_type]
+    start_time = frame * DT_CTRL
 
     # if new alert is higher priority, log it
-    if not self.alertPresent() or added_alert.alert_priority > self.activealerts[0].alert_priority:
-          cloudlog.event('alert_add', alert_type=alert_type, enabled=enabled)
-
-    self.activealerts.append(added_alert)
-
-    # sort by priority first and then by start_time
-    self.activealerts.sort(key=lambda k: (k.alert_priority, k.start_time), reverse=True)
+    top = self._top()
+    if top is None or self.priority[i] > self.priority[top]:
+      cloudlog.event('alert_add', alert_type=alert_type, enabled=enabled)
+
+    if self.active[i] and self.start_time[i] == start_time:
+      # added again in the same frame, the first one keeps precedence
+      return
+
+    self.seq[i] = self.next_seq
+    self.next_seq += 1
+    self.active[i] = True
+    self.start_time[i] = start_time
+    self.text_1[i] = self.alert_list[i].alert_text_1 + extra_text_1
+    self.text_2[i] = self.alert_list[i].alert_text_2 + extra_text_2
+
+    entry = (-self.priority[i], -start_time, self.seq[i], i)
+    if top == i:
+      # a later start time only raises the root, the heap stays valid
+      self.heap[0] = entry
+    else:
+      heapq.heappush(self.heap, entry)
+
+    if len(self.heap) > self.max_heap_size:
+      self.heap = [e for e in self.heap if self._is_current(e)]
+      heapq.heapify(self.heap)
 
   def process_alerts(self, frame):
     cur_time = frame * DT_CTRL
 
     # first get rid of all the expired alerts
-    self.activealerts = [a for a in self.activealerts if a.start_time +
-                         max(a.duration_sound, a.duration_hud_alert, a.duration_text) > cur_time]
-
-    current_alert = self.activealerts[0] if self.alertPresent() else None
+    current_alert = self._top()
+    while current_alert is not None and self.start_time[current_alert] + self.duration[current_alert] <= cur_time:
+      self.active[current_alert] = False
+      current_alert = self._top()
 
     # start with assuming no alerts
     self.alert_type = ""
@@ -54,18 +99,20 @@ class AlertManager():
     self.audible_alert = AudibleAlert.none
     self.alert_rate = 0.
 
-    if current_alert:
-      self.alert_type = current_alert.alert_type
+    if current_alert is not None:
+      alert = self.alert_list[current_alert]
+      start_time = self.start_time[current_alert]
+      self.alert_type = alert.alert_type
 
-      if current_alert.start_time + current_alert.duration_sound > cur_time:
-        self.audible_alert = current_alert.audible_alert
+      if start_time + alert.duration_sound > cur_time:
+        self.audible_alert = alert.audible_alert
 
-      if current_alert.start_time + current_alert.duration_hud_alert > cur_time:
-        self.visual_alert = current_alert.visual_alert
+      if start_time + alert.duration_hud_alert > cur_time:
+        self.visual_alert = alert.visual_alert
 
-      if current_alert.start_time + current_alert.duration_text > cur_time:
-        self.alert_text_1 = current_alert.alert_text_1
-        self.alert_text_2 = current_alert.alert_text_2
-        self.alert_status = current_alert.alert_status
-        self.alert_size = current_alert.alert_size
-        self.alert_rate = current_alert.alert_rate
+      if start_time + alert.duration_text > cur_time:
+        self.alert_text_1 = self.text_1[current_alert]
+        self.alert_text_2 = self.text_2[current_alert]
+        self.alert_status = alert.alert_status
+        self.alert_size = alert.alert_size
+        self.alert_rate = alert.alert_rate
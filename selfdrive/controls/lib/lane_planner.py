@@ -16,29 +16,48 @@ def model_polyfit(points, path_pinv):
   return np.dot(path_pinv, [float(x) for x in points])
 
 
-def calc_d_poly(l_poly, r_poly, p_poly, l_prob, r_prob, lane_width):
+def calc_d_poly(l_poly, r_poly, p_poly, l_prob, r_prob, lane_width, out=None, tmp=None):
+  """Blends the lanes and the predicted path into d_poly, optionally in the preallocated
+  arrays out and tmp. The operations are the ones of blending shifted copies of the lane
+  polys, in the same order, so the result is bit for bit the same."""
   # This will improve behaviour when lanes suddenly widen
   lane_width = min(4.0, lane_width)
   l_prob = l_prob * interp(abs(l_poly[3]), [2, 2.5], [1.0, 0.0])
   r_prob = r_prob * interp(abs(r_poly[3]), [2, 2.5], [1.0, 0.0])
+  if out is None:
+    out = np.empty(4)
+  if tmp is None:
+    tmp = np.empty(4)
 
-  path_from_left_lane = l_poly.copy()
-  path_from_left_lane[3] -= lane_width / 2.0
-  path_from_right_lane = r_poly.copy()
-  path_from_right_lane[3] += lane_width / 2.0
+  # path from left lane and path from right lane
+  np.copyto(out, l_poly)
+  out[3] -= lane_width / 2.0
+  np.copyto(tmp, r_poly)
+  tmp[3] += lane_width / 2.0
 
   lr_prob = l_prob + r_prob - l_prob * r_prob
 
-  d_poly_lane = (l_prob * path_from_left_lane + r_prob * path_from_right_lane) / (l_prob + r_prob + 0.0001)
-  return lr_prob * d_poly_lane + (1.0 - lr_prob) * p_poly
+  # d_poly_lane = (l_prob * path_from_left_lane + r_prob * path_from_right_lane) / (l_prob + r_prob + 0.0001)
+  out *= l_prob
+  tmp *= r_prob
+  out += tmp
+  out /= l_prob + r_prob + 0.0001
+
+  # lr_prob * d_poly_lane + (1.0 - lr_prob) * p_poly
+  out *= lr_prob
+  np.multiply(p_poly, 1.0 - lr_prob, out=tmp)
+  out += tmp
+  return out
 
 
 class LanePlanner():
   def __init__(self):
-    self.l_poly = [0., 0., 0., 0.]
-    self.r_poly = [0., 0., 0., 0.]
-    self.p_poly = [0., 0., 0., 0.]
-    self.d_poly = [0., 0., 0., 0.]
+    # the polys are preallocated and updated in place
+    self.polys = np.zeros((3, 4))
+    self.l_poly, self.r_poly, self.p_poly = self.polys
+    self.d_poly = np.zeros(4)
+    self._points = np.zeros((3, 50))
+    self._d_poly_tmp = np.zeros(4)
 
     self.lane_width_estimate = 3.7
     self.lane_width_certainty = 1.0
@@ -54,20 +73,24 @@ class LanePlanner():
     self.x_points = np.arange(50)
 
   def parse_model(self, md):
-    if len(md.leftLane.poly):
-      self.l_poly = np.array(md.leftLane.poly)
-      self.r_poly = np.array(md.rightLane.poly)
-      self.p_poly = np.array(md.path.poly)
+    left_lane, right_lane, path = md.leftLane, md.rightLane, md.path
+    if len(left_lane.poly):
+      self.l_poly[:] = list(left_lane.poly)
+      self.r_poly[:] = list(right_lane.poly)
+      self.p_poly[:] = list(path.poly)
     else:
-      self.l_poly = model_polyfit(md.leftLane.points, self._path_pinv)  # left line
-      self.r_poly = model_polyfit(md.rightLane.points, self._path_pinv)  # right line
-      self.p_poly = model_polyfit(md.path.points, self._path_pinv)  # predicted path
-    self.l_prob = md.leftLane.prob  # left line prob
-    self.r_prob = md.rightLane.prob  # right line prob
-
-    if len(md.meta.desireState):
-      self.l_lane_change_prob = md.meta.desireState[log.PathPlan.Desire.laneChangeLeft - 1]
-      self.r_lane_change_prob = md.meta.desireState[log.PathPlan.Desire.laneChangeRight - 1]
+      # fit left line, right line and predicted path, one product each like model_polyfit,
+      # a single matrix product sums in a different order
+      for lane, points, poly in zip((left_lane, right_lane, path), self._points, self.polys):
+        points[:] = list(lane.points)
+        np.dot(self._path_pinv, points, out=poly)
+    self.l_prob = left_lane.prob  # left line prob
+    self.r_prob = right_lane.prob  # right line prob
+
+    desire_state = md.meta.desireState
+    if len(desire_state):
+      self.l_lane_change_prob = desire_state[log.PathPlan.Desire.laneChangeLeft - 1]
+      self.r_lane_change_prob = desire_state[log.PathPlan.Desire.laneChangeRight - 1]
 
   def update_d_poly(self, v_ego):
     # only offset left and right lane lines; offsetting p_poly does not make sense
@@ -82,7 +105,8 @@ class LanePlanner():
     self.lane_width = self.lane_width_certainty * self.lane_width_estimate + \
                       (1 - self.lane_width_certainty) * speed_lane_width
 
-    self.d_poly = calc_d_poly(self.l_poly, self.r_poly, self.p_poly, self.l_prob, self.r_prob, self.lane_width)
+    calc_d_poly(self.l_poly, self.r_poly, self.p_poly, self.l_prob, self.r_prob, self.lane_width,
+                out=self.d_poly, tmp=self._d_poly_tmp)
 
   def update(self, v_ego, md):
     self.parse_model(md)
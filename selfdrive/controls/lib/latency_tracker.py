@@ -0,0 +1,87 @@
+import time
+from bisect import bisect_left
+
+import numpy as np
+
+import cereal.messaging as messaging
+from common import tracing
+
+# upper edges of the lag histogram bins, the last bin is everything above
+LAG_BINS_MS = [0., 1., 2., 5., 10., 20., 50., 100.]
+
+
+class _Stage():
+  __slots__ = ('tracker', 'name', 'idx', 'start')
+
+  def __init__(self, tracker, name, idx):
+    self.tracker = tracker
+    self.name = name
+    self.idx = idx
+    self.start = 0
+
+  def __enter__(self):
+    self.start = time.monotonic_ns()
+
+  def __exit__(self, *exc):
+    dur = time.monotonic_ns() - self.start
+    self.tracker.cur[self.idx] += dur * 1e-9
+    tracing.record_span(self.name, self.start, dur)
+
+
+class LatencyTracker():
+  """Always-on timing of the stages of a fixed rate loop. The stage
+  durations of the last size frames are kept in a ring buffer and the
+  frame lag is counted in a histogram, both are summarized at 1 Hz.
+  Every stage is timed once, when tracing is on the same measurement is
+  also recorded as a span."""
+  def __init__(self, stages, size=100):
+    self.stages = list(stages)
+    self._stages = {s: _Stage(self, s, i) for i, s in enumerate(self.stages)}
+    self.size = size
+
+    self.durations = np.zeros((size, len(self.stages)))
+    self.cur = [0.] * len(self.stages)
+    self.idx = 0
+    self.frames = 0
+    self.lag_histogram = [0] * (len(LAG_BINS_MS) + 1)
+
+  def start(self):
+    self.cur = [0.] * len(self.stages)
+
+  def stage(self, name):
+    """Context manager timing one stage of the current frame"""
+    return self._stages[name]
+
+  def end_frame(self, lag):
+    """Store the current frame, lag is how late the frame was in seconds"""
+    self.durations[self.idx] = self.cur
+    self.idx = (self.idx + 1) % self.size
+    self.frames += 1
+    self.lag_histogram[bisect_left(LAG_BINS_MS, lag * 1000.)] += 1
+
+  def get_msg(self):
+    """controlsLatency message summarizing the frames since the last call"""
+    n = min(self.frames, self.size)
+    durations = self.durations[(self.idx - 1 - np.arange(n)) % self.size] * 1000.
+
+    dat = messaging.new_message('controlsLatency')
+    dat.controlsLatency.frames = self.frames
+    dat.controlsLatency.laggedFrames = self.frames - self.lag_histogram[0]
+    dat.controlsLatency.lagHistogram = self.lag_histogram
+    dat.controlsLatency.lagHistogramBinsMs = LAG_BINS_MS
+
+    stages = dat.controlsLatency.init('stages', len(self.stages))
+    if n > 0:
+      p50, p99 = np.percentile(durations, [50, 99], axis=0)
+      max_ = np.max(durations, axis=0)
+    else:
+      p50 = p99 = max_ = np.zeros(len(self.stages))
+    for i, name in enumerate(self.stages):
+      stages[i].name = name
+      stages[i].p50Ms = float(p50[i])
+      stages[i].p99Ms = float(p99[i])
+      stages[i].maxMs = float(max_[i])
+
+    self.frames = 0
+    self.lag_histogram = [0] * (len(LAG_BINS_MS) + 1)
+    return dat
@@ -52,7 +52,7 @@ void init_weights(double pathCost, double laneCost, double headingCost, double s
   acadoVariables.WN[(NYN+1)*3] = headingCost * STEP_MULTIPLIER;
 }
 
-void init(double pathCost, double laneCost, double headingCost, double steerRateCost){
+static void reset(){
   acado_initializeSolver();
   int    i;
 
@@ -66,7 +66,10 @@ void init(double pathCost, double laneCost, double headingCost, double steerRate
 
   /* MPC: initialize the current state feedback. */
   for (i = 0; i < NX; ++i) acadoVariables.x0[ i ] = 0.0;
+}
 
+void init(double pathCost, double laneCost, double headingCost, double steerRateCost){
+  reset();
   init_weights(pathCost, laneCost, headingCost, steerRateCost);
 }
 
@@ -132,3 +135,20 @@ int run_mpc(state_t * x0, log_t * solution,
 
   return acado_getNWSR();
 }
+
+void run_mpc_batch(int n, int n_iter, state_t * x0, log_t * solution,
+                   double * l_poly, double * r_poly, double * d_poly,
+                   double * l_prob, double * r_prob, double * curvature_factor, double * v_ref, double * lane_width,
+                   int * qp_iterations){
+  /* Solves n independent problems from a fresh solver state each, running
+     n_iter real time iterations on every problem. Weights are kept. */
+  int i, j;
+
+  for (i = 0; i < n; i++){
+    reset();
+    for (j = 0; j < n_iter; j++){
+      qp_iterations[i] = run_mpc(&x0[i], &solution[i], &l_poly[4*i], &r_poly[4*i], &d_poly[4*i],
+                                 l_prob[i], r_prob[i], curvature_factor[i], v_ref[i], lane_width[i]);
+    }
+  }
+}
@@ -1,7 +1,8 @@
 import os
 
+import numpy as np
 from cffi import FFI
-from common.ffi_wrapper import suffix
+from common.ffi_wrapper import suffix, dlopen_private, run_parallel
 
 mpc_dir = os.path.dirname(os.path.abspath(__file__))
 libmpc_fn = os.path.join(mpc_dir, "libmpc"+suffix())
@@ -26,6 +27,53 @@ void init_weights(double pathCost, double laneCost, double headingCost, double s
 int run_mpc(state_t * x0, log_t * solution,
              double l_poly[4], double r_poly[4], double d_poly[4],
              double l_prob, double r_prob, double curvature_factor, double v_ref, double lane_width);
+void run_mpc_batch(int n, int n_iter, state_t * x0, log_t * solution,
+                   double * l_poly, double * r_poly, double * d_poly,
+                   double * l_prob, double * r_prob, double * curvature_factor, double * v_ref, double * lane_width,
+                   int * qp_iterations);
 """)
 
 libmpc = ffi.dlopen(libmpc_fn)
+
+# numpy layouts of state_t and log_t
+STATE_DTYPE = np.dtype([('x', np.float64), ('y', np.float64), ('psi', np.float64), ('delta', np.float64),
+                        ('t', np.float64)])
+LOG_DTYPE = np.dtype([('x', np.float64, 21), ('y', np.float64, 21), ('psi', np.float64, 21),
+                      ('delta', np.float64, 21), ('rate', np.float64, 20), ('cost', np.float64)])
+
+# private solver copies for batches, so they never touch the state of libmpc
+batch_libs = []
+
+
+def run_mpc_batch(weights, x0, l_poly, r_poly, d_poly, l_prob, r_prob, curvature_factor, v_ref, lane_width,
+                  n_iter=10, threads=1):
+  """Solves N independent problems with cost weights (path, lane, heading, steer rate).
+
+  x0 is an array of N initial states with dtype STATE_DTYPE, the polys are (N, 4) arrays and
+  the other inputs are arrays of length N or scalars. Every problem starts from a fresh solver
+  and runs n_iter iterations. The problems are split over threads, each with its own solver.
+  Returns the solutions as an array with dtype LOG_DTYPE and the qp iterations of the last
+  iteration of each problem."""
+  x0 = np.ascontiguousarray(x0, dtype=STATE_DTYPE)
+  n = len(x0)
+  polys = [np.ascontiguousarray(np.broadcast_to(p, (n, 4)), dtype=np.float64) for p in (l_poly, r_poly, d_poly)]
+  scalars = [np.ascontiguousarray(np.broadcast_to(a, (n,)), dtype=np.float64)
+             for a in (l_prob, r_prob, curvature_factor, v_ref, lane_width)]
+  solution = np.zeros(n, dtype=LOG_DTYPE)
+  qp_iterations = np.zeros(n, dtype=np.int32)
+
+  while len(batch_libs) < threads:
+    batch_libs.append(dlopen_private(ffi, libmpc_fn))
+  libs = batch_libs[:threads]
+  for lib in libs:
+    lib.init(*weights)
+
+  def solve(lib, lo, hi):
+    lib.run_mpc_batch(hi - lo, n_iter,
+                      ffi.cast("state_t *", ffi.from_buffer(x0[lo:hi])),
+                      ffi.cast("log_t *", ffi.from_buffer(solution[lo:hi])),
+                      *[ffi.cast("double *", ffi.from_buffer(a[lo:hi])) for a in polys + scalars],
+                      ffi.cast("int *", ffi.from_buffer(qp_iterations[lo:hi])))
+
+  run_parallel(libs, n, solve)
+  return solution, qp_iterations
@@ -24,6 +24,11 @@ class LongitudinalMpc():
     self.prev_lead_x = 0.0
     self.new_lead = False
 
+    # inputs of the last solve, and its qp iterations and solve time in ns
+    self.last_inputs = None
+    self.qp_iterations = 0
+    self.calculation_time = 0
+
     self.last_cloudlog_t = 0.0
 
   def send_mpc_solution(self, pm, qp_iterations, calculation_time):
@@ -42,12 +47,14 @@ class LongitudinalMpc():
     pm.send('liveLongitudinalMpc', dat)
 
   def setup_mpc(self):
-    ffi, self.libmpc = libmpc_py.get_libmpc(self.mpc_id)
+    self.ffi, self.libmpc = libmpc_py.get_libmpc(self.mpc_id)
     self.libmpc.init(MPC_COST_LONG.TTC, MPC_COST_LONG.DISTANCE,
                      MPC_COST_LONG.ACCELERATION, MPC_COST_LONG.JERK)
 
-    self.mpc_solution = ffi.new("log_t *")
-    self.cur_state = ffi.new("state_t *")
+    self.mpc_solution = self.ffi.new("log_t *")
+    self.cur_state = self.ffi.new("state_t *")
+    self.guess_x = self.ffi.new("double[%d]" % (libmpc_py.NX * (libmpc_py.N + 1)))
+    self.guess_u = self.ffi.new("double[%d]" % (libmpc_py.NU * libmpc_py.N))
     self.cur_state[0].v_ego = 0
     self.cur_state[0].a_ego = 0
     self.a_lead_tau = _LEAD_ACCEL_TAU
@@ -56,7 +63,15 @@ class LongitudinalMpc():
     self.cur_state[0].v_ego = v
     self.cur_state[0].a_ego = a
 
-  def update(self, pm, CS, lead, v_cruise_setpoint):
+  def copy_solution(self, other):
+    """Takes over the solution of other, and its trajectory as initial guess for the next solve"""
+    self.ffi.memmove(self.mpc_solution, other.mpc_solution, self.ffi.sizeof("log_t"))
+    other.libmpc.get_guess(self.guess_x, self.guess_u)
+    self.libmpc.set_guess(self.guess_x, self.guess_u)
+
+  def update(self, pm, CS, lead, v_cruise_setpoint, shared=None):
+    """Solves for the current lead. If shared is another LongitudinalMpc that was
+    just solved with the same inputs, e.g. both without a lead, its solution is reused."""
     v_ego = CS.vEgo
 
     # Setup current mpc state
@@ -90,10 +105,20 @@ class LongitudinalMpc():
       self.a_lead_tau = _LEAD_ACCEL_TAU
 
     # Calculate mpc
+    cur_state = self.cur_state[0]
+    inputs = (cur_state.v_ego, cur_state.a_ego, cur_state.x_l, cur_state.v_l, a_lead, self.a_lead_tau)
     t = sec_since_boot()
-    n_its = self.libmpc.run_mpc(self.cur_state, self.mpc_solution, self.a_lead_tau, a_lead)
+    if shared is not None and shared.last_inputs == inputs:
+      self.copy_solution(shared)
+      n_its = 0
+    else:
+      n_its = self.libmpc.run_mpc(self.cur_state, self.mpc_solution, self.a_lead_tau, a_lead)
     duration = int((sec_since_boot() - t) * 1e9)
 
+    self.last_inputs = inputs
+    self.qp_iterations = n_its
+    self.calculation_time = duration
+
     if LOG_MPC:
       self.send_mpc_solution(pm, n_its, duration)
 
@@ -120,3 +145,4 @@ class LongitudinalMpc():
       self.v_mpc = v_ego
       self.a_mpc = CS.aEgo
       self.prev_lead_status = False
+      self.last_inputs = None
@@ -1,7 +1,8 @@
 import os
 
+import numpy as np
 from cffi import FFI
-from common.ffi_wrapper import suffix
+from common.ffi_wrapper import suffix, dlopen_private, run_parallel
 
 mpc_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)))
 
@@ -31,6 +32,11 @@ def _get_libmpc(mpc_id):
     void init_with_simulation(double v_ego, double x_l, double v_l, double a_l, double l);
     int run_mpc(state_t * x0, log_t * solution,
                 double l, double a_l_0);
+    void get_dims(int * nx, int * nu, int * n);
+    void get_guess(double * x, double * u);
+    void set_guess(double * x, double * u);
+    void run_mpc_batch(int n, int n_iter, state_t * x0, log_t * solution, double * l,
+                       int * qp_iterations);
     """)
 
     return (ffi, ffi.dlopen(libmpc_fn))
@@ -39,3 +45,52 @@ mpcs = [_get_libmpc(1), _get_libmpc(2)]
 
 def get_libmpc(mpc_id):
     return mpcs[mpc_id - 1]
+
+def _get_dims():
+    ffi, libmpc = mpcs[0]
+    dims = ffi.new("int[3]")
+    libmpc.get_dims(dims, dims + 1, dims + 2)
+    return tuple(dims)
+
+# states, controls and intervals of the generated solver, the guess holds NX * (N + 1) states and NU * N controls
+NX, NU, N = _get_dims()
+
+# numpy layouts of state_t and log_t
+STATE_DTYPE = np.dtype([(f, np.float64) for f in ('x_ego', 'v_ego', 'a_ego', 'x_l', 'v_l', 'a_l')])
+LOG_DTYPE = np.dtype([('x_ego', np.float64, 21), ('v_ego', np.float64, 21), ('a_ego', np.float64, 21),
+                      ('j_ego', np.float64, 20), ('x_l', np.float64, 21), ('v_l', np.float64, 21),
+                      ('a_l', np.float64, 21), ('t', np.float64, 21), ('cost', np.float64)])
+
+# private solver copies for batches, so they never touch the state of the planner mpcs
+batch_libs = []
+
+def run_mpc_batch(weights, x0, a_lead_tau, n_iter=10, threads=1):
+    """Solves N independent problems with cost weights (ttc, distance, acceleration, jerk).
+
+    x0 is an array of N initial states with dtype STATE_DTYPE, a_l being the lead acceleration,
+    a_lead_tau is an array of length N or a scalar. Every problem is initialized like a new
+    lead and runs n_iter iterations. The problems are split over threads, each with its own
+    solver. Returns the solutions as an array with dtype LOG_DTYPE and the qp iterations of
+    the last iteration of each problem."""
+    ffi = mpcs[0][0]
+    x0 = np.ascontiguousarray(x0, dtype=STATE_DTYPE)
+    n = len(x0)
+    a_lead_tau = np.ascontiguousarray(np.broadcast_to(a_lead_tau, (n,)), dtype=np.float64)
+    solution = np.zeros(n, dtype=LOG_DTYPE)
+    qp_iterations = np.zeros(n, dtype=np.int32)
+
+    while len(batch_libs) < threads:
+        batch_libs.append(dlopen_private(ffi, os.path.join(mpc_dir, "libmpc1%s" % suffix())))
+    libs = batch_libs[:threads]
+    for lib in libs:
+        lib.init(*weights)
+
+    def solve(lib, lo, hi):
+        lib.run_mpc_batch(hi - lo, n_iter,
+                          ffi.cast("state_t *", ffi.from_buffer(x0[lo:hi])),
+                          ffi.cast("log_t *", ffi.from_buffer(solution[lo:hi])),
+                          ffi.cast("double *", ffi.from_buffer(a_lead_tau[lo:hi])),
+                          ffi.cast("int *", ffi.from_buffer(qp_iterations[lo:hi])))
+
+    run_parallel(libs, n, solve)
+    return solution, qp_iterations
@@ -112,6 +112,24 @@ void init_with_simulation(double v_ego, double x_l_0, double v_l_0, double a_l_0
   for (i = 0; i < NYN; ++i)  acadoVariables.yN[ i ] = 0.0;
 }
 
+void get_dims(int * nx, int * nu, int * n){
+  *nx = NX;
+  *nu = NU;
+  *n = N;
+}
+
+void get_guess(double * x, double * u){
+  int i;
+  for (i = 0; i < NX * (N + 1); ++i)  x[i] = acadoVariables.x[i];
+  for (i = 0; i < NU * N; ++i)  u[i] = acadoVariables.u[i];
+}
+
+void set_guess(double * x, double * u){
+  int i;
+  for (i = 0; i < NX * (N + 1); ++i)  acadoVariables.x[i] = x[i];
+  for (i = 0; i < NU * N; ++i)  acadoVariables.u[i] = u[i];
+}
+
 int run_mpc(state_t * x0, log_t * solution, double l, double a_l_0){
   // Calculate lead vehicle predictions
   int i;
@@ -171,3 +189,17 @@ int run_mpc(state_t * x0, log_t * solution, double l, double a_l_0){
 
   return acado_getNWSR();
 }
+
+void run_mpc_batch(int n, int n_iter, state_t * x0, log_t * solution, double * l, int * qp_iterations){
+  /* Solves n independent problems, each initialized like a new lead, running
+     n_iter real time iterations on every problem. Weights are kept. */
+  int i, j;
+
+  for (i = 0; i < n; i++){
+    acado_initializeSolver();
+    init_with_simulation(x0[i].v_ego, x0[i].x_l, x0[i].v_l, x0[i].a_l, l[i]);
+    for (j = 0; j < n_iter; j++){
+      qp_iterations[i] = run_mpc(&x0[i], &solution[i], l[i], x0[i].a_l);
+    }
+  }
+}
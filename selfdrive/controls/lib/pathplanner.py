@@ -68,6 +68,10 @@ class PathPlanner():
     self.cur_state[0].psi = 0.0
     self.cur_state[0].delta = 0.0
 
+    # the mpc reads the lane planner polys in place
+    self.l_poly_ptr, self.r_poly_ptr, self.d_poly_ptr = [libmpc_py.ffi.cast("double *", libmpc_py.ffi.from_buffer(p))
+                                                         for p in (self.LP.l_poly, self.LP.r_poly, self.LP.d_poly)]
+
     self.angle_steers_des = 0.0
     self.angle_steers_des_mpc = 0.0
     self.angle_steers_des_prev = 0.0
@@ -149,7 +153,7 @@ class PathPlanner():
 
     v_ego_mpc = max(v_ego, 5.0)  # avoid mpc roughness due to low speed
     self.libmpc.run_mpc(self.cur_state, self.mpc_solution,
-                        list(self.LP.l_poly), list(self.LP.r_poly), list(self.LP.d_poly),
+                        self.l_poly_ptr, self.r_poly_ptr, self.d_poly_ptr,
                         self.LP.l_prob, self.LP.r_prob, curvature_factor, v_ego_mpc, self.LP.lane_width)
 
     # reset to current steer angle if not active or overriding
@@ -184,10 +188,10 @@ class PathPlanner():
     plan_send = messaging.new_message('pathPlan')
     plan_send.valid = sm.all_alive_and_valid(service_list=['carState', 'controlsState', 'liveParameters', 'model'])
     plan_send.pathPlan.laneWidth = float(self.LP.lane_width)
-    plan_send.pathPlan.dPoly = [float(x) for x in self.LP.d_poly]
-    plan_send.pathPlan.lPoly = [float(x) for x in self.LP.l_poly]
+    plan_send.pathPlan.dPoly = self.LP.d_poly.tolist()
+    plan_send.pathPlan.lPoly = self.LP.l_poly.tolist()
     plan_send.pathPlan.lProb = float(self.LP.l_prob)
-    plan_send.pathPlan.rPoly = [float(x) for x in self.LP.r_poly]
+    plan_send.pathPlan.rPoly = self.LP.r_poly.tolist()
     plan_send.pathPlan.rProb = float(self.LP.r_prob)
 
     plan_send.pathPlan.angleSteers = float(self.angle_steers_des_mpc)
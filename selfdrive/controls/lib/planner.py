@@ -2,7 +2,7 @@
 import math
 import numpy as np
 from common.params import Params
-from common.numpy_fast import interp
+from common.numpy_fast import InterpTable
 
 import cereal.messaging as messaging
 from cereal import car
@@ -35,17 +35,22 @@ _A_CRUISE_MAX_BP = [0.,  6.4, 22.5, 40.]
 _A_TOTAL_MAX_V = [1.7, 3.2]
 _A_TOTAL_MAX_BP = [20., 40.]
 
+_A_CRUISE_MIN = InterpTable(_A_CRUISE_MIN_BP, _A_CRUISE_MIN_V)
+_A_CRUISE_MAX = InterpTable(_A_CRUISE_MAX_BP, _A_CRUISE_MAX_V)
+_A_CRUISE_MAX_FOLLOWING = InterpTable(_A_CRUISE_MAX_BP, _A_CRUISE_MAX_V_FOLLOWING)
+_A_TOTAL_MAX = InterpTable(_A_TOTAL_MAX_BP, _A_TOTAL_MAX_V)
+
 # 75th percentile
 SPEED_PERCENTILE_IDX = 7
 
 
 def calc_cruise_accel_limits(v_ego, following):
-  a_cruise_min = interp(v_ego, _A_CRUISE_MIN_BP, _A_CRUISE_MIN_V)
+  a_cruise_min = _A_CRUISE_MIN(v_ego)
 
   if following:
-    a_cruise_max = interp(v_ego, _A_CRUISE_MAX_BP, _A_CRUISE_MAX_V_FOLLOWING)
+    a_cruise_max = _A_CRUISE_MAX_FOLLOWING(v_ego)
   else:
-    a_cruise_max = interp(v_ego, _A_CRUISE_MAX_BP, _A_CRUISE_MAX_V)
+    a_cruise_max = _A_CRUISE_MAX(v_ego)
   return np.vstack([a_cruise_min, a_cruise_max])
 
 
@@ -55,7 +60,7 @@ def limit_accel_in_turns(v_ego, angle_steers, a_target, CP):
   this should avoid accelerating when losing the target in turns
   """
 
-  a_total_max = interp(v_ego, _A_TOTAL_MAX_BP, _A_TOTAL_MAX_V)
+  a_total_max = _A_TOTAL_MAX(v_ego)
   a_y = v_ego**2 * angle_steers * CV.DEG_TO_RAD / (CP.steerRatio * CP.wheelbase)
   a_x_allowed = math.sqrt(max(a_total_max**2 - a_y**2, 0.))
 
@@ -189,7 +194,7 @@ class Planner():
     self.mpc2.set_cur_state(self.v_acc_start, self.a_acc_start)
 
     self.mpc1.update(pm, sm['carState'], lead_1, v_cruise_setpoint)
-    self.mpc2.update(pm, sm['carState'], lead_2, v_cruise_setpoint)
+    self.mpc2.update(pm, sm['carState'], lead_2, v_cruise_setpoint, shared=self.mpc1)
 
     self.choose_solution(v_cruise_setpoint, enabled)
 
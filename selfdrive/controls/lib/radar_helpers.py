@@ -1,4 +1,5 @@
-from common.kalman.simple_kalman import KF1D
+import numpy as np
+
 from selfdrive.config import RADAR_TO_CAMERA
 
 
@@ -13,123 +14,187 @@ SPEED, ACCEL = 0, 1   # Kalman filter states enum
 v_ego_stationary = 4.   # no stationary object flag below this speed
 
 
-class Track():
-  def __init__(self, v_lead, kalman_params):
-    self.cnt = 0
-    self.aLeadTau = _LEAD_ACCEL_TAU
-    self.K_A = kalman_params.A
-    self.K_C = kalman_params.C
-    self.K_K = kalman_params.K
-    self.kf = KF1D([[v_lead], [0.0]], self.K_A, self.K_C, self.K_K)
-
-  def update(self, d_rel, y_rel, v_rel, v_lead, measured):
-    # relative values, copy
-    self.dRel = d_rel   # LONG_DIST
-    self.yRel = y_rel   # -LAT_DIST
-    self.vRel = v_rel   # REL_SPEED
-    self.vLead = v_lead
-    self.measured = measured   # measured or estimate
-
-    # computed velocity and accelerations
-    if self.cnt > 0:
-      self.kf.update(self.vLead)
-
-    self.vLeadK = float(self.kf.x[SPEED][0])
-    self.aLeadK = float(self.kf.x[ACCEL][0])
-
-    # Learn if constant acceleration
-    if abs(self.aLeadK) < 0.5:
-      self.aLeadTau = _LEAD_ACCEL_TAU
-    else:
-      self.aLeadTau *= 0.9
-
-    self.cnt += 1
-
-  def get_key_for_cluster(self):
-    # Weigh y higher since radar is inaccurate in this dimension
-    return [self.dRel, self.yRel*2, self.vRel]
-
-  def reset_a_lead(self, aLeadK, aLeadTau):
-    self.kf = KF1D([[self.vLead], [aLeadK]], self.K_A, self.K_C, self.K_K)
-    self.aLeadK = aLeadK
-    self.aLeadTau = aLeadTau
-
-def mean(l):
-  return sum(l) / len(l)
-
+class Tracks():
+  """Struct of arrays with all radar tracks, sorted by trackId. The lead
+  Kalman filters of all tracks are updated at once."""
+  def __init__(self, kalman_params):
+    A = np.asarray(kalman_params.A, dtype=np.float64)
+    C = np.asarray(kalman_params.C, dtype=np.float64)
+    K = np.asarray(kalman_params.K, dtype=np.float64)[:, 0]
 
-class Cluster():
-  def __init__(self):
-    self.tracks = set()
+    # same as the KF1D gain, the filter assumes a constant covariance matrix
+    self.A_K = A - np.outer(K, C)
+    self.K = K
 
-  def add(self, t):
-    # add the first track
-    self.tracks.add(t)
+    self.ids = np.zeros(0, dtype=np.uint64)
+    self.dRel = np.zeros(0)   # LONG_DIST
+    self.yRel = np.zeros(0)   # -LAT_DIST
+    self.vRel = np.zeros(0)   # REL_SPEED
+    self.vLead = np.zeros(0)
+    self.measured = np.zeros(0, dtype=bool)   # measured or estimate
+    self.cnt = np.zeros(0, dtype=np.int64)
+    self.x = np.zeros((0, 2))   # Kalman filter state: vLeadK, aLeadK
+    self.aLeadTau = np.zeros(0)
 
-  # TODO: make generic
-  @property
-  def dRel(self):
-    return mean([t.dRel for t in self.tracks])
-
-  @property
-  def yRel(self):
-    return mean([t.yRel for t in self.tracks])
-
-  @property
-  def vRel(self):
-    return mean([t.vRel for t in self.tracks])
-
-  @property
-  def aRel(self):
-    return mean([t.aRel for t in self.tracks])
-
-  @property
-  def vLead(self):
-    return mean([t.vLead for t in self.tracks])
-
-  @property
-  def dPath(self):
-    return mean([t.dPath for t in self.tracks])
-
-  @property
-  def vLat(self):
-    return mean([t.vLat for t in self.tracks])
+  def __len__(self):
+    return len(self.ids)
 
   @property
   def vLeadK(self):
-    return mean([t.vLeadK for t in self.tracks])
+    return self.x[:, SPEED]
 
   @property
   def aLeadK(self):
-    if all(t.cnt <= 1 for t in self.tracks):
-      return 0.
-    else:
-      return mean([t.aLeadK for t in self.tracks if t.cnt > 1])
+    return self.x[:, ACCEL]
+
+  def update(self, ids, d_rel, y_rel, v_rel, v_lead, measured):
+    """Replace the tracks with the given points, ids must be sorted and unique.
+    Points with an id that was already tracked keep their filter state."""
+    ids = np.asarray(ids, dtype=np.uint64)
+    n = len(ids)
+
+    cnt = np.zeros(n, dtype=np.int64)
+    x = np.zeros((n, 2))
+    x[:, SPEED] = v_lead
+    a_lead_tau = np.full(n, _LEAD_ACCEL_TAU)
+
+    # carry over the state of the tracks that are still present
+    if len(self.ids) and n:
+      pos = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+      existing = self.ids[pos] == ids
+      pos = pos[existing]
+      cnt[existing] = self.cnt[pos]
+      x[existing] = self.x[pos]
+      a_lead_tau[existing] = self.aLeadTau[pos]
 
-  @property
-  def aLeadTau(self):
-    if all(t.cnt <= 1 for t in self.tracks):
-      return _LEAD_ACCEL_TAU
-    else:
-      return mean([t.aLeadTau for t in self.tracks if t.cnt > 1])
+    # computed velocity and accelerations
+    upd = cnt > 0
+    if np.any(upd):
+      x0, x1, meas = x[upd, SPEED], x[upd, ACCEL], v_lead[upd]
+      x[upd, SPEED] = self.A_K[0, 0] * x0 + self.A_K[0, 1] * x1 + self.K[0] * meas
+      x[upd, ACCEL] = self.A_K[1, 0] * x0 + self.A_K[1, 1] * x1 + self.K[1] * meas
 
-  @property
-  def measured(self):
-    return any(t.measured for t in self.tracks)
+    # Learn if constant acceleration
+    a_lead_tau = np.where(np.abs(x[:, ACCEL]) < 0.5, _LEAD_ACCEL_TAU, a_lead_tau * 0.9)
+
+    self.ids = ids
+    self.dRel = np.asarray(d_rel, dtype=np.float64)
+    self.yRel = np.asarray(y_rel, dtype=np.float64)
+    self.vRel = np.asarray(v_rel, dtype=np.float64)
+    self.vLead = np.asarray(v_lead, dtype=np.float64)
+    self.measured = np.asarray(measured, dtype=bool)
+    self.cnt = cnt + 1
+    self.x = x
+    self.aLeadTau = a_lead_tau
+
+  def get_keys_for_cluster(self):
+    # Weigh y higher since radar is inaccurate in this dimension
+    return np.column_stack((self.dRel, self.yRel*2, self.vRel))
+
+  def reset_a_lead(self, idxs, aLeadK, aLeadTau):
+    self.x[idxs, SPEED] = self.vLead[idxs]
+    self.x[idxs, ACCEL] = aLeadK
+    self.aLeadTau[idxs] = aLeadTau
+
+
+class Clusters():
+  """Per cluster aggregates of the tracks, computed with one grouped reduction per frame"""
+  def __init__(self, tracks, labels):
+    labels = np.asarray(labels, dtype=np.int64)
+    n = int(labels.max()) + 1 if len(labels) else 0
+
+    cnt = np.bincount(labels, minlength=n)
+    valid = cnt > 0
+    cnt = np.maximum(cnt, 1)
+
+    def mean(v, w=cnt):
+      return np.bincount(labels, weights=v, minlength=n) / w
+
+    self.labels = labels
+    self.dRel = mean(tracks.dRel)
+    self.yRel = mean(tracks.yRel)
+    self.vRel = mean(tracks.vRel)
+    self.vLead = mean(tracks.vLead)
+    self.vLeadK = mean(tracks.vLeadK)
+    self.measured = np.bincount(labels, weights=tracks.measured.astype(np.float64), minlength=n) > 0
+
+    # acceleration is only averaged over tracks that were filtered at least once
+    old = tracks.cnt > 1
+    n_old = np.bincount(labels, weights=old.astype(np.float64), minlength=n)
+    has_old = n_old > 0
+    n_old = np.maximum(n_old, 1)
+    self.aLeadK = np.where(has_old, mean(np.where(old, tracks.aLeadK, 0.), n_old), 0.)
+    self.aLeadTau = np.where(has_old, mean(np.where(old, tracks.aLeadTau, 0.), n_old), _LEAD_ACCEL_TAU)
+
+    stats = zip(self.dRel.tolist(), self.yRel.tolist(), self.vRel.tolist(), self.vLead.tolist(),
+                self.vLeadK.tolist(), self.aLeadK.tolist(), self.aLeadTau.tolist(), self.measured.tolist())
+    self.clusters = [Cluster(*c) for c, v in zip(stats, valid) if v]
+
+    # lead query index over the non empty clusters, sorted by distance
+    idx = np.flatnonzero(valid)
+    self.by_dist = np.argsort(self.dRel[idx], kind='stable')
+    self.sorted_dRel = self.dRel[idx][self.by_dist]
+    self.sorted_yRel = self.yRel[idx][self.by_dist]
+    self.idx_dRel = self.dRel[idx]
+    self.idx_yRel = self.yRel[idx]
+    self.idx_vRel = self.vRel[idx]
+
+  def __len__(self):
+    return len(self.clusters)
+
+  def __iter__(self):
+    return iter(self.clusters)
+
+  def __getitem__(self, i):
+    return self.clusters[i]
+
+  def best_match(self, d, d_std, y, y_std, v, v_std):
+    """Cluster that best matches a detection, scoring all clusters at once
+    with the product of laplacian probabilities in d, y and v"""
+    if not len(self.clusters):
+      return None
+
+    prob = np.exp(-np.abs(self.idx_dRel - d) / max(d_std, 1e-4))
+    prob *= np.exp(-np.abs(self.idx_yRel - y) / max(y_std, 1e-4))
+    prob *= np.exp(-np.abs(self.idx_vRel - v) / max(v_std, 1e-4))
+    return self.clusters[int(np.argmax(prob))]
+
+  def closest_low_speed_lead(self, v_ego):
+    """Closest cluster for which potential_low_speed_lead is true, if any"""
+    if v_ego >= v_ego_stationary:
+      return None
+
+    n = np.searchsorted(self.sorted_dRel, 25., side='left')
+    close = np.flatnonzero(np.abs(self.sorted_yRel[:n]) < 1.5)
+    if not len(close):
+      return None
+    return self.clusters[int(self.by_dist[close[0]])]
+
+
+class Cluster():
+  def __init__(self, dRel=0., yRel=0., vRel=0., vLead=0., vLeadK=0., aLeadK=0., aLeadTau=_LEAD_ACCEL_TAU, measured=False):
+    self.dRel = dRel
+    self.yRel = yRel
+    self.vRel = vRel
+    self.vLead = vLead
+    self.vLeadK = vLeadK
+    self.aLeadK = aLeadK
+    self.aLeadTau = aLeadTau
+    self.measured = measured
 
   def get_RadarState(self, model_prob=0.0):
     return {
-      "dRel": float(self.dRel),
-      "yRel": float(self.yRel),
-      "vRel": float(self.vRel),
-      "vLead": float(self.vLead),
-      "vLeadK": float(self.vLeadK),
-      "aLeadK": float(self.aLeadK),
+      "dRel": self.dRel,
+      "yRel": self.yRel,
+      "vRel": self.vRel,
+      "vLead": self.vLead,
+      "vLeadK": self.vLeadK,
+      "aLeadK": self.aLeadK,
       "status": True,
       "fcw": self.is_potential_fcw(model_prob),
       "modelProb": model_prob,
       "radar": True,
-      "aLeadTau": float(self.aLeadTau)
+      "aLeadTau": self.aLeadTau
     }
 
   def get_RadarState_from_vision(self, lead_msg, v_ego):
@@ -114,6 +114,9 @@ class VehicleModel():
     self.cR = stiffness_factor * self.cR_orig
     self.sR = steer_ratio
 
+    # the slip factor only depends on the parameters
+    self.sf = calc_slip_factor(self)
+
   def steady_state_sol(self, sa, u):
     """Returns the steady state solution.
 
@@ -154,8 +157,7 @@ class VehicleModel():
     Returns:
       Curvature factor [1/m]
     """
-    sf = calc_slip_factor(self)
-    return (1. - self.chi) / (1. - sf * u**2) / self.l
+    return (1. - self.chi) / (1. - self.sf * u**2) / self.l
 
   def get_steer_from_curvature(self, curv, u):
     """Calculates the required steering wheel angle for a given curvature
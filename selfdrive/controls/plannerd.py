@@ -4,6 +4,7 @@ import gc
 from cereal import car
 from common.params import Params
 from common.realtime import set_realtime_priority
+from common.tracing import trace
 from selfdrive.swaglog import cloudlog
 from selfdrive.controls.lib.planner import Planner
 from selfdrive.controls.lib.vehicle_model import VehicleModel
@@ -11,39 +12,51 @@ from selfdrive.controls.lib.pathplanner import PathPlanner
 import cereal.messaging as messaging
 
 
-def plannerd_thread(sm=None, pm=None):
-  gc.disable()
+class Plannerd():
+  def __init__(self, sm=None, pm=None):
+    cloudlog.info("plannerd is waiting for CarParams")
+    self.CP = car.CarParams.from_bytes(Params().get("CarParams", block=True))
+    cloudlog.info("plannerd got CarParams: %s", self.CP.carName)
 
-  # start the loop
-  set_realtime_priority(2)
+    self.PL = Planner(self.CP)
+    self.PP = PathPlanner(self.CP)
 
-  cloudlog.info("plannerd is waiting for CarParams")
-  CP = car.CarParams.from_bytes(Params().get("CarParams", block=True))
-  cloudlog.info("plannerd got CarParams: %s", CP.carName)
+    self.VM = VehicleModel(self.CP)
 
-  PL = Planner(CP)
-  PP = PathPlanner(CP)
+    self.sm = sm
+    if self.sm is None:
+      self.sm = messaging.LazySubMaster(['carState', 'controlsState', 'radarState', 'model', 'liveParameters'])
 
-  VM = VehicleModel(CP)
+    self.pm = pm
+    if self.pm is None:
+      self.pm = messaging.PubMaster(['plan', 'liveLongitudinalMpc', 'pathPlan', 'liveMpc'])
 
-  if sm is None:
-    sm = messaging.SubMaster(['carState', 'controlsState', 'radarState', 'model', 'liveParameters'])
+    self.sm['liveParameters'].valid = True
+    self.sm['liveParameters'].sensorValid = True
+    self.sm['liveParameters'].steerRatio = self.CP.steerRatio
+    self.sm['liveParameters'].stiffnessFactor = 1.0
 
-  if pm is None:
-    pm = messaging.PubMaster(['plan', 'liveLongitudinalMpc', 'pathPlan', 'liveMpc'])
+  def step(self):
+    """Runs one iteration of the plannerd loop"""
+    self.sm.update()
 
-  sm['liveParameters'].valid = True
-  sm['liveParameters'].sensorValid = True
-  sm['liveParameters'].steerRatio = CP.steerRatio
-  sm['liveParameters'].stiffnessFactor = 1.0
+    if self.sm.updated['model']:
+      with trace("pathPlanner"):
+        self.PP.update(self.sm, self.pm, self.CP, self.VM)
+    if self.sm.updated['radarState']:
+      with trace("planner"):
+        self.PL.update(self.sm, self.pm, self.CP, self.VM, self.PP)
 
-  while True:
-    sm.update()
 
-    if sm.updated['model']:
-      PP.update(sm, pm, CP, VM)
-    if sm.updated['radarState']:
-      PL.update(sm, pm, CP, VM, PP)
+def plannerd_thread(sm=None, pm=None):
+  gc.disable()
+
+  # start the loop
+  set_realtime_priority(2)
+
+  plannerd = Plannerd(sm, pm)
+  while True:
+    plannerd.step()
 
 
 def main(sm=None, pm=None):
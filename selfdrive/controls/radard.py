@@ -1,16 +1,18 @@
 #!/usr/bin/env python3
 import importlib
-import math
-from collections import defaultdict, deque
+from collections import deque
+
+import numpy as np
 
 import cereal.messaging as messaging
 from cereal import car
 from common.numpy_fast import interp
 from common.params import Params
 from common.realtime import Ratekeeper, set_realtime_priority
+from common.tracing import trace
 from selfdrive.config import RADAR_TO_CAMERA
 from selfdrive.controls.lib.cluster.fastcluster_py import cluster_points_centroid
-from selfdrive.controls.lib.radar_helpers import Cluster, Track
+from selfdrive.controls.lib.radar_helpers import Cluster, Clusters, Tracks
 from selfdrive.swaglog import cloudlog
 
 
@@ -30,24 +32,12 @@ class KalmanParams():
     self.K = [[interp(dt, dts, K0)], [interp(dt, dts, K1)]]
 
 
-def laplacian_cdf(x, mu, b):
-  b = max(b, 1e-4)
-  return math.exp(-abs(x-mu)/b)
-
-
 def match_vision_to_cluster(v_ego, lead, clusters):
   # match vision point to best statistical cluster match
   offset_vision_dist = lead.dist - RADAR_TO_CAMERA
 
-  def prob(c):
-    prob_d = laplacian_cdf(c.dRel, offset_vision_dist, lead.std)
-    prob_y = laplacian_cdf(c.yRel, lead.relY, lead.relYStd)
-    prob_v = laplacian_cdf(c.vRel, lead.relVel, lead.relVelStd)
-
-    # This is isn't exactly right, but good heuristic
-    return prob_d * prob_y * prob_v
-
-  cluster = max(clusters, key=prob)
+  # This is isn't exactly right, but good heuristic
+  cluster = clusters.best_match(offset_vision_dist, lead.std, lead.relY, lead.relYStd, lead.relVel, lead.relVelStd)
 
   # if no 'sane' match is found return -1
   # stationary radar points can be false positives
@@ -73,10 +63,8 @@ def get_lead(v_ego, ready, clusters, lead_msg, low_speed_override=True):
     lead_dict = Cluster().get_RadarState_from_vision(lead_msg, v_ego)
 
   if low_speed_override:
-    low_speed_clusters = [c for c in clusters if c.potential_low_speed_lead(v_ego)]
-    if len(low_speed_clusters) > 0:
-      closest_cluster = min(low_speed_clusters, key=lambda c: c.dRel)
-
+    closest_cluster = clusters.closest_low_speed_lead(v_ego)
+    if closest_cluster is not None:
       # Only choose new cluster if it is actually closer than the previous one
       if (not lead_dict['status']) or (closest_cluster.dRel < lead_dict['dRel']):
         lead_dict = closest_cluster.get_RadarState()
@@ -88,8 +76,8 @@ class RadarD():
   def __init__(self, radar_ts, delay=0):
     self.current_time = 0
 
-    self.tracks = defaultdict(dict)
     self.kalman_params = KalmanParams(radar_ts)
+    self.tracks = Tracks(self.kalman_params)
 
     self.last_md_ts = 0
     self.last_controls_state_ts = 0
@@ -116,51 +104,27 @@ class RadarD():
     for pt in rr.points:
       ar_pts[pt.trackId] = [pt.dRel, pt.yRel, pt.vRel, pt.measured]
 
-    # *** remove missing points from meta data ***
-    for ids in list(self.tracks.keys()):
-      if ids not in ar_pts:
-        self.tracks.pop(ids, None)
-
     # *** compute the tracks ***
-    for ids in ar_pts:
-      rpt = ar_pts[ids]
-
-      # align v_ego by a fixed time to align it with the radar measurement
-      v_lead = rpt[2] + self.v_ego_hist[0]
-
-      # create the track if it doesn't exist or it's a new track
-      if ids not in self.tracks:
-        self.tracks[ids] = Track(v_lead, self.kalman_params)
-      self.tracks[ids].update(rpt[0], rpt[1], rpt[2], v_lead, rpt[3])
-
-    idens = list(sorted(self.tracks.keys()))
-    track_pts = list([self.tracks[iden].get_key_for_cluster() for iden in idens])
+    idens = sorted(ar_pts.keys())
+    pts = np.array([ar_pts[iden] for iden in idens], dtype=np.float64).reshape(-1, 4)
 
+    # align v_ego by a fixed time to align it with the radar measurement
+    v_lead = pts[:, 2] + self.v_ego_hist[0]
+    self.tracks.update(idens, pts[:, 0], pts[:, 1], pts[:, 2], v_lead, pts[:, 3] > 0)
 
     # If we have multiple points, cluster them
-    if len(track_pts) > 1:
-      cluster_idxs = cluster_points_centroid(track_pts, 2.5)
-      clusters = [None] * (max(cluster_idxs) + 1)
-
-      for idx in range(len(track_pts)):
-        cluster_i = cluster_idxs[idx]
-        if clusters[cluster_i] is None:
-          clusters[cluster_i] = Cluster()
-        clusters[cluster_i].add(self.tracks[idens[idx]])
-    elif len(track_pts) == 1:
-      # FIXME: cluster_point_centroid hangs forever if len(track_pts) == 1
-      cluster_idxs = [0]
-      clusters = [Cluster()]
-      clusters[0].add(self.tracks[idens[0]])
+    if len(self.tracks) > 1:
+      cluster_idxs = cluster_points_centroid(self.tracks.get_keys_for_cluster(), 2.5)
     else:
-      clusters = []
+      # FIXME: cluster_point_centroid hangs forever if len(track_pts) == 1
+      cluster_idxs = [0] * len(self.tracks)
+    clusters = Clusters(self.tracks, cluster_idxs)
 
     # if a new point, reset accel to the rest of the cluster
-    for idx in range(len(track_pts)):
-      if self.tracks[idens[idx]].cnt <= 1:
-        aLeadK = clusters[cluster_idxs[idx]].aLeadK
-        aLeadTau = clusters[cluster_idxs[idx]].aLeadTau
-        self.tracks[idens[idx]].reset_a_lead(aLeadK, aLeadTau)
+    new = np.flatnonzero(self.tracks.cnt <= 1)
+    if len(new):
+      labels = clusters.labels[new]
+      self.tracks.reset_a_lead(new, clusters.aLeadK[labels], clusters.aLeadTau[labels])
 
     # *** publish radarState ***
     dat = messaging.new_message('radarState')
@@ -176,64 +140,77 @@ class RadarD():
     return dat
 
 
-# fuses camera and radar data for best lead detection
-def radard_thread(sm=None, pm=None, can_sock=None):
-  set_realtime_priority(2)
-
-  # wait for stats about the car to come in from controls
-  cloudlog.info("radard is waiting for CarParams")
-  CP = car.CarParams.from_bytes(Params().get("CarParams", block=True))
-  cloudlog.info("radard got CarParams")
+class Radard():
+  def __init__(self, sm=None, pm=None, can_sock=None):
+    # wait for stats about the car to come in from controls
+    cloudlog.info("radard is waiting for CarParams")
+    CP = car.CarParams.from_bytes(Params().get("CarParams", block=True))
+    cloudlog.info("radard got CarParams")
 
-  # import the radar from the fingerprint
-  cloudlog.info("radard is importing %s", CP.carName)
-  RadarInterface = importlib.import_module('selfdrive.car.%s.radar_interface' % CP.carName).RadarInterface
+    # import the radar from the fingerprint
+    cloudlog.info("radard is importing %s", CP.carName)
+    RadarInterface = importlib.import_module('selfdrive.car.%s.radar_interface' % CP.carName).RadarInterface
 
-  if can_sock is None:
-    can_sock = messaging.sub_sock('can')
+    self.can_sock = can_sock
+    if self.can_sock is None:
+      self.can_sock = messaging.sub_sock('can')
 
-  if sm is None:
-    sm = messaging.SubMaster(['model', 'controlsState', 'liveParameters'])
+    self.sm = sm
+    if self.sm is None:
+      self.sm = messaging.LazySubMaster(['model', 'controlsState', 'liveParameters'])
 
-  # *** publish radarState and liveTracks
-  if pm is None:
-    pm = messaging.PubMaster(['radarState', 'liveTracks'])
+    # *** publish radarState and liveTracks
+    self.pm = pm
+    if self.pm is None:
+      self.pm = messaging.PubMaster(['radarState', 'liveTracks'])
 
-  RI = RadarInterface(CP)
+    self.RI = RadarInterface(CP)
 
-  rk = Ratekeeper(1.0 / CP.radarTimeStep, print_delay_threshold=None)
-  RD = RadarD(CP.radarTimeStep, RI.delay)
+    self.rk = Ratekeeper(1.0 / CP.radarTimeStep, print_delay_threshold=None)
+    self.RD = RadarD(CP.radarTimeStep, self.RI.delay)
 
-  has_radar = not CP.radarOffCan
+    self.has_radar = not CP.radarOffCan
 
-  while 1:
-    can_strings = messaging.drain_sock_raw(can_sock, wait_for_one=True)
-    rr = RI.update(can_strings)
+  def step(self):
+    """Runs one iteration of the radard loop, driven by the next CAN packet"""
+    can_strings = messaging.drain_sock_raw(self.can_sock, wait_for_one=True)
+    rr = self.RI.update(can_strings)
 
     if rr is None:
-      continue
+      return
 
-    sm.update(0)
+    self.sm.update(0)
 
-    dat = RD.update(rk.frame, sm, rr, has_radar)
-    dat.radarState.cumLagMs = -rk.remaining*1000.
+    with trace("update"):
+      dat = self.RD.update(self.rk.frame, self.sm, rr, self.has_radar)
+    dat.radarState.cumLagMs = -self.rk.remaining*1000.
 
-    pm.send('radarState', dat)
+    self.pm.send('radarState', dat)
 
     # *** publish tracks for UI debugging (keep last) ***
-    tracks = RD.tracks
-    dat = messaging.new_message('liveTracks', len(tracks))
-
-    for cnt, ids in enumerate(sorted(tracks.keys())):
-      dat.liveTracks[cnt] = {
-        "trackId": ids,
-        "dRel": float(tracks[ids].dRel),
-        "yRel": float(tracks[ids].yRel),
-        "vRel": float(tracks[ids].vRel),
-      }
-    pm.send('liveTracks', dat)
-
-    rk.monitor_time()
+    with trace("liveTracks"):
+      tracks = self.RD.tracks
+      dat = messaging.new_message('liveTracks', len(tracks))
+
+      for cnt in range(len(tracks)):
+        dat.liveTracks[cnt] = {
+          "trackId": int(tracks.ids[cnt]),
+          "dRel": float(tracks.dRel[cnt]),
+          "yRel": float(tracks.yRel[cnt]),
+          "vRel": float(tracks.vRel[cnt]),
+        }
+      self.pm.send('liveTracks', dat)
+
+    self.rk.monitor_time()
+
+
+# fuses camera and radar data for best lead detection
+def radard_thread(sm=None, pm=None, can_sock=None):
+  set_realtime_priority(2)
+
+  radard = Radard(sm, pm, can_sock)
+  while 1:
+    radard.step()
 
 
 def main(sm=None, pm=None, can_sock=None):
@@ -0,0 +1,49 @@
+import unittest
+
+from common.realtime import DT_CTRL
+from selfdrive.controls.lib.alertmanager import AlertManager
+
+
+class TestAlertManager(unittest.TestCase):
+  def test_priority_and_expiry(self):
+    AM = AlertManager()
+    AM.add(0, "steerSaturated")
+    AM.add(0, "fcw")
+    AM.process_alerts(0)
+    self.assertEqual(AM.alert_type, "fcw")
+
+    # fcw is shown for 2s, steerSaturated for 3s
+    AM.process_alerts(int(2.5 / DT_CTRL))
+    self.assertEqual(AM.alert_type, "steerSaturated")
+    AM.process_alerts(int(3.5 / DT_CTRL))
+    self.assertEqual(AM.alert_type, "")
+    self.assertFalse(AM.alertPresent())
+
+  def test_readd(self):
+    AM = AlertManager()
+    AM.add(0, "steerSaturated", extra_text_2=" a")
+    AM.add(0, "steerSaturated", extra_text_2=" b")
+    AM.process_alerts(0)
+    self.assertTrue(AM.alert_text_2.endswith(" a"))
+
+    # re-adding every frame keeps the alert alive with the latest text
+    for frame in range(1, 1000):
+      AM.add(frame, "steerSaturated", extra_text_2=" c")
+      AM.process_alerts(frame)
+    self.assertEqual(AM.alert_type, "steerSaturated")
+    self.assertTrue(AM.alert_text_2.endswith(" c"))
+    self.assertLessEqual(len(AM.heap), AM.max_heap_size)
+
+  def test_same_priority_latest_first(self):
+    AM = AlertManager()
+    AM.add(0, "fcw")
+    AM.add(1, "fcwStock")
+    AM.process_alerts(1)
+    self.assertEqual(AM.alert_type, "fcwStock")
+    AM.add(2, "fcw")
+    AM.process_alerts(2)
+    self.assertEqual(AM.alert_type, "fcw")
+
+
+if __name__ == "__main__":
+  unittest.main()
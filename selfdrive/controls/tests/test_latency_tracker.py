@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import common.tracing as tracing
+from common.tracing import KIND_SPAN, read_ring
+from selfdrive.controls.lib.latency_tracker import LatencyTracker, LAG_BINS_MS
+
+
+class TestLatencyTracker(unittest.TestCase):
+  def test_summary(self):
+    lt = LatencyTracker(['a', 'b'], size=100)
+    for i in range(250):
+      lt.start()
+      lt.cur = [i * 1e-3, 1e-3]
+      lt.end_frame(-0.001 if i % 10 else 0.0015)
+
+    msg = lt.get_msg().controlsLatency
+    self.assertEqual(msg.frames, 250)
+    self.assertEqual(msg.laggedFrames, 25)
+    self.assertEqual(list(msg.lagHistogram), [225, 0, 25] + [0] * (len(LAG_BINS_MS) - 2))
+
+    # only the last 100 frames are in the ring
+    stage_a, stage_b = msg.stages
+    self.assertEqual(stage_a.name, 'a')
+    self.assertAlmostEqual(stage_a.maxMs, 249., places=3)
+    self.assertAlmostEqual(stage_a.p50Ms, 199.5, places=3)
+    self.assertAlmostEqual(stage_b.p99Ms, 1., places=3)
+
+    # counters restart after every summary
+    self.assertEqual(lt.get_msg().controlsLatency.frames, 0)
+
+  def test_stage(self):
+    lt = LatencyTracker(['a', 'b'])
+    lt.start()
+    with lt.stage('a'):
+      pass
+    with lt.stage('b'):
+      pass
+    lt.end_frame(0.)
+    self.assertTrue(all(d >= 0. for d in lt.durations[0]))
+
+  def test_stage_traced(self):
+    tmpdir = tempfile.mkdtemp()
+    trace_dir, tracing.TRACE_DIR = tracing.TRACE_DIR, tmpdir
+    tracing._drop_ring()
+    try:
+      tracing.set_enabled(True)
+      lt = LatencyTracker(['a'])
+      lt.start()
+      with lt.stage('a'):
+        pass
+      _, _, records = read_ring(os.path.join(tmpdir, os.listdir(tmpdir)[0]))
+    finally:
+      tracing.set_enabled(False)
+      tracing._close_ring()
+      tracing.TRACE_DIR = trace_dir
+      shutil.rmtree(tmpdir)
+
+    # the span is the same measurement as the stage duration
+    self.assertEqual([(r[0], r[1]) for r in records], [(KIND_SPAN, 'a')])
+    self.assertAlmostEqual(records[0][3] * 1e-9, lt.cur[0], places=12)
+
+
+if __name__ == "__main__":
+  unittest.main()
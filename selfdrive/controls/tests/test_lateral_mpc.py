@@ -124,6 +124,38 @@ class TestLateralMpc(unittest.TestCase):
     for y in list(sol[0].y):
       self.assertGreaterEqual(y_init, abs(y))
 
+  def test_batch(self):
+    np.random.seed(0)
+    n = 50
+    x0 = np.zeros(n, dtype=libmpc_py.STATE_DTYPE)
+    x0['y'] = np.random.uniform(-1., 1., n)
+    x0['psi'] = np.random.uniform(-0.1, 0.1, n)
+    x0['delta'] = np.random.uniform(-0.1, 0.1, n)
+    shift = np.random.uniform(-1., 1., n)
+    v_ref = np.random.uniform(5., 35., n)
+
+    CP = CarInterface.get_params("HONDA CIVIC 2016 TOURING")
+    VM = VehicleModel(CP)
+    curvature_factor = np.array([VM.curvature_factor(v) for v in v_ref])
+
+    l_poly = np.tile([0., 0., 0., 1.8], (n, 1))
+    r_poly = np.tile([0., 0., 0., -1.8], (n, 1))
+    l_poly[:, 3] += shift
+    r_poly[:, 3] += shift
+    d_poly = np.array([calc_d_poly(l, r, np.zeros(4), 1., 1., 3.6) for l, r in zip(l_poly, r_poly)])
+
+    expected = [run_mpc(v_ref=v_ref[i], y_init=x0['y'][i], psi_init=x0['psi'][i], delta_init=x0['delta'][i],
+                        poly_shift=shift[i]) for i in range(n)]
+
+    for threads in [1, 3]:
+      sol, qp_iterations = libmpc_py.run_mpc_batch((1.0, 3.0, 1.0, 1.0), x0, l_poly, r_poly, d_poly, 1., 1.,
+                                                   curvature_factor, v_ref, 3.6, n_iter=20, threads=threads)
+      self.assertEqual(qp_iterations.shape, (n,))
+      for i in range(n):
+        for f in ['x', 'y', 'psi', 'delta', 'rate']:
+          np.testing.assert_allclose(sol[f][i], list(getattr(expected[i][0], f)), atol=1e-9)
+        self.assertAlmostEqual(sol['cost'][i], expected[i][0].cost)
+
 
 if __name__ == "__main__":
   unittest.main()
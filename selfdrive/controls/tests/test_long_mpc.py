@@ -0,0 +1,96 @@
+import math
+import unittest
+import numpy as np
+
+from cereal import car, log
+from selfdrive.controls.lib.long_mpc import LongitudinalMpc
+from selfdrive.controls.lib.longitudinal_mpc import libmpc_py
+from selfdrive.controls.lib.drive_helpers import MPC_COST_LONG
+
+
+def run_two_lead_mpcs(shared, t_end=60.0):
+  """Runs both lead mpcs like the planner at 20 Hz, with a lead that is only present half of the time"""
+  dt = 0.05
+  t = 0.
+
+  v_ego, a_ego = 20., 0.
+  x_lead, v_lead = 40., 20.
+
+  mpc1, mpc2 = LongitudinalMpc(1), LongitudinalMpc(2)
+  v_mpc, qp_iterations, calculation_time, copied = [], [], [], 0
+
+  while t < t_end:
+    CS = car.CarState.new_message(vEgo=v_ego, aEgo=a_ego)
+    lead = log.RadarState.LeadData.new_message(status=(t % 20.) < 10., dRel=x_lead, vLead=v_lead, aLeadK=0.,
+                                               aLeadTau=1.5)
+    no_lead = log.RadarState.LeadData.new_message(status=False)
+
+    for mpc in (mpc1, mpc2):
+      mpc.set_cur_state(v_ego, a_ego)
+    mpc1.update(None, CS, lead, v_ego + 5.)
+    mpc2.update(None, CS, no_lead, v_ego + 5., shared=mpc1 if shared else None)
+
+    v_mpc.append((mpc1.v_mpc, mpc2.v_mpc))
+    qp_iterations.append(mpc1.qp_iterations + mpc2.qp_iterations)
+    calculation_time.append(mpc1.calculation_time + mpc2.calculation_time)
+    copied += mpc2.last_inputs == mpc1.last_inputs
+
+    # cruise at 25 m/s when not limited by the lead
+    if mpc1.v_mpc < 25.:
+      v_ego, a_ego = mpc1.v_mpc, mpc1.a_mpc
+    else:
+      v_ego, a_ego = 25., 0.
+    v_lead = 20. + 5. * math.sin(t / 3.)
+    x_lead += (v_lead - v_ego) * dt
+    t += dt
+
+  return np.array(v_mpc), np.array(qp_iterations), np.array(calculation_time), copied
+
+
+class TestLongitudinalMpc(unittest.TestCase):
+  def test_shared_solution(self):
+    v_mpc, qp_iterations, _, copied = run_two_lead_mpcs(shared=False)
+    v_mpc_shared, qp_iterations_shared, _, copied_shared = run_two_lead_mpcs(shared=True)
+
+    # without a lead for mpc1 both mpcs solve the same problem, and mpc2 takes over the solution
+    self.assertEqual(copied, copied_shared)
+    self.assertGreater(copied_shared, len(v_mpc) // 3)
+    np.testing.assert_equal(v_mpc_shared[:, 0], v_mpc[:, 0])
+    self.assertLessEqual(np.sum(qp_iterations_shared), np.sum(qp_iterations))
+
+    # a single real time iteration is not converged, so mpc2 differs slightly from its own solve
+    np.testing.assert_allclose(v_mpc_shared[:, 1], v_mpc[:, 1], atol=1.)
+
+  def test_batch(self):
+    np.random.seed(0)
+    n = 50
+    x0 = np.zeros(n, dtype=libmpc_py.STATE_DTYPE)
+    x0['v_ego'] = np.random.uniform(0., 35., n)
+    x0['a_ego'] = np.random.uniform(-1., 1., n)
+    x0['x_l'] = np.random.uniform(5., 100., n)
+    x0['v_l'] = np.random.uniform(0., 35., n)
+    x0['a_l'] = np.random.uniform(-2., 2., n)
+    a_lead_tau = np.random.uniform(0.5, 2., n)
+    weights = (MPC_COST_LONG.TTC, MPC_COST_LONG.DISTANCE, MPC_COST_LONG.ACCELERATION, MPC_COST_LONG.JERK)
+
+    ffi, libmpc = libmpc_py.get_libmpc(1)
+    expected = []
+    for i in range(n):
+      cur_state = ffi.new("state_t *", tuple(x0[i]))
+      mpc_solution = ffi.new("log_t *")
+      libmpc.init(*weights)
+      libmpc.init_with_simulation(x0['v_ego'][i], x0['x_l'][i], x0['v_l'][i], x0['a_l'][i], a_lead_tau[i])
+      for _ in range(10):
+        libmpc.run_mpc(cur_state, mpc_solution, a_lead_tau[i], x0['a_l'][i])
+      expected.append(mpc_solution)
+
+    for threads in [1, 3]:
+      sol, qp_iterations = libmpc_py.run_mpc_batch(weights, x0, a_lead_tau, n_iter=10, threads=threads)
+      self.assertEqual(qp_iterations.shape, (n,))
+      for i in range(n):
+        for f in ['x_ego', 'v_ego', 'a_ego', 'j_ego', 'x_l', 'v_l']:
+          np.testing.assert_allclose(sol[f][i], list(getattr(expected[i][0], f)), atol=1e-9)
+
+
+if __name__ == "__main__":
+  unittest.main()
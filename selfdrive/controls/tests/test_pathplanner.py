@@ -0,0 +1,131 @@
+import shutil
+import tempfile
+import unittest
+from functools import partial
+from unittest import mock
+import numpy as np
+
+from cereal import car, log
+from common.numpy_fast import interp
+from common.params import Params
+from selfdrive.car.honda.interface import CarInterface
+from selfdrive.controls.lib.lane_planner import LanePlanner, calc_d_poly, compute_path_pinv, CAMERA_OFFSET
+from selfdrive.controls.lib.pathplanner import PathPlanner
+from selfdrive.controls.lib.vehicle_model import VehicleModel
+
+
+def ref_calc_d_poly(l_poly, r_poly, p_poly, l_prob, r_prob, lane_width):
+  lane_width = min(4.0, lane_width)
+  l_prob = l_prob * interp(abs(l_poly[3]), [2, 2.5], [1.0, 0.0])
+  r_prob = r_prob * interp(abs(r_poly[3]), [2, 2.5], [1.0, 0.0])
+
+  path_from_left_lane = l_poly.copy()
+  path_from_left_lane[3] -= lane_width / 2.0
+  path_from_right_lane = r_poly.copy()
+  path_from_right_lane[3] += lane_width / 2.0
+
+  lr_prob = l_prob + r_prob - l_prob * r_prob
+
+  d_poly_lane = (l_prob * path_from_left_lane + r_prob * path_from_right_lane) / (l_prob + r_prob + 0.0001)
+  return lr_prob * d_poly_lane + (1.0 - lr_prob) * p_poly
+
+
+def model_msg(t, with_poly):
+  x = np.arange(50.)
+  curv = 1e-4 * np.sin(t)
+  center = curv * x**2 + 0.1 * np.cos(t)
+  l_points = center + 1.8 + 0.01 * np.sin(x + t)
+  r_points = center - 1.8 - 0.01 * np.cos(x + t)
+
+  md = log.ModelData.new_message()
+  for lane, points in [(md.leftLane, l_points), (md.rightLane, r_points), (md.path, center)]:
+    lane.points = points.tolist()
+    lane.prob = 0.9
+    if with_poly:
+      lane.poly = np.polyfit(x, points, 3).tolist()
+  md.meta.desireState = [0.] * 8
+  return md.as_reader()
+
+
+class FakeSubMaster(dict):
+  def all_alive_and_valid(self, service_list=None):
+    return True
+
+
+class FakePubMaster():
+  def send(self, s, dat):
+    pass
+
+
+class TestLanePlanner(unittest.TestCase):
+  def test_calc_d_poly(self):
+    np.random.seed(0)
+    out = np.zeros(4)
+    tmp = np.zeros(4)
+    for _ in range(20000):
+      l_poly, r_poly, p_poly = np.random.uniform(-3., 3., (3, 4))
+      l_prob, r_prob = np.random.uniform(0., 1., 2)
+      lane_width = np.random.uniform(2., 5.)
+      # process replay compares pathPlan exactly
+      expected = ref_calc_d_poly(l_poly, r_poly, p_poly, l_prob, r_prob, lane_width)
+      self.assertTrue(np.array_equal(calc_d_poly(l_poly, r_poly, p_poly, l_prob, r_prob, lane_width), expected))
+      calc_d_poly(l_poly, r_poly, p_poly, l_prob, r_prob, lane_width, out=out, tmp=tmp)
+      self.assertTrue(np.array_equal(out, expected))
+
+  def test_parse_model(self):
+    path_pinv = compute_path_pinv()
+    LP = LanePlanner()
+    buffers = (LP.l_poly, LP.r_poly, LP.p_poly, LP.d_poly)
+
+    for t in range(10):
+      for with_poly in [True, False]:
+        md = model_msg(t, with_poly)
+        LP.update(20., md)
+
+        for lane, poly, offset in [(md.leftLane, LP.l_poly, CAMERA_OFFSET), (md.rightLane, LP.r_poly, CAMERA_OFFSET),
+                                   (md.path, LP.p_poly, 0.)]:
+          if with_poly:
+            expected = np.array(lane.poly)
+          else:
+            expected = np.dot(path_pinv, [float(x) for x in lane.points])
+          expected[3] += offset
+          self.assertTrue(np.array_equal(poly, expected))
+        expected = ref_calc_d_poly(LP.l_poly, LP.r_poly, LP.p_poly, LP.l_prob, LP.r_prob, LP.lane_width)
+        self.assertTrue(np.array_equal(LP.d_poly, expected))
+
+        # the buffers are reused for every frame
+        self.assertTrue(all(a is b for a, b in zip(buffers, (LP.l_poly, LP.r_poly, LP.p_poly, LP.d_poly))))
+
+
+class TestPathPlanner(unittest.TestCase):
+  def setUp(self):
+    # the default Params() is bound to PARAMS_PATH at import, keep the planner out of the checkout
+    self.tmpdir = tempfile.mkdtemp()
+    self.params_patch = mock.patch('selfdrive.controls.lib.pathplanner.Params', partial(Params, self.tmpdir))
+    self.params_patch.start()
+
+  def tearDown(self):
+    self.params_patch.stop()
+    shutil.rmtree(self.tmpdir)
+
+  def test_update(self):
+    CP = CarInterface.get_params("HONDA CIVIC 2016 TOURING")
+    VM = VehicleModel(CP)
+    PP = PathPlanner(CP)
+    pm = FakePubMaster()
+
+    n = 200
+    for with_poly in [True, False]:
+      for i in range(n):
+        sm = FakeSubMaster()
+        sm['carState'] = car.CarState.new_message(vEgo=25., steeringAngle=float(np.sin(i / 20.))).as_reader()
+        sm['controlsState'] = log.ControlsState.new_message(active=True).as_reader()
+        sm['liveParameters'] = log.LiveParametersData.new_message(steerRatio=CP.steerRatio, stiffnessFactor=1.,
+                                                                  valid=True, sensorValid=True).as_reader()
+        sm['model'] = model_msg(i / 20., with_poly)
+        PP.update(sm, pm, CP, VM)
+      self.assertTrue(PP.solution_invalid_cnt < 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
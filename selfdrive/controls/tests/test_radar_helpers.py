@@ -0,0 +1,107 @@
+import math
+import random
+import unittest
+from collections import namedtuple
+import numpy as np
+
+from common.kalman.simple_kalman_old import KF1D
+from selfdrive.controls.lib.radar_helpers import Clusters, Tracks, _LEAD_ACCEL_TAU
+
+KalmanParams = namedtuple('KalmanParams', ['A', 'C', 'K'])
+
+
+class RefTrack():
+  # per track implementation the vectorized store replaces
+  def __init__(self, v_lead, kp):
+    self.kp = kp
+    self.cnt = 0
+    self.aLeadTau = _LEAD_ACCEL_TAU
+    self.kf = KF1D(np.array([[v_lead], [0.0]]), np.array(kp.A), np.array([kp.C]), np.array(kp.K))
+
+  def update(self, v_lead):
+    self.vLead = v_lead
+    if self.cnt > 0:
+      self.kf.update(v_lead)
+    self.vLeadK = float(self.kf.x[0][0])
+    self.aLeadK = float(self.kf.x[1][0])
+    if abs(self.aLeadK) < 0.5:
+      self.aLeadTau = _LEAD_ACCEL_TAU
+    else:
+      self.aLeadTau *= 0.9
+    self.cnt += 1
+
+  def reset_a_lead(self, aLeadK, aLeadTau):
+    self.kf.x = np.array([[self.vLead], [aLeadK]])
+    self.aLeadK = aLeadK
+    self.aLeadTau = aLeadTau
+
+
+class TestRadarHelpers(unittest.TestCase):
+  def test_tracks_match_reference(self):
+    random.seed(0)
+    kp = KalmanParams([[1.0, 0.05], [0.0, 1.0]], [1.0, 0.0], [[0.19887], [0.28555]])
+    tracks = Tracks(kp)
+    ref = {}
+
+    for _ in range(200):
+      ids = sorted(random.sample(range(20), random.randint(0, 12)))
+      v_lead = np.array([random.uniform(0., 30.) for _ in ids])
+      d_rel = np.array([random.uniform(0., 100.) for _ in ids])
+      labels = [random.randint(0, 3) for _ in ids]
+      labels = list(np.unique(labels, return_inverse=True)[1]) if ids else []
+
+      tracks.update(ids, d_rel, np.zeros(len(ids)), v_lead, v_lead, np.ones(len(ids), dtype=bool))
+      clusters = Clusters(tracks, labels)
+
+      ref = {iden: ref[iden] if iden in ref else RefTrack(v, kp) for iden, v in zip(ids, v_lead)}
+      for iden, v in zip(ids, v_lead):
+        ref[iden].update(v)
+
+      for c in range(len(clusters)):
+        members = [ref[iden] for iden, l in zip(ids, labels) if l == c]
+        old = [t for t in members if t.cnt > 1]
+        self.assertAlmostEqual(clusters[c].dRel, np.mean([d for d, l in zip(d_rel, labels) if l == c]))
+        self.assertAlmostEqual(clusters[c].vLeadK, np.mean([t.vLeadK for t in members]))
+        self.assertAlmostEqual(clusters[c].aLeadK, np.mean([t.aLeadK for t in old]) if old else 0.)
+        self.assertAlmostEqual(clusters[c].aLeadTau, np.mean([t.aLeadTau for t in old]) if old else _LEAD_ACCEL_TAU)
+
+      new = np.flatnonzero(tracks.cnt <= 1)
+      tracks.reset_a_lead(new, clusters.aLeadK[clusters.labels[new]], clusters.aLeadTau[clusters.labels[new]])
+      for i in new:
+        c = clusters[clusters.labels[i]]
+        ref[ids[i]].reset_a_lead(c.aLeadK, c.aLeadTau)
+
+      for i, iden in enumerate(ids):
+        self.assertAlmostEqual(tracks.vLeadK[i], ref[iden].kf.x[0][0])
+        self.assertAlmostEqual(tracks.aLeadK[i], ref[iden].kf.x[1][0])
+        self.assertAlmostEqual(tracks.aLeadTau[i], ref[iden].aLeadTau)
+
+  def test_lead_queries_match_reference(self):
+    random.seed(0)
+    kp = KalmanParams([[1.0, 0.05], [0.0, 1.0]], [1.0, 0.0], [[0.19887], [0.28555]])
+
+    def laplacian_cdf(x, mu, b):
+      return math.exp(-abs(x-mu)/max(b, 1e-4))
+
+    for _ in range(500):
+      n = random.randint(1, 64)
+      tracks = Tracks(kp)
+      d_rel = np.array([random.uniform(0., 100.) for _ in range(n)])
+      y_rel = np.array([random.uniform(-5., 5.) for _ in range(n)])
+      v_rel = np.array([random.uniform(-10., 10.) for _ in range(n)])
+      tracks.update(range(n), d_rel, y_rel, v_rel, v_rel, np.ones(n, dtype=bool))
+      clusters = Clusters(tracks, [random.randint(0, n - 1) for _ in range(n)])
+
+      d, y, v = random.uniform(0., 100.), random.uniform(-3., 3.), random.uniform(-10., 10.)
+      d_std, y_std, v_std = random.uniform(0., 5.), random.uniform(0., 1.), random.uniform(0., 3.)
+      ref = max(clusters, key=lambda c: laplacian_cdf(c.dRel, d, d_std) * laplacian_cdf(c.yRel, y, y_std) * laplacian_cdf(c.vRel, v, v_std))
+      self.assertIs(clusters.best_match(d, d_std, y, y_std, v, v_std), ref)
+
+      v_ego = random.uniform(0., 8.)
+      low_speed = [c for c in clusters if c.potential_low_speed_lead(v_ego)]
+      ref = min(low_speed, key=lambda c: c.dRel) if low_speed else None
+      self.assertIs(clusters.closest_low_speed_lead(v_ego), ref)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+import numpy as np
+
+from selfdrive.car.honda.interface import CarInterface
+from selfdrive.car.honda.values import CAR
+from selfdrive.controls.lib.vehicle_model import VehicleModel, calc_slip_factor
+
+
+def ref_curvature_factor(VM, u):
+  sf = calc_slip_factor(VM)
+  return (1. - VM.chi) / (1. - sf * u**2) / VM.l
+
+
+class TestVehicleModel(unittest.TestCase):
+  def setUp(self):
+    CP = CarInterface.get_params(CAR.CIVIC)
+    self.VM = VehicleModel(CP)
+
+  def test_cached_slip_factor(self):
+    # process replay compares controlsd and plannerd exactly, so the results have to be bit exact
+    VM = self.VM
+    np.random.seed(0)
+    speeds = np.concatenate([np.linspace(0., 0.2, 21), np.random.uniform(0.2, 45., 500)])
+    for stiffness_factor in [0.5, 0.8, 1.0, 1.3]:
+      for steer_ratio in [10., 15.38, 20.]:
+        VM.update_params(stiffness_factor, steer_ratio)
+        for u in speeds:
+          u = float(u)
+          cf = ref_curvature_factor(VM, u)
+          self.assertEqual(VM.curvature_factor(u), cf)
+          self.assertEqual(VM.calc_curvature(0.3, u), cf * 0.3 / steer_ratio)
+          self.assertEqual(VM.get_steer_from_curvature(0.01, u), 0.01 * steer_ratio * 1.0 / cf)
+
+
+if __name__ == "__main__":
+  unittest.main()
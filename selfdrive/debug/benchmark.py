@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Timings of the optimized hot paths next to what they replaced.
+
+These are wall clock numbers, so they live here instead of in the unit tests, which only check
+results. The reference implementations come from the tests.
+  benchmark.py              run everything
+  benchmark.py interp ekf   run the named benchmarks
+"""
+import os
+import sys
+import time
+import timeit
+import tempfile
+
+# PathPlanner reads params, keep them out of the checkout
+os.environ.setdefault("PARAMS_PATH", os.path.join(tempfile.mkdtemp(), "params"))
+
+import numpy as np  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def best_of(fn, number, repeat=3):
+  """Best time of a call to fn in seconds"""
+  return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def bench_interp():
+  from common.numpy_fast import interp, InterpTable
+  from common.tests.test_numpy_fast import ref_interp
+
+  xp = [0., 5., 10., 20., 40.]
+  fp = [-1.0, -.8, -.67, -.5, -.30]
+  xp_np, fp_np = np.array(xp), np.array(fp)
+  table = InterpTable(xp, fp)
+  x = [3., 12., 25., 50.]
+  x_np = np.array(x)
+
+  cases = [
+    ("scalar", lambda: ref_interp(25., xp, fp), lambda: np.interp(25., xp_np, fp_np),
+     lambda: interp(25., xp, fp), lambda: table(25.)),
+    ("4 points", lambda: ref_interp(x, xp, fp), lambda: np.interp(x_np, xp_np, fp_np),
+     lambda: interp(x, xp, fp), lambda: table(x)),
+  ]
+  for name, *fns in cases:
+    t_ref, t_np, t_interp, t_table = [best_of(fn, 10000) * 1e6 for fn in fns]
+    print("interp %s: python %.2f us, np.interp %.2f us, interp %.2f us, InterpTable %.2f us" %
+          (name, t_ref, t_np, t_interp, t_table))
+
+
+def bench_tracing():
+  import common.tracing as tracing
+
+  def span():
+    with tracing.trace("foo"):
+      pass
+
+  tracing.set_enabled(False)
+  print("disabled trace span: %.3f us" % (best_of(span, 100000, repeat=5) * 1e6))
+
+
+def bench_pathplanner():
+  from cereal import car, log
+  from selfdrive.car.honda.interface import CarInterface
+  from selfdrive.controls.lib.pathplanner import PathPlanner
+  from selfdrive.controls.lib.vehicle_model import VehicleModel
+  from selfdrive.controls.tests.test_pathplanner import FakeSubMaster, FakePubMaster, model_msg
+
+  CP = CarInterface.get_params("HONDA CIVIC 2016 TOURING")
+  VM = VehicleModel(CP)
+  PP = PathPlanner(CP)
+  pm = FakePubMaster()
+
+  n = 200
+  for with_poly in [True, False]:
+    frames = []
+    for i in range(n):
+      sm = FakeSubMaster()
+      sm['carState'] = car.CarState.new_message(vEgo=25., steeringAngle=float(np.sin(i / 20.))).as_reader()
+      sm['controlsState'] = log.ControlsState.new_message(active=True).as_reader()
+      sm['liveParameters'] = log.LiveParametersData.new_message(steerRatio=CP.steerRatio, stiffnessFactor=1.,
+                                                                valid=True, sensorValid=True).as_reader()
+      sm['model'] = model_msg(i / 20., with_poly)
+      frames.append(sm)
+
+    def update():
+      for sm in frames:
+        PP.update(sm, pm, CP, VM)
+
+    dt = best_of(update, 1, repeat=5) / n
+    print("PathPlanner.update with %s: %.1f us per model frame" % ("poly" if with_poly else "points", dt * 1e6))
+
+
+def bench_lateral_mpc():
+  from selfdrive.car.honda.interface import CarInterface
+  from selfdrive.controls.lib.lane_planner import calc_d_poly
+  from selfdrive.controls.lib.lateral_mpc import libmpc_py
+  from selfdrive.controls.lib.vehicle_model import VehicleModel
+  from selfdrive.controls.tests.test_lateral_mpc import run_mpc
+
+  np.random.seed(0)
+  n = 50
+  x0 = np.zeros(n, dtype=libmpc_py.STATE_DTYPE)
+  x0['y'] = np.random.uniform(-1., 1., n)
+  x0['psi'] = np.random.uniform(-0.1, 0.1, n)
+  x0['delta'] = np.random.uniform(-0.1, 0.1, n)
+  shift = np.random.uniform(-1., 1., n)
+  v_ref = np.random.uniform(5., 35., n)
+
+  VM = VehicleModel(CarInterface.get_params("HONDA CIVIC 2016 TOURING"))
+  curvature_factor = np.array([VM.curvature_factor(v) for v in v_ref])
+  l_poly = np.tile([0., 0., 0., 1.8], (n, 1))
+  r_poly = np.tile([0., 0., 0., -1.8], (n, 1))
+  l_poly[:, 3] += shift
+  r_poly[:, 3] += shift
+  d_poly = np.array([calc_d_poly(l, r, np.zeros(4), 1., 1., 3.6) for l, r in zip(l_poly, r_poly)])
+
+  t = time.monotonic()
+  for i in range(n):
+    run_mpc(v_ref=v_ref[i], y_init=x0['y'][i], psi_init=x0['psi'][i], delta_init=x0['delta'][i], poly_shift=shift[i])
+  t_serial = time.monotonic() - t
+
+  for threads in [1, 3]:
+    t = time.monotonic()
+    libmpc_py.run_mpc_batch((1.0, 3.0, 1.0, 1.0), x0, l_poly, r_poly, d_poly, 1., 1., curvature_factor, v_ref, 3.6,
+                            n_iter=20, threads=threads)
+    print("lateral mpc, %d problems: serial %.1f ms, batch with %d threads %.1f ms" %
+          (n, t_serial * 1e3, threads, (time.monotonic() - t) * 1e3))
+
+
+def bench_long_mpc():
+  from selfdrive.controls.tests.test_long_mpc import run_two_lead_mpcs
+
+  _, qp_iterations, calculation_time, _ = run_two_lead_mpcs(shared=False)
+  _, qp_iterations_shared, calculation_time_shared, _ = run_two_lead_mpcs(shared=True)
+  print("longitudinal mpcs, qp iterations per frame: %.2f -> %.2f" %
+        (np.mean(qp_iterations), np.mean(qp_iterations_shared)))
+  print("longitudinal mpcs, solve time per frame: %.1f us -> %.1f us" %
+        (np.mean(calculation_time) / 1e3, np.mean(calculation_time_shared) / 1e3))
+
+
+def bench_ekf():
+  from selfdrive.locationd.kalman.helpers import ObservationKind
+  from selfdrive.locationd.kalman.helpers.ekf_sym import REWIND_TO_KEEP
+  from selfdrive.locationd.kalman.models.live_kf import LiveKalman
+  from selfdrive.locationd.test.test_ekf_sym import imu_observations, run_filter
+
+  kf = LiveKalman()
+  run_filter(kf, imu_observations(100))
+  n = 20
+  z = np.random.normal(0., 0.01, (n, 3))
+  R = kf.get_R(ObservationKind.PHONE_GYRO, n)
+  t = [kf.filter.filter_time]
+
+  def update():
+    t[0] += 0.01
+    kf.filter.predict_and_update_batch(t[0], ObservationKind.PHONE_GYRO, z, R)
+  print("ekf, batch of %d gyro observations: %.1f us" % (n, best_of(update, 100, repeat=5) * 1e6))
+
+  kf = LiveKalman()
+  observations = imu_observations(2 * REWIND_TO_KEEP)
+  run_filter(kf, observations[:REWIND_TO_KEEP])
+  t = time.monotonic()
+  run_filter(kf, observations[REWIND_TO_KEEP:])
+  print("ekf, with checkpoints: %.1f us per imu observation" % ((time.monotonic() - t) / REWIND_TO_KEEP * 1e6))
+
+
+def bench_locationd():
+  from selfdrive.locationd.test.test_locationd import random_localizer, ref_live_location_msg
+
+  localizer = random_localizer(0)
+  t_ref = best_of(lambda: ref_live_location_msg(localizer), 1000)
+  t = best_of(lambda: localizer.liveLocationMsg(0.), 1000)
+  print("liveLocationKalman: %.1f us -> %.1f us per message" % (t_ref * 1e6, t * 1e6))
+
+
+BENCHMARKS = {
+  "interp": bench_interp,
+  "tracing": bench_tracing,
+  "pathplanner": bench_pathplanner,
+  "lateral_mpc": bench_lateral_mpc,
+  "long_mpc": bench_long_mpc,
+  "ekf": bench_ekf,
+  "locationd": bench_locationd,
+}
+
+
+if __name__ == "__main__":
+  names = sys.argv[1:] or list(BENCHMARKS)
+  for name in names:
+    if name not in BENCHMARKS:
+      sys.exit("unknown benchmark %s, one of: %s" % (name, ", ".join(BENCHMARKS)))
+  for name in names:
+    BENCHMARKS[name]()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Aggregates the trace rings of all processes (see common/tracing.py).
+
+Run the processes with TRACE=1, then while they run:
+  trace_dump.py                   per stack summary, sorted by total time
+  trace_dump.py --folded          folded stacks, input for flamegraph.pl
+  trace_dump.py --chrome out.json chrome://tracing / perfetto json
+"""
+import os
+import sys
+import json
+import argparse
+from collections import defaultdict
+
+from common.tracing import TRACE_DIR, KIND_SPAN, KIND_COUNTER, list_rings, read_ring
+
+
+def load_rings(trace_dir=TRACE_DIR):
+  """Returns a list of (process name, pid, records) for all readable rings"""
+  rings = []
+  for path in list_rings(trace_dir):
+    try:
+      rings.append(read_ring(path))
+    except (OSError, ValueError) as e:
+      print("skipping %s: %s" % (path, e), file=sys.stderr)
+  return rings
+
+
+def build_stacks(process_name, records):
+  """Nests the spans of each thread by time containment.
+
+  Returns a list of (stack, dur_ns, self_ns), stack being a tuple of names starting with the process name."""
+  by_thread = defaultdict(list)
+  for kind, name, start_ns, dur_ns, _, tid in records:
+    if kind == KIND_SPAN:
+      by_thread[tid].append((start_ns, -dur_ns, name))
+
+  ret = []
+  for spans in by_thread.values():
+    spans.sort()
+    open_spans = []  # (end, index into ret)
+    for start_ns, neg_dur_ns, name in spans:
+      dur_ns = -neg_dur_ns
+      while open_spans and open_spans[-1][0] <= start_ns:
+        open_spans.pop()
+
+      if open_spans:
+        parent = open_spans[-1][1]
+        stack = ret[parent][0] + (name,)
+        ret[parent][2] -= dur_ns
+      else:
+        stack = (process_name, name)
+
+      ret.append([stack, dur_ns, dur_ns])
+      open_spans.append((start_ns + dur_ns, len(ret) - 1))
+  return [tuple(r) for r in ret]
+
+
+def summarize(rings):
+  """Returns {stack: [count, total_ns, self_ns, max_ns]}"""
+  stats = {}
+  for process_name, _, records in rings:
+    for stack, dur_ns, self_ns in build_stacks(process_name, records):
+      s = stats.get(stack)
+      if s is None:
+        stats[stack] = [1, dur_ns, self_ns, dur_ns]
+      else:
+        s[0] += 1
+        s[1] += dur_ns
+        s[2] += self_ns
+        s[3] = max(s[3], dur_ns)
+  return stats
+
+
+def chrome_trace(rings):
+  events = []
+  for process_name, pid, records in rings:
+    events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": process_name}})
+    for kind, name, start_ns, dur_ns, value, tid in records:
+      if kind == KIND_SPAN:
+        events.append({"name": name, "ph": "X", "ts": start_ns / 1e3, "dur": dur_ns / 1e3, "pid": pid, "tid": tid})
+      elif kind == KIND_COUNTER:
+        events.append({"name": name, "ph": "C", "ts": start_ns / 1e3, "pid": pid, "args": {name: value}})
+  return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def print_summary(stats):
+  print("%-60s %8s %10s %10s %9s %9s" % ("stack", "count", "total ms", "self ms", "mean ms", "max ms"))
+  for stack, (cnt, total_ns, self_ns, max_ns) in sorted(stats.items(), key=lambda x: -x[1][1]):
+    print("%-60s %8d %10.2f %10.2f %9.3f %9.3f" % (";".join(stack), cnt, total_ns / 1e6, self_ns / 1e6,
+                                                  total_ns / cnt / 1e6, max_ns / 1e6))
+
+
+def print_folded(stats):
+  for stack, (_, _, self_ns, _) in sorted(stats.items()):
+    print("%s %d" % (";".join(stack), self_ns // 1000))
+
+
+def clean(trace_dir=TRACE_DIR):
+  """Removes the rings of processes that are no longer running"""
+  for path in list_rings(trace_dir):
+    pid = int(path.rsplit('.', 1)[-1])
+    try:
+      os.kill(pid, 0)
+    except ProcessLookupError:
+      os.unlink(path)
+    except PermissionError:
+      pass
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Aggregate the trace rings of all processes")
+  parser.add_argument("--dir", default=TRACE_DIR, help="trace ring directory")
+  parser.add_argument("--folded", action="store_true", help="print folded stacks for flamegraph.pl")
+  parser.add_argument("--chrome", help="write a chrome trace json to this file")
+  parser.add_argument("--clean", action="store_true", help="remove rings of exited processes and quit")
+  args = parser.parse_args()
+
+  if args.clean:
+    clean(args.dir)
+    sys.exit(0)
+
+  rings = load_rings(args.dir)
+  if args.chrome:
+    with open(args.chrome, 'w') as f:
+      json.dump(chrome_trace(rings), f)
+  elif args.folded:
+    print_folded(summarize(rings))
+  else:
+    print_summary(summarize(rings))
@@ -130,31 +130,43 @@ class Calibrator():
     pm.send('liveCalibration', cal_send)
 
 
-def calibrationd_thread(sm=None, pm=None):
-  if sm is None:
-    sm = messaging.SubMaster(['cameraOdometry'])
-
-  if pm is None:
-    pm = messaging.PubMaster(['liveCalibration'])
-
-  calibrator = Calibrator(param_put=True)
-
-  send_counter = 0
-  while 1:
+class Calibrationd():
+  def __init__(self, sm=None, pm=None):
+    self.sm = sm
+    if self.sm is None:
+      self.sm = messaging.SubMaster(['cameraOdometry'])
+
+    self.pm = pm
+    if self.pm is None:
+      self.pm = messaging.PubMaster(['liveCalibration'])
+
+    self.calibrator = Calibrator(param_put=True)
+    self.send_counter = 0
+
+  def step(self):
+    """Runs one iteration of the calibrationd loop"""
+    sm = self.sm
     sm.update()
 
+    new_vp = None
     if sm.updated['cameraOdometry']:
-      new_vp = calibrator.handle_cam_odom(sm['cameraOdometry'].trans,
-                                          sm['cameraOdometry'].rot,
-                                          sm['cameraOdometry'].transStd,
-                                          sm['cameraOdometry'].rotStd)
+      new_vp = self.calibrator.handle_cam_odom(sm['cameraOdometry'].trans,
+                                               sm['cameraOdometry'].rot,
+                                               sm['cameraOdometry'].transStd,
+                                               sm['cameraOdometry'].rotStd)
     if DEBUG and new_vp is not None:
       print('got new vp', new_vp)
 
     # decimate outputs for efficiency
-    if (send_counter % 5) == 0:
-      calibrator.send_data(pm)
-    send_counter += 1
+    if (self.send_counter % 5) == 0:
+      self.calibrator.send_data(self.pm)
+    self.send_counter += 1
+
+
+def calibrationd_thread(sm=None, pm=None):
+  calibrationd = Calibrationd(sm, pm)
+  while 1:
+    calibrationd.step()
 
 
 def main(sm=None, pm=None):
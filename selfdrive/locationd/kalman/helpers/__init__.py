@@ -1,11 +1,18 @@
 import numpy as np
 import os
+import glob
+import fcntl
+import shutil
+import hashlib
+import tempfile
 from bisect import bisect
 from tqdm import tqdm
 from cffi import FFI
 
-TEMPLATE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'templates'))
-GENERATED_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'generated'))
+HELPERS_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.abspath(os.path.join(HELPERS_DIR, '..', 'templates'))
+GENERATED_DIR = os.path.abspath(os.path.join(HELPERS_DIR, '..', 'generated'))
+CACHE_DIR = os.getenv("KALMAN_CACHE_DIR", "/tmp/kalman_cache")
 
 
 def write_code(name, code, header):
@@ -16,6 +23,52 @@ def write_code(name, code, header):
   open(os.path.join(GENERATED_DIR, f"{name}.h"), 'w').write(header)
 
 
+def code_hash(name, sources, args=()):
+  """Content hash of everything the code of name is generated from: the given source files,
+  the generation arguments, the helpers, the templates and the sympy version"""
+  import sympy
+
+  h = hashlib.sha1()
+  h.update(f"{name} {args!r} {sympy.__version__}".encode('utf8'))
+  helpers = glob.glob(os.path.join(HELPERS_DIR, '*.py')) + glob.glob(os.path.join(HELPERS_DIR, '*.npy'))
+  templates = glob.glob(os.path.join(TEMPLATE_DIR, '*'))
+  for fn in sorted(sources) + sorted(helpers) + sorted(templates):
+    with open(fn, 'rb') as f:
+      h.update(f.read())
+  return h.hexdigest()
+
+
+def generate_code_cached(name, generate, sources, args=()):
+  """Writes the code of name into GENERATED_DIR by calling generate(*args), unless CACHE_DIR has
+  a copy that was generated from the same content, see code_hash. Then sympy is skipped entirely.
+
+  Cache entries are written to a temporary directory and renamed into place, and every entry has
+  its own lock, so concurrent builds of the same code wait for the first one instead of
+  generating it again."""
+  key = f"{name}_{code_hash(name, sources, args)}"
+  entry = os.path.join(CACHE_DIR, key)
+  files = [f"{name}.cpp", f"{name}.h"]
+
+  os.makedirs(CACHE_DIR, exist_ok=True)
+  with open(entry + ".lock", 'w') as lock:
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    if os.path.isdir(entry):
+      os.makedirs(GENERATED_DIR, exist_ok=True)
+      for fn in files:
+        tmp = os.path.join(GENERATED_DIR, f".{fn}.tmp{os.getpid()}")
+        shutil.copyfile(os.path.join(entry, fn), tmp)
+        os.replace(tmp, os.path.join(GENERATED_DIR, fn))
+      return False
+
+    print(f"cache miss {key}")
+    generate(*args)
+    tmp = tempfile.mkdtemp(dir=CACHE_DIR)
+    for fn in files:
+      shutil.copyfile(os.path.join(GENERATED_DIR, fn), os.path.join(tmp, fn))
+    os.rename(tmp, entry)
+    return True
+
+
 def load_code(name):
   shared_fn = os.path.join(GENERATED_DIR, f"lib{name}.so")
   header_fn = os.path.join(GENERATED_DIR, f"{name}.h")
@@ -109,12 +162,8 @@ SAT_OBS = [ObservationKind.PSEUDORANGE_GPS,
 
 def run_car_ekf_offline(kf, observations_by_kind):
   from laika.raw_gnss import GNSSMeasurement
-  observations = []
-  # create list of observations with element format: [kind, time, data]
-  for kind in observations_by_kind:
-    for t, data in zip(observations_by_kind[kind][0], observations_by_kind[kind][1]):
-      observations.append([t, kind, data])
-  observations.sort(key=lambda obs: obs[0])
+  from selfdrive.locationd.kalman.helpers.offline import sorted_observations
+  observations = sorted_observations(observations_by_kind)
 
   times, estimates = run_observations_through_filter(kf, observations)
 
@@ -1,5 +1,4 @@
 import os
-from bisect import bisect_right
 
 import numpy as np
 import sympy as sp
@@ -11,6 +10,9 @@ from selfdrive.locationd.kalman.helpers import (TEMPLATE_DIR, load_code,
 
 from selfdrive.locationd.kalman.helpers.chi2_lookup import chi2_ppf
 
+# number of checkpoints kept for rewinding
+REWIND_TO_KEEP = 512
+
 
 def solve(a, b):
   if a.shape[0] == 1 and a.shape[1] == 1:
@@ -134,8 +136,18 @@ def gen_code(name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_params=No
         update<%d,%d,%d>(in_x, in_P, h_%d, H_%d, %s, in_z, in_R, in_ea, MAHA_THRESH_%d);
       }
     """ % (kind, h_sym.shape[0], 3, maha_test, kind, kind, He_str, kind)
+    extra_post += """
+      void update_batch_%d(int n, double *in_x, double *in_P, double *in_z, double *in_R, double *in_ea, int ea_dim) {
+        update_batch<%d,%d,%d>(n, in_x, in_P, h_%d, H_%d, %s, in_z, in_R, in_ea, ea_dim, MAHA_THRESH_%d);
+      }
+    """ % (kind, h_sym.shape[0], 3, maha_test, kind, kind, He_str, kind)
+    extra_post += """
+      int zdim_%d() { return %d; }
+    """ % (kind, h_sym.shape[0])
     extra_header += "\nconst static double MAHA_THRESH_%d = %f;" % (kind, maha_thresh)
     extra_header += "\nvoid update_%d(double *, double *, double *, double *, double *);" % kind
+    extra_header += "\nvoid update_batch_%d(int, double *, double *, double *, double *, double *, int);" % kind
+    extra_header += "\nint zdim_%d();" % kind
 
   code += '\nextern "C"{\n' + extra_header + "\n}\n"
   code += "\n" + open(os.path.join(TEMPLATE_DIR, "ekf_c.c")).read()
@@ -156,6 +168,78 @@ def gen_code(name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_params=No
   write_code(name, code, header)
 
 
+class RewindBuffer():
+  """Preallocated circular store of filter checkpoints, oldest first.
+
+  Every checkpoint holds the filter time, state, covariance and the observation
+  that produced it. Checkpoints are copied into fixed slots, so pushing one
+  allocates nothing and drops the oldest when full.
+  """
+  def __init__(self, capacity, dim_x, dim_err):
+    self.capacity = capacity
+    self.t = np.zeros(capacity, dtype=np.float64)
+    self.x = np.zeros((capacity, dim_x, 1), dtype=np.float64)
+    self.P = np.zeros((capacity, dim_err, dim_err), dtype=np.float64)
+    self.obs = [None] * capacity
+    # views into the slots, indexing the arrays would create new ones every time
+    self._x_slots = list(self.x)
+    self._P_slots = list(self.P)
+    self.clear()
+
+  def clear(self):
+    self.start = 0
+    self.count = 0
+    self.obs[:] = [None] * self.capacity
+
+  def __len__(self):
+    return self.count
+
+  def first_t(self):
+    return self.t[self.start]
+
+  def last_t(self):
+    return self.t[(self.start + self.count - 1) % self.capacity]
+
+  def push(self, t, x, P, obs):
+    if self.count == self.capacity:
+      i = self.start
+      self.start = (self.start + 1) % self.capacity
+    else:
+      i = (self.start + self.count) % self.capacity
+      self.count += 1
+    self.t[i] = t
+    np.copyto(self._x_slots[i], x)
+    np.copyto(self._P_slots[i], P)
+    self.obs[i] = obs
+
+  def bisect(self, t):
+    """Returns the number of checkpoints at or before t"""
+    lo, hi = 0, self.count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if t < self.t[(self.start + mid) % self.capacity]:
+        hi = mid
+      else:
+        lo = mid + 1
+    return lo
+
+  def rewind(self, idx, x, P):
+    """Copies checkpoint idx into x and P and drops all checkpoints after it.
+
+    Returns the time of the checkpoint and the observations that were dropped, oldest first."""
+    i = (self.start + idx) % self.capacity
+    np.copyto(x, self._x_slots[i])
+    np.copyto(P, self._P_slots[i])
+
+    obs = []
+    for j in range(idx + 1, self.count):
+      k = (self.start + j) % self.capacity
+      obs.append(self.obs[k])
+      self.obs[k] = None
+    self.count = idx + 1
+    return float(self.t[i]), obs
+
+
 class EKF_sym():
   def __init__(self, name, Q, x_initial, P_initial, dim_main, dim_main_err,
                N=0, dim_augment=0, dim_augment_err=0, maha_test_kinds=[], global_vars=None):
@@ -185,9 +269,7 @@ class EKF_sym():
     self.Q = Q
 
     # rewind stuff
-    self.rewind_t = []
-    self.rewind_states = []
-    self.rewind_obscache = []
+    self.rewind_buffer = RewindBuffer(REWIND_TO_KEEP, self.dim_x, self.dim_err)
     self.init_state(x_initial, P_initial, None)
 
     ffi, lib = load_code(name)
@@ -232,8 +314,9 @@ class EKF_sym():
     self.inv_err_function = wrap_2lists("inv_err_fun")
     self.H_mod = wrap_1lists("H_mod_fun")
 
-    self.hs, self.Hs, self.Hes = {}, {}, {}
+    self.hs, self.Hs, self.Hes, self.z_dims = {}, {}, {}, {}
     for kind in kinds:
+      self.z_dims[kind] = getattr(lib, "zdim_%d" % kind)()
       self.hs[kind] = wrap_2lists("h_%d" % kind)
       self.Hs[kind] = wrap_2lists("H_%d" % kind)
       if self.msckf and kind in self.feature_track_kinds:
@@ -252,44 +335,43 @@ class EKF_sym():
                   ffi.cast("double", dt))
       return x, P
 
-    # wrap the C++ update function
+    # wrap the C++ batch update function, all observations of a call are updated in one go
     def fun_wrapper(f, kind):
       f = eval("lib.%s" % f, {"lib": lib})
 
       def _update_inner_blas(x, P, z, R, extra_args):
-        f(ffi.cast("double *", x.ctypes.data),
+        f(len(z),
+          ffi.cast("double *", x.ctypes.data),
           ffi.cast("double *", P.ctypes.data),
           ffi.cast("double *", z.ctypes.data),
           ffi.cast("double *", R.ctypes.data),
-          ffi.cast("double *", extra_args.ctypes.data))
+          ffi.cast("double *", extra_args.ctypes.data),
+          extra_args.shape[1])
         if self.msckf and kind in self.feature_track_kinds:
-          y = z[:-len(extra_args)]
+          y = z[:, :-extra_args.shape[1]]
         else:
           y = z
-        return x, P, y
+        return x, P, list(y)
       return _update_inner_blas
 
     self._updates = {}
     for kind in kinds:
-      self._updates[kind] = fun_wrapper("update_%d" % kind, kind)
+      self._updates[kind] = fun_wrapper("update_batch_%d" % kind, kind)
 
-    def _update_blas(x, P, kind, z, R, extra_args=[]):
+    def _update_batch_blas(x, P, kind, z, R, extra_args):
         return self._updates[kind](x, P, z, R, extra_args)
 
     # assign the functions
     self._predict = _predict_blas
     # self._predict = self._predict_python
-    self._update = _update_blas
-    # self._update = self._update_python
+    self._update_batch = _update_batch_blas
 
   def init_state(self, state, covs, filter_time):
     self.x = np.array(state.reshape((-1, 1))).astype(np.float64)
     self.P = np.array(covs).astype(np.float64)
     self.filter_time = filter_time
     self.augment_times = [0] * self.N
-    self.rewind_obscache = []
-    self.rewind_t = []
-    self.rewind_states = []
+    self.rewind_buffer.clear()
 
   def augment(self):
     # TODO this is not a generalized way of doing this and implies that the augmented states
@@ -327,37 +409,17 @@ class EKF_sym():
 
   def rewind(self, t):
     # find where we are rewinding to
-    idx = bisect_right(self.rewind_t, t)
-    assert self.rewind_t[idx - 1] <= t
-    assert self.rewind_t[idx] > t    # must be true, or rewind wouldn't be called
-
-    # set the state to the time right before that
-    self.filter_time = self.rewind_t[idx - 1]
-    self.x[:] = self.rewind_states[idx - 1][0]
-    self.P[:] = self.rewind_states[idx - 1][1]
-
-    # return the observations we rewound over for fast forwarding
-    ret = self.rewind_obscache[idx:]
-
-    # throw away the old future
-    # TODO: is this making a copy?
-    self.rewind_t = self.rewind_t[:idx]
-    self.rewind_states = self.rewind_states[:idx]
-    self.rewind_obscache = self.rewind_obscache[:idx]
+    idx = self.rewind_buffer.bisect(t)
+    assert 0 < idx < len(self.rewind_buffer)    # must be true, or rewind wouldn't be called
 
+    # set the state to the time right before that, throw away the old future
+    # and return the observations we rewound over for fast forwarding
+    self.filter_time, ret = self.rewind_buffer.rewind(idx - 1, self.x, self.P)
     return ret
 
   def checkpoint(self, obs):
-    # push to rewinder
-    self.rewind_t.append(self.filter_time)
-    self.rewind_states.append((np.copy(self.x), np.copy(self.P)))
-    self.rewind_obscache.append(obs)
-
-    # only keep a certain number around
-    REWIND_TO_KEEP = 512
-    self.rewind_t = self.rewind_t[-REWIND_TO_KEEP:]
-    self.rewind_states = self.rewind_states[-REWIND_TO_KEEP:]
-    self.rewind_obscache = self.rewind_obscache[-REWIND_TO_KEEP:]
+    # push to rewinder, the oldest checkpoint is dropped when it is full
+    self.rewind_buffer.push(self.filter_time, self.x, self.P, obs)
 
   def predict(self, t):
     # initialize time
@@ -375,7 +437,7 @@ class EKF_sym():
 
     # rewind
     if self.filter_time is not None and t < self.filter_time:
-      if len(self.rewind_t) == 0 or t < self.rewind_t[0] or t < self.rewind_t[-1] - 1.0:
+      if len(self.rewind_buffer) == 0 or t < self.rewind_buffer.first_t() or t < self.rewind_buffer.last_t() - 1.0:
         print("observation too old at %.3f with filter at %.3f, ignoring" % (t, self.filter_time))
         return None
       rewound = self.rewind(t)
@@ -418,14 +480,19 @@ class EKF_sym():
 
     # update batch
     y = []
-    for i in range(len(z)):
-      # these are from the user, so we canonicalize them
-      z_i = np.array(z[i], dtype=np.float64, order='F')
-      R_i = np.array(R[i], dtype=np.float64, order='F')
-      extra_args_i = np.array(extra_args[i], dtype=np.float64, order='F')
-      # update
-      self.x, self.P, y_i = self._update(self.x, self.P, kind, z_i, R_i, extra_args=extra_args_i)
-      y.append(y_i)
+    if len(z) > 0:
+      # these are from the user, so we canonicalize them, z is copied as it gets overwritten with the residuals
+      z_batch = np.array(z, dtype=np.float64, order='C', ndmin=2)
+      R_batch = np.ascontiguousarray(R, dtype=np.float64)
+      extra_args_batch = np.array(extra_args, dtype=np.float64, order='C', ndmin=2)
+
+      # the C update reads n rows of every buffer, nothing is checked on the other side
+      n, dim_z = len(z_batch), self.z_dims[kind]
+      assert z_batch.shape == (n, dim_z), "z has shape %s, expected %s" % (z_batch.shape, (n, dim_z))
+      assert R_batch.shape == (n, dim_z, dim_z), "R has shape %s, expected %s" % (R_batch.shape, (n, dim_z, dim_z))
+      assert extra_args_batch.shape[0] == (1 if extra_args_batch.shape[1] == 0 else n), \
+        "extra_args has shape %s for %d observations" % (extra_args_batch.shape, n)
+      self.x, self.P, y = self._update_batch(self.x, self.P, kind, z_batch, R_batch, extra_args_batch)
     xk_k, Pk_k = np.copy(self.x).flatten(), np.copy(self.P)
 
     if augment:
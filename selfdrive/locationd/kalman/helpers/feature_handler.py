@@ -5,8 +5,9 @@ import os
 import numpy as np
 
 import common.transformations.orientation as orient
-from selfdrive.locationd.kalman.helpers import (TEMPLATE_DIR, load_code,
-                                                write_code)
+from selfdrive.locationd.kalman.helpers import (TEMPLATE_DIR,
+                                                generate_code_cached,
+                                                load_code, write_code)
 from selfdrive.locationd.kalman.helpers.sympy_helpers import quat_matrix_l
 
 
@@ -155,4 +156,5 @@ def generate_orient_error_jac(K):
 
 if __name__ == "__main__":
   # TODO: get K from argparse
-  FeatureHandler.generate_code()
+  K = 5
+  generate_code_cached(f"{FeatureHandler.name}_{K}", FeatureHandler.generate_code, [__file__], (K,))
@@ -6,8 +6,9 @@ import numpy as np
 import sympy as sp
 
 import common.transformations.orientation as orient
-from selfdrive.locationd.kalman.helpers import (TEMPLATE_DIR, load_code,
-                                                write_code)
+from selfdrive.locationd.kalman.helpers import (TEMPLATE_DIR,
+                                                generate_code_cached,
+                                                load_code, write_code)
 from selfdrive.locationd.kalman.helpers.sympy_helpers import (quat_rotate,
                                                               sympy_into_c)
 
@@ -172,5 +173,5 @@ def project(poses, ecef_pos):
 
 if __name__ == "__main__":
   K = int(sys.argv[1].split("_")[-1])
-  LstSqComputer.generate_code(K=K)
+  generate_code_cached(f"{LstSqComputer.name}_{K}", LstSqComputer.generate_code, [__file__], (K,))
 
@@ -0,0 +1,157 @@
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+
+class FixedLagSmoother():
+  """Filters a stream of observations and RTS smooths the estimates over a sliding window.
+
+  Estimates are smoothed a chunk at a time, once lag estimates after the chunk are known, so at
+  most chunk + lag + 1 estimates are kept. The last ones are smoothed by flush at the end of the
+  stream. Every state is smoothed with at least lag estimates after it, with a lag longer than
+  the stream this is the full RTS smoother.
+  """
+  def __init__(self, kf, lag=2000, chunk=2000):
+    self.kf = kf
+    self.lag = lag
+    self.chunk = chunk
+    self.window = []
+    # the window starts with the last estimate of the previous chunk, which was already returned
+    self.head = 0
+
+  def observe(self, t, kind, data):
+    """Filters an observation. Returns the smoothed (times, states, covs) of a chunk when one is
+    done and None otherwise."""
+    estimate = self.kf.predict_and_observe(t, kind, data)
+    if estimate is None:
+      # too old to be filtered
+      return None
+
+    # only what the smoother needs, the residuals and observations are dropped
+    self.window.append(estimate[:5])
+    if len(self.window) >= self.head + self.chunk + self.lag:
+      return self._smooth(self.chunk)
+    return None
+
+  def flush(self):
+    """Smooths all remaining estimates, returns None if there are none"""
+    if len(self.window) == self.head:
+      return None
+    return self._smooth(len(self.window) - self.head)
+
+  def _smooth(self, n):
+    # rts_smooth works on the estimates in place, the rest of the window is smoothed again later.
+    # It also post processes every state (like normalizing quaternions) when smoothing the one
+    # before it, so the window keeps the state before the chunk.
+    window = [(np.copy(xk_km1), np.copy(xk_k), Pk_km1, np.copy(Pk_k), t, None, None, None, None)
+              for xk_km1, xk_k, Pk_km1, Pk_k, t in self.window]
+    states, covs = self.kf.rts_smooth(window)
+
+    chunk = slice(self.head, self.head + n)
+    times = np.array([e[4] for e in self.window[chunk]])
+    self.window = self.window[chunk.stop - 1:]
+    self.head = 1
+    return times, states[chunk], covs[chunk]
+
+
+class ColumnWriter():
+  """Writes rows of named float64 columns to one compressed .npz file, with an array per column.
+
+  Rows are appended to a raw file per column and packed into the .npz on close, so the columns
+  are never held in memory. The file is only renamed into place by close, abort drops the rows."""
+  def __init__(self, fn):
+    self.fn = fn
+    self.tmpdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(fn)))
+    self.columns = {}
+
+  def append(self, **columns):
+    for name, values in columns.items():
+      values = np.ascontiguousarray(values, dtype=np.float64)
+      if name not in self.columns:
+        self.columns[name] = (open(os.path.join(self.tmpdir, name), 'wb'), values.shape[1:])
+      values.tofile(self.columns[name][0])
+
+  def _close_columns(self):
+    for f, _ in self.columns.values():
+      f.close()
+
+  def abort(self):
+    """Drops everything written so far, fn is left untouched"""
+    self._close_columns()
+    shutil.rmtree(self.tmpdir)
+
+  def close(self):
+    """Writes fn, to be called once all rows are appended"""
+    self._close_columns()
+    try:
+      arrays = {}
+      for name, (f, shape) in self.columns.items():
+        n = os.path.getsize(f.name) // (8 * int(np.prod(shape)))
+        if n == 0:
+          arrays[name] = np.zeros((0,) + shape)
+        else:
+          arrays[name] = np.memmap(f.name, dtype=np.float64, mode='r', shape=(n,) + shape)
+
+      tmp_fn = os.path.join(self.tmpdir, "out.npz")
+      np.savez_compressed(tmp_fn, **arrays)
+      os.replace(tmp_fn, self.fn)
+    finally:
+      shutil.rmtree(self.tmpdir)
+
+
+def sorted_observations(observations_by_kind):
+  """Turns {kind: (times, data)} into a time sorted list of (t, kind, data)"""
+  observations = []
+  for kind in observations_by_kind:
+    for t, data in zip(observations_by_kind[kind][0], observations_by_kind[kind][1]):
+      observations.append((t, kind, data))
+  observations.sort(key=lambda obs: obs[0])
+  return observations
+
+
+def smooth_route(make_kf, observations, fn, lag=2000, chunk=2000):
+  """Filters and smooths the observations of a route, an iterable of time sorted (t, kind, data),
+  with a FixedLagSmoother. Writes the columns t, x and std, the standard deviations of the
+  smoothed states, to fn."""
+  smoother = FixedLagSmoother(make_kf(), lag, chunk)
+  writer = ColumnWriter(fn)
+
+  def write(smoothed):
+    if smoothed is not None:
+      t, states, covs = smoothed
+      writer.append(t=t, x=states, std=np.sqrt(np.diagonal(covs, axis1=1, axis2=2)))
+
+  try:
+    for t, kind, data in observations:
+      write(smoother.observe(t, kind, data))
+    write(smoother.flush())
+  except BaseException:
+    # no output rather than a route that silently ends early
+    writer.abort()
+    raise
+  writer.close()
+  return fn
+
+
+def _smooth_route_job(args):
+  make_kf, load_observations, route, fn, lag, chunk = args
+  return route, smooth_route(make_kf, load_observations(route), fn, lag, chunk)
+
+
+def smooth_routes(make_kf, load_observations, routes, out_dir, lag=2000, chunk=2000, processes=None):
+  """Smooths many routes in parallel processes, see smooth_route. Every process builds its own
+  filter with make_kf(), load_observations(route) returns the observations of a route. Both
+  have to be picklable, e.g. module level functions.
+
+  Returns {route: output file}, the file of a route is <out_dir>/<route>.npz"""
+  os.makedirs(out_dir, exist_ok=True)
+  jobs = []
+  for route in routes:
+    fn = os.path.join(out_dir, str(route).replace('|', '_').replace('/', '_') + ".npz")
+    jobs.append((make_kf, load_observations, route, fn, lag, chunk))
+
+  with multiprocessing.Pool(processes) as pool:
+    return dict(pool.imap_unordered(_smooth_route_job, jobs))
@@ -4,7 +4,7 @@ import math
 import numpy as np
 import sympy as sp
 
-from selfdrive.locationd.kalman.helpers import ObservationKind
+from selfdrive.locationd.kalman.helpers import ObservationKind, generate_code_cached
 from selfdrive.locationd.kalman.helpers.ekf_sym import EKF_sym, gen_code
 
 i = 0
@@ -189,8 +189,8 @@ class CarKalman():
   def predict_and_observe(self, t, kind, data):
     if len(data) > 0:
       data = np.atleast_2d(data)
-    self.filter.predict_and_update_batch(t, kind, data, self.get_R(kind, len(data)))
+    return self.filter.predict_and_update_batch(t, kind, data, self.get_R(kind, len(data)))
 
 
 if __name__ == "__main__":
-  CarKalman.generate_code()
+  generate_code_cached(CarKalman.name, CarKalman.generate_code, [__file__])
@@ -2,7 +2,8 @@
 import numpy as np
 import sympy as sp
 
-from selfdrive.locationd.kalman.helpers import KalmanError, ObservationKind
+from selfdrive.locationd.kalman.helpers import (KalmanError, ObservationKind,
+                                                generate_code_cached)
 from selfdrive.locationd.kalman.helpers.ekf_sym import EKF_sym, gen_code
 from selfdrive.locationd.kalman.helpers.sympy_helpers import (euler_rotate,
                                                               quat_matrix_r,
@@ -281,4 +282,4 @@ class LiveKalman():
 
 
 if __name__ == "__main__":
-  LiveKalman.generate_code()
+  generate_code_cached(LiveKalman.name, LiveKalman.generate_code, [__file__])
@@ -120,4 +120,14 @@ void update(double *in_x, double *in_P, Hfun h_fun, Hfun H_fun, Hfun Hea_fun, do
   memcpy(in_z, y.data(), y.rows() * sizeof(double));
 }
 
+// updates n observations of one kind in a row, the rows of in_z are
+// overwritten with the residuals like in update. in_z holds n*ZDIM, in_R
+// n*ZDIM*ZDIM and in_ea n*ea_dim doubles, the caller checks the shapes
+template <int ZDIM, int EADIM, bool MAHA_TEST>
+void update_batch(int n, double *in_x, double *in_P, Hfun h_fun, Hfun H_fun, Hfun Hea_fun, double *in_z, double *in_R, double *in_ea, int ea_dim, double MAHA_THRESHOLD) {
+  for (int i = 0; i < n; i++) {
+    update<ZDIM, EADIM, MAHA_TEST>(in_x, in_P, h_fun, H_fun, Hea_fun, in_z + i*ZDIM, in_R + i*ZDIM*ZDIM, in_ea + i*ea_dim, MAHA_THRESHOLD);
+  }
+}
+
 
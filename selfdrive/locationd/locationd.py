@@ -7,9 +7,9 @@ import cereal.messaging as messaging
 import common.transformations.coordinates as coord
 from common.transformations.orientation import (ecef_euler_from_ned,
                                                 euler_from_quat,
-                                                ned_euler_from_ecef,
                                                 quat_from_euler,
                                                 rot_from_quat, rot_from_euler)
+from common.tracing import trace
 from selfdrive.locationd.kalman.helpers import ObservationKind, KalmanError
 from selfdrive.locationd.kalman.models.live_kf import LiveKalman, States
 from selfdrive.swaglog import cloudlog
@@ -21,8 +21,32 @@ VISION_DECIMATION = 2
 SENSOR_DECIMATION = 10
 
 
-def to_float(arr):
-  return [float(arr[0]), float(arr[1]), float(arr[2])]
+# The Measurement fields of liveLocationKalman, in the order of the rows of Localizer.out. Rows
+# that are copied from the state come first, then the ones that are rotated from it.
+COPIED_FIELDS = ['positionECEF', 'velocityECEF', 'accelerationDevice', 'angularVelocityDevice']
+ROTATED_FIELDS = ['velocityNED', 'velocityDevice', 'velocityCalibrated', 'accelerationCalibrated',
+                  'angularVelocityCalibrated']
+FIELDS = COPIED_FIELDS + ROTATED_FIELDS + ['positionGeodetic', 'orientationECEF', 'orientationNED']
+ROTATED = slice(len(COPIED_FIELDS), len(COPIED_FIELDS) + len(ROTATED_FIELDS))
+POS_GEO, ORIENTATION_ECEF, ORIENTATION_NED = range(ROTATED.stop, len(FIELDS))
+
+# state and error state indices of the vectors that are copied, followed by the ones that are rotated
+STATE_IDX = np.array([np.r_[s] for s in [States.ECEF_POS, States.ECEF_VELOCITY, States.ACCELERATION,
+                                         States.ANGULAR_VELOCITY,
+                                         States.ECEF_VELOCITY, States.ECEF_VELOCITY, States.ECEF_VELOCITY,
+                                         States.ACCELERATION, States.ANGULAR_VELOCITY]])
+STD_IDX = np.array([np.r_[s] for s in [States.ECEF_POS_ERR, States.ECEF_VELOCITY_ERR, States.ACCELERATION_ERR,
+                                       States.ANGULAR_VELOCITY_ERR,
+                                       States.ECEF_VELOCITY_ERR, States.ECEF_VELOCITY_ERR, States.ECEF_VELOCITY_ERR,
+                                       States.ACCELERATION_ERR, States.ANGULAR_VELOCITY_ERR]])
+
+
+def euler_from_rots(rots, out):
+  """Roll, pitch and yaw of a stack of rotation matrices, like ned_euler_from_ecef without the loop"""
+  np.arctan2(rots[:, 2, 1], rots[:, 2, 2], out=out[:, 0])
+  np.arctan2(-rots[:, 2, 0], np.hypot(rots[:, 0, 0], rots[:, 1, 0]), out=out[:, 1])
+  np.arctan2(rots[:, 1, 0], rots[:, 0, 0], out=out[:, 2])
+  return out
 
 
 class Localizer():
@@ -36,73 +60,71 @@ class Localizer():
     self.calib_from_device = np.eye(3)
     self.calibrated = 0
 
+    # values and stds of all fields, computed in place by liveLocationMsg
+    self.out = np.zeros((2, len(FIELDS), 3))
+    self.vecs = np.zeros((2, len(STATE_IDX), 3))
+    self.rots = np.zeros((len(ROTATED_FIELDS), 3, 3))
+    self.rots[3:] = self.calib_from_device
+    self.geo = np.zeros((2, 3))
+    self.eulers = np.zeros((2, 3))
+    self.quats = np.zeros((2, 4))
+    self.ned_eulers = np.zeros((2, 3))
+
+    # the message is reused for every publish, its lists are only allocated once
+    self.msg = messaging.new_message('liveLocationKalman')
+    fix = self.msg.liveLocationKalman
+    self.fields = []
+    for name in FIELDS:
+      field = getattr(fix, name)
+      field.valid = True
+      self.fields.append((field.init('value', 3), field.init('std', 3)))
+
   def liveLocationMsg(self, time):
+    """Fills self.msg, the one reused liveLocationKalman event, with the current estimate.
+    Nothing is returned, every call overwrites the previous message."""
     predicted_state = self.kf.x
     predicted_std = np.diagonal(self.kf.P)
-
-    fix_ecef = predicted_state[States.ECEF_POS]
-    fix_ecef_std = predicted_std[States.ECEF_POS_ERR]
-    vel_ecef = predicted_state[States.ECEF_VELOCITY]
-    vel_ecef_std = predicted_std[States.ECEF_VELOCITY_ERR]
-    fix_pos_geo = coord.ecef2geodetic(fix_ecef)
-    fix_pos_geo_std = coord.ecef2geodetic(fix_ecef + fix_ecef_std) - fix_pos_geo
-    ned_vel = self.converter.ecef2ned(fix_ecef + vel_ecef) - self.converter.ecef2ned(fix_ecef)
-    ned_vel_std = self.converter.ecef2ned(fix_ecef + vel_ecef + vel_ecef_std) - self.converter.ecef2ned(fix_ecef + vel_ecef)
-    device_from_ecef = rot_from_quat(predicted_state[States.ECEF_ORIENTATION]).T
-    vel_device = device_from_ecef.dot(vel_ecef)
-    vel_device_std = device_from_ecef.dot(vel_ecef_std)
-    orientation_ecef = euler_from_quat(predicted_state[States.ECEF_ORIENTATION])
-    orientation_ecef_std = predicted_std[States.ECEF_ORIENTATION_ERR]
-    orientation_ned = ned_euler_from_ecef(fix_ecef, orientation_ecef)
-    orientation_ned_std = ned_euler_from_ecef(fix_ecef, orientation_ecef + orientation_ecef_std) - orientation_ned
-    vel_calib = self.calib_from_device.dot(vel_device)
-    vel_calib_std = self.calib_from_device.dot(vel_device_std)
-    acc_calib = self.calib_from_device.dot(predicted_state[States.ACCELERATION])
-    acc_calib_std = self.calib_from_device.dot(predicted_std[States.ACCELERATION_ERR])
-    ang_vel_calib = self.calib_from_device.dot(predicted_state[States.ANGULAR_VELOCITY])
-    ang_vel_calib_std = self.calib_from_device.dot(predicted_std[States.ANGULAR_VELOCITY_ERR])
-
-
-    fix = messaging.log.LiveLocationKalman.new_message()
-    fix.positionGeodetic.value = to_float(fix_pos_geo)
-    fix.positionGeodetic.std = to_float(fix_pos_geo_std)
-    fix.positionGeodetic.valid = True
-    fix.positionECEF.value = to_float(fix_ecef)
-    fix.positionECEF.std = to_float(fix_ecef_std)
-    fix.positionECEF.valid = True
-    fix.velocityECEF.value = to_float(vel_ecef)
-    fix.velocityECEF.std = to_float(vel_ecef_std)
-    fix.velocityECEF.valid = True
-    fix.velocityNED.value = to_float(ned_vel)
-    fix.velocityNED.std = to_float(ned_vel_std)
-    fix.velocityNED.valid = True
-    fix.velocityDevice.value = to_float(vel_device)
-    fix.velocityDevice.std = to_float(vel_device_std)
-    fix.velocityDevice.valid = True
-    fix.accelerationDevice.value = to_float(predicted_state[States.ACCELERATION])
-    fix.accelerationDevice.std = to_float(predicted_std[States.ACCELERATION_ERR])
-    fix.accelerationDevice.valid = True
-
-    fix.orientationECEF.value = to_float(orientation_ecef)
-    fix.orientationECEF.std = to_float(orientation_ecef_std)
-    fix.orientationECEF.valid = True
-    fix.orientationNED.value = to_float(orientation_ned)
-    fix.orientationNED.std = to_float(orientation_ned_std)
-    fix.orientationNED.valid = True
-    fix.angularVelocityDevice.value = to_float(predicted_state[States.ANGULAR_VELOCITY])
-    fix.angularVelocityDevice.std = to_float(predicted_std[States.ANGULAR_VELOCITY_ERR])
-    fix.angularVelocityDevice.valid = True
-
-    fix.velocityCalibrated.value = to_float(vel_calib)
-    fix.velocityCalibrated.std = to_float(vel_calib_std)
-    fix.velocityCalibrated.valid = True
-    fix.angularVelocityCalibrated.value = to_float(ang_vel_calib)
-    fix.angularVelocityCalibrated.std = to_float(ang_vel_calib_std)
-    fix.angularVelocityCalibrated.valid = True
-    fix.accelerationCalibrated.value = to_float(acc_calib)
-    fix.accelerationCalibrated.std = to_float(acc_calib_std)
-    fix.accelerationCalibrated.valid = True
-
+    out, vecs, rots = self.out, self.vecs, self.rots
+
+    np.take(predicted_state, STATE_IDX, out=vecs[0])
+    np.take(predicted_std, STD_IDX, out=vecs[1])
+    out[:, :ROTATED.start] = vecs[:, :ROTATED.start]
+
+    # the orientation and the orientation off by its std, as eulers and rotations in one pass
+    orientation_ecef, quats = self.eulers, self.quats
+    quats[0] = predicted_state[States.ECEF_ORIENTATION]
+    orientation_ecef[0] = euler_from_quat(quats[0])
+    out[1, ORIENTATION_ECEF] = predicted_std[States.ECEF_ORIENTATION_ERR]
+    np.add(orientation_ecef[0], out[1, ORIENTATION_ECEF], out=orientation_ecef[1])
+    out[0, ORIENTATION_ECEF] = orientation_ecef[0]
+    quats[1] = quat_from_euler(orientation_ecef[1])
+    ecef_from_device = rot_from_quat(quats)
+
+    # ned, device and calibrated frames of the velocity, calibrated acceleration and angular velocity
+    rots[0] = self.converter.ecef2ned_matrix
+    rots[1] = ecef_from_device[0].T
+    np.dot(self.calib_from_device, rots[1], out=rots[2])
+    np.matmul(rots, vecs[:, ROTATED.start:, :, None], out=out[:, ROTATED, :, None])
+
+    fix_ecef = out[0, 0]
+    np.add(fix_ecef, out[1, 0], out=self.geo[1])
+    self.geo[0] = fix_ecef
+    fix_pos_geo = coord.ecef2geodetic(self.geo)
+    out[0, POS_GEO] = fix_pos_geo[0]
+    np.subtract(fix_pos_geo[1], fix_pos_geo[0], out=out[1, POS_GEO])
+
+    # the eulers are scale invariant, the rotation of an unnormalized quaternion gives the same angles
+    ned_from_ecef = coord.LocalCoord(fix_pos_geo[0], fix_ecef).ecef2ned_matrix
+    orientation_ned = euler_from_rots(np.matmul(ned_from_ecef, ecef_from_device), self.ned_eulers)
+    out[0, ORIENTATION_NED] = orientation_ned[0]
+    np.subtract(orientation_ned[1], orientation_ned[0], out=out[1, ORIENTATION_NED])
+
+    self.msg.clear_write_flag()
+    for (value, std), v, s in zip(self.fields, out[0].tolist(), out[1].tolist()):
+      value[0], value[1], value[2] = v
+      std[0], std[1], std[2] = s
+
+    fix = self.msg.liveLocationKalman
     #fix.gpsWeek = self.time.week
     #fix.gpsTimeOfWeek = self.time.tow
     fix.unixTimestampMillis = self.unix_timestamp_millis
@@ -113,7 +135,6 @@ class Localizer():
       fix.status = 'uncalibrated'
     else:
       fix.status = 'uninitialized'
-    return fix
 
   def update_kalman(self, time, kind, meas):
     if self.filter_ready:
@@ -215,6 +236,7 @@ class Localizer():
     self.calib = log.rpyCalib
     self.device_from_calib = rot_from_euler(self.calib)
     self.calib_from_device = self.device_from_calib.T
+    self.rots[3:] = self.calib_from_device
     self.calibrated = log.calStatus == 1
 
   def reset_kalman(self):
@@ -228,38 +250,52 @@ class Localizer():
     self.cam_counter = 0
 
 
-def locationd_thread(sm, pm, disabled_logs=[]):
-  if sm is None:
-    sm = messaging.SubMaster(['gpsLocationExternal', 'sensorEvents', 'cameraOdometry', 'liveCalibration'])
-  if pm is None:
-    pm = messaging.PubMaster(['liveLocationKalman'])
+class Locationd():
+  def __init__(self, sm=None, pm=None, disabled_logs=[]):
+    self.sm = sm
+    if self.sm is None:
+      self.sm = messaging.SubMaster(['gpsLocationExternal', 'sensorEvents', 'cameraOdometry', 'liveCalibration'])
 
-  localizer = Localizer(disabled_logs=disabled_logs)
+    self.pm = pm
+    if self.pm is None:
+      self.pm = messaging.PubMaster(['liveLocationKalman'])
 
-  while True:
+    self.localizer = Localizer(disabled_logs=disabled_logs)
+
+  def step(self):
+    """Runs one iteration of the locationd loop"""
+    sm, localizer = self.sm, self.localizer
     sm.update()
 
     for sock, updated in sm.updated.items():
       if updated:
         t = sm.logMonoTime[sock] * 1e-9
-        if sock == "sensorEvents":
-          localizer.handle_sensors(t, sm[sock])
-        elif sock == "gpsLocationExternal":
-          localizer.handle_gps(t, sm[sock])
-        elif sock == "carState":
-          localizer.handle_car_state(t, sm[sock])
-        elif sock == "cameraOdometry":
-          localizer.handle_cam_odo(t, sm[sock])
-        elif sock == "liveCalibration":
-          localizer.handle_live_calib(t, sm[sock])
+        with trace(sock):
+          if sock == "sensorEvents":
+            localizer.handle_sensors(t, sm[sock])
+          elif sock == "gpsLocationExternal":
+            localizer.handle_gps(t, sm[sock])
+          elif sock == "carState":
+            localizer.handle_car_state(t, sm[sock])
+          elif sock == "cameraOdometry":
+            localizer.handle_cam_odo(t, sm[sock])
+          elif sock == "liveCalibration":
+            localizer.handle_live_calib(t, sm[sock])
 
     if localizer.filter_ready and sm.updated['gpsLocationExternal']:
       t = sm.logMonoTime['gpsLocationExternal']
-      msg = messaging.new_message('liveLocationKalman')
-      msg.logMonoTime = t
 
-      msg.liveLocationKalman = localizer.liveLocationMsg(t * 1e-9)
-      pm.send('liveLocationKalman', msg)
+      with trace("liveLocationKalman"):
+        localizer.liveLocationMsg(t * 1e-9)
+        msg = localizer.msg
+        msg.logMonoTime = t
+        self.pm.send('liveLocationKalman', msg)
+
+
+def locationd_thread(sm, pm, disabled_logs=[]):
+  locationd = Locationd(sm, pm, disabled_logs)
+  while True:
+    locationd.step()
 
 
 def main(sm=None, pm=None):
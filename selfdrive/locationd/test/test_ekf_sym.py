@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import unittest
+import tracemalloc
+import numpy as np
+
+from selfdrive.locationd.kalman.helpers import ObservationKind
+from selfdrive.locationd.kalman.helpers.ekf_sym import RewindBuffer, REWIND_TO_KEEP
+from selfdrive.locationd.kalman.models.live_kf import LiveKalman
+
+
+def imu_observations(n, dt=0.01):
+  """Gyro and accelerometer readings at 100 Hz of a device that is standing still"""
+  np.random.seed(0)
+  observations = []
+  for i in range(n):
+    t = 100. + i * dt
+    if i % 2:
+      observations.append((t, ObservationKind.PHONE_GYRO, np.random.normal(0., 0.01, (1, 3))))
+    else:
+      observations.append((t, ObservationKind.PHONE_ACCEL, np.random.normal([9.81, 0., 0.], 0.1, (1, 3))))
+  return observations
+
+
+def run_filter(kf, observations):
+  for t, kind, z in observations:
+    kf.filter.predict_and_update_batch(t, kind, z, kf.get_R(kind, len(z)))
+
+
+class TestRewindBuffer(unittest.TestCase):
+  def test_wrap(self):
+    buf = RewindBuffer(4, 2, 2)
+    for i in range(10):
+      buf.push(float(i), np.full((2, 1), i), np.full((2, 2), i), i)
+    self.assertEqual(len(buf), 4)
+    self.assertEqual((buf.first_t(), buf.last_t()), (6., 9.))
+    self.assertEqual([buf.bisect(t) for t in [5., 6., 6.5, 8., 9., 10.]], [0, 1, 1, 3, 4, 4])
+
+    x, P = np.zeros((2, 1)), np.zeros((2, 2))
+    t, obs = buf.rewind(1, x, P)
+    self.assertEqual((t, obs, len(buf), buf.last_t()), (7., [8, 9], 2, 7.))
+    np.testing.assert_equal(x, 7.)
+    np.testing.assert_equal(P, 7.)
+
+    buf.push(7.5, x, P, 10)
+    self.assertEqual((len(buf), buf.last_t()), (3, 7.5))
+    buf.clear()
+    self.assertEqual(len(buf), 0)
+
+
+class TestEKFSym(unittest.TestCase):
+  def test_rewind_matches_ordered(self):
+    observations = imu_observations(2000)
+
+    # every 10th observation arrives 30 ms late
+    delayed = list(observations)
+    for i in range(5, len(delayed) - 3, 10):
+      delayed[i:i + 4] = delayed[i + 1:i + 4] + [delayed[i]]
+
+    kf, kf_delayed = LiveKalman(), LiveKalman()
+    run_filter(kf, observations)
+    run_filter(kf_delayed, delayed)
+
+    self.assertEqual(len(kf_delayed.filter.rewind_buffer), REWIND_TO_KEEP)
+    self.assertEqual(kf_delayed.filter.filter_time, kf.filter.filter_time)
+    np.testing.assert_equal(kf_delayed.filter.x, kf.filter.x)
+    np.testing.assert_equal(kf_delayed.filter.P, kf.filter.P)
+
+  def test_batch_update(self):
+    np.random.seed(0)
+    kf, kf_single = LiveKalman(), LiveKalman()
+    run_filter(kf, imu_observations(100))
+    run_filter(kf_single, imu_observations(100))
+
+    n = 20
+    t = kf.filter.filter_time + 0.01
+    z = np.random.normal(0., 0.01, (n, 3))
+    R = kf.get_R(ObservationKind.PHONE_GYRO, n)
+    ret = kf.filter.predict_and_update_batch(t, ObservationKind.PHONE_GYRO, z, R)
+
+    # a batch is the same as updating the observations one by one at the same time
+    y = []
+    for i in range(n):
+      y += kf_single.filter.predict_and_update_batch(t, ObservationKind.PHONE_GYRO, z[i:i + 1], R[i:i + 1])[6]
+    np.testing.assert_allclose(kf.filter.x, kf_single.filter.x, rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(kf.filter.P, kf_single.filter.P, rtol=1e-9, atol=1e-15)
+    np.testing.assert_allclose(ret[6], y, rtol=1e-12, atol=1e-12)
+    np.testing.assert_equal(ret[7], z)
+
+    # empty batches only predict
+    ret = kf.filter.predict_and_update_batch(t + 0.01, ObservationKind.PHONE_GYRO, [], [])
+    self.assertEqual(ret[6], [])
+
+  def test_batch_shapes(self):
+    kf = LiveKalman()
+    t = 0.
+    n = 4
+    z = np.zeros((n, 3))
+    R = kf.get_R(ObservationKind.PHONE_GYRO, n)
+    for bad_z, bad_R, bad_extra_args in [(z[:, :2], R, [[]]),
+                                     (z, R[:n - 1], [[]]),
+                                     (z, R[:, :2, :2], [[]]),
+                                     (z, R, np.zeros((n - 1, 2)))]:
+      t += 0.01
+      with self.assertRaises(AssertionError):
+        kf.filter.predict_and_update_batch(t, ObservationKind.PHONE_GYRO, bad_z, bad_R, bad_extra_args)
+
+  def test_checkpoint_allocations(self):
+    kf = LiveKalman()
+    observations = imu_observations(REWIND_TO_KEEP)
+    run_filter(kf, observations)
+
+    ekf = kf.filter
+    obs = observations[0]
+    n = REWIND_TO_KEEP
+
+    # bytes allocated by a checkpoint on top of what is live before it
+    tracemalloc.start()
+    allocated = 0
+    for _ in range(n):
+      tracemalloc.reset_peak()
+      before = tracemalloc.get_traced_memory()[0]
+      ekf.checkpoint(obs)
+      allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    self.assertLess(allocated / n, 256)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+import selfdrive.locationd.kalman.helpers as helpers
+from selfdrive.locationd.kalman.helpers import generate_code_cached, write_code
+
+
+def generate(counter_fn, value):
+  # stands in for sympy, counts how often it runs
+  with open(counter_fn, 'a') as f:
+    f.write("x")
+  time.sleep(0.2)
+  write_code("test", "int x = %d;\n" % value, "extern int x;\n")
+
+
+class TestKalmanCache(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.dirs = helpers.CACHE_DIR, helpers.GENERATED_DIR
+    helpers.CACHE_DIR = os.path.join(self.tmpdir, "cache")
+    helpers.GENERATED_DIR = os.path.join(self.tmpdir, "generated")
+    self.counter_fn = os.path.join(self.tmpdir, "counter")
+    self.source_fn = os.path.join(self.tmpdir, "model.py")
+    with open(self.source_fn, 'w') as f:
+      f.write("model = 1\n")
+
+  def tearDown(self):
+    helpers.CACHE_DIR, helpers.GENERATED_DIR = self.dirs
+    shutil.rmtree(self.tmpdir)
+
+  def runs(self):
+    if not os.path.exists(self.counter_fn):
+      return 0
+    with open(self.counter_fn) as f:
+      return len(f.read())
+
+  def generated(self):
+    with open(os.path.join(helpers.GENERATED_DIR, "test.cpp")) as f:
+      return f.read()
+
+  def test_hit_and_miss(self):
+    self.assertTrue(generate_code_cached("test", generate, [self.source_fn], (self.counter_fn, 1)))
+    self.assertEqual(self.runs(), 1)
+
+    # a clean build restores the code without generating it
+    shutil.rmtree(helpers.GENERATED_DIR)
+    self.assertFalse(generate_code_cached("test", generate, [self.source_fn], (self.counter_fn, 1)))
+    self.assertEqual(self.runs(), 1)
+    self.assertEqual(self.generated(), "int x = 1;\n")
+
+    # other arguments or sources are other entries
+    self.assertTrue(generate_code_cached("test", generate, [self.source_fn], (self.counter_fn, 2)))
+    self.assertEqual(self.generated(), "int x = 2;\n")
+    with open(self.source_fn, 'a') as f:
+      f.write("model = 2\n")
+    self.assertTrue(generate_code_cached("test", generate, [self.source_fn], (self.counter_fn, 1)))
+    self.assertEqual(self.runs(), 3)
+    self.assertEqual(self.generated(), "int x = 1;\n")
+
+  def test_concurrent(self):
+    args = ("test", generate, [self.source_fn], (self.counter_fn, 1))
+    procs = [multiprocessing.Process(target=generate_code_cached, args=args) for _ in range(4)]
+    for p in procs:
+      p.start()
+    for p in procs:
+      p.join()
+      self.assertEqual(p.exitcode, 0)
+
+    self.assertEqual(self.runs(), 1)
+    self.assertEqual(self.generated(), "int x = 1;\n")
+    # one entry and no leftover temporary directories
+    entries = [f for f in os.listdir(helpers.CACHE_DIR) if not f.endswith(".lock")]
+    self.assertEqual(len(entries), 1)
+    self.assertTrue(entries[0].startswith("test_"))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import unittest
+from types import SimpleNamespace
+import numpy as np
+
+import cereal.messaging as messaging
+import common.transformations.coordinates as coord
+from common.transformations.orientation import euler_from_quat, ned_euler_from_ecef, rot_from_quat
+from selfdrive.locationd.locationd import Localizer, FIELDS
+from selfdrive.locationd.kalman.models.live_kf import LiveKalman, States
+
+
+def to_float(arr):
+  return [float(arr[0]), float(arr[1]), float(arr[2])]
+
+
+def ref_live_location_msg(localizer):
+  """liveLocationKalman computed one field at a time into a new message"""
+  predicted_state = localizer.kf.x
+  predicted_std = np.diagonal(localizer.kf.P)
+
+  fix_ecef = predicted_state[States.ECEF_POS]
+  fix_ecef_std = predicted_std[States.ECEF_POS_ERR]
+  vel_ecef = predicted_state[States.ECEF_VELOCITY]
+  vel_ecef_std = predicted_std[States.ECEF_VELOCITY_ERR]
+  fix_pos_geo = coord.ecef2geodetic(fix_ecef)
+  fix_pos_geo_std = coord.ecef2geodetic(fix_ecef + fix_ecef_std) - fix_pos_geo
+  converter = localizer.converter
+  ned_vel = converter.ecef2ned(fix_ecef + vel_ecef) - converter.ecef2ned(fix_ecef)
+  ned_vel_std = converter.ecef2ned(fix_ecef + vel_ecef + vel_ecef_std) - converter.ecef2ned(fix_ecef + vel_ecef)
+  device_from_ecef = rot_from_quat(predicted_state[States.ECEF_ORIENTATION]).T
+  vel_device = device_from_ecef.dot(vel_ecef)
+  vel_device_std = device_from_ecef.dot(vel_ecef_std)
+  orientation_ecef = euler_from_quat(predicted_state[States.ECEF_ORIENTATION])
+  orientation_ecef_std = predicted_std[States.ECEF_ORIENTATION_ERR]
+  orientation_ned = ned_euler_from_ecef(fix_ecef, orientation_ecef)
+  orientation_ned_std = ned_euler_from_ecef(fix_ecef, orientation_ecef + orientation_ecef_std) - orientation_ned
+  calib_from_device = localizer.calib_from_device
+
+  fix = messaging.log.LiveLocationKalman.new_message()
+  for name, value, std in [
+      ('positionGeodetic', fix_pos_geo, fix_pos_geo_std),
+      ('positionECEF', fix_ecef, fix_ecef_std),
+      ('velocityECEF', vel_ecef, vel_ecef_std),
+      ('velocityNED', ned_vel, ned_vel_std),
+      ('velocityDevice', vel_device, vel_device_std),
+      ('accelerationDevice', predicted_state[States.ACCELERATION], predicted_std[States.ACCELERATION_ERR]),
+      ('orientationECEF', orientation_ecef, orientation_ecef_std),
+      ('orientationNED', orientation_ned, orientation_ned_std),
+      ('angularVelocityDevice', predicted_state[States.ANGULAR_VELOCITY], predicted_std[States.ANGULAR_VELOCITY_ERR]),
+      ('velocityCalibrated', calib_from_device.dot(vel_device), calib_from_device.dot(vel_device_std)),
+      ('angularVelocityCalibrated', calib_from_device.dot(predicted_state[States.ANGULAR_VELOCITY]),
+       calib_from_device.dot(predicted_std[States.ANGULAR_VELOCITY_ERR])),
+      ('accelerationCalibrated', calib_from_device.dot(predicted_state[States.ACCELERATION]),
+       calib_from_device.dot(predicted_std[States.ACCELERATION_ERR]))]:
+    field = getattr(fix, name)
+    field.value = to_float(value)
+    field.std = to_float(std)
+    field.valid = True
+  fix.unixTimestampMillis = localizer.unix_timestamp_millis
+  return fix
+
+
+def random_localizer(seed):
+  """A localizer with a random filter state somewhere on earth and a random calibration"""
+  np.random.seed(seed)
+  localizer = Localizer()
+  geodetic = [np.random.uniform(-70., 70.), np.random.uniform(-180., 180.), np.random.uniform(-100., 2000.)]
+  localizer.converter = coord.LocalCoord.from_geodetic(geodetic)
+  localizer.unix_timestamp_millis = 1580000000000 + seed
+  localizer.filter_ready = True
+  localizer.handle_live_calib(0., SimpleNamespace(rpyCalib=np.random.uniform(-0.1, 0.1, 3).tolist(), calStatus=1))
+
+  x = np.copy(LiveKalman.initial_x)
+  x[States.ECEF_POS] = localizer.converter.ned2ecef(np.random.uniform(-1000., 1000., 3))
+  quat = np.random.normal(size=4)
+  x[States.ECEF_ORIENTATION] = quat / np.linalg.norm(quat)
+  x[States.ECEF_VELOCITY] = np.random.uniform(-30., 30., 3)
+  x[States.ANGULAR_VELOCITY] = np.random.uniform(-0.5, 0.5, 3)
+  x[States.ACCELERATION] = np.random.uniform(-3., 3., 3)
+  P = np.diag(np.random.uniform(0.01, 4., len(LiveKalman.initial_P_diag)))
+  localizer.kf.init_state(x, covs=P, filter_time=0.)
+  return localizer
+
+
+class TestLocalizer(unittest.TestCase):
+  def test_live_location_msg(self):
+    for seed in range(20):
+      localizer = random_localizer(seed)
+      expected = ref_live_location_msg(localizer)
+      for _ in range(2):
+        localizer.liveLocationMsg(0.)
+        fix = localizer.msg.liveLocationKalman
+
+        self.assertEqual(fix.status, 'valid')
+        self.assertEqual(fix.unixTimestampMillis, expected.unixTimestampMillis)
+        for name in FIELDS:
+          field, expected_field = getattr(fix, name), getattr(expected, name)
+          self.assertTrue(field.valid)
+          # up to rounding, the reference loses precision on differences of ecef positions
+          np.testing.assert_allclose(list(field.value), list(expected_field.value), rtol=1e-9, atol=1e-6, err_msg=name)
+          np.testing.assert_allclose(list(field.std), list(expected_field.std), rtol=1e-9, atol=1e-6, err_msg=name)
+
+  def test_message_reused(self):
+    localizer = random_localizer(0)
+    localizer.liveLocationMsg(0.)
+    msg = localizer.msg
+    size = len(msg.to_bytes())
+    for _ in range(100):
+      self.assertIsNone(localizer.liveLocationMsg(0.))
+    self.assertIs(localizer.msg, msg)
+    self.assertEqual(len(msg.to_bytes()), size)
+
+
+if __name__ == "__main__":
+  unittest.main()
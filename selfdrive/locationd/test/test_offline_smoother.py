@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from selfdrive.locationd.kalman.helpers import ObservationKind
+from selfdrive.locationd.kalman.helpers.offline import FixedLagSmoother, smooth_route, smooth_routes
+from selfdrive.locationd.kalman.models.live_kf import LiveKalman
+
+
+def load_observations(route):
+  """Gyro and accelerometer readings at 100 Hz of a device that is standing still, the route is the seed"""
+  np.random.seed(route)
+  for i in range(1000):
+    t = 100. + i * 0.01
+    if i % 2:
+      yield t, ObservationKind.PHONE_GYRO, np.random.normal(0., 0.01, 3)
+    else:
+      yield t, ObservationKind.PHONE_ACCEL, np.random.normal([9.81, 0., 0.], 0.1, 3)
+
+
+def full_smooth(route, n=None):
+  """RTS smooths the first n estimates of the route at once"""
+  kf = LiveKalman()
+  estimates = [kf.predict_and_observe(t, kind, data) for t, kind, data in load_observations(route)][:n]
+  return np.array([e[4] for e in estimates]), kf.rts_smooth(estimates)
+
+
+def fixed_lag_smooth(route, lag, chunk):
+  smoother = FixedLagSmoother(LiveKalman(), lag, chunk)
+  results = []
+  for t, kind, data in load_observations(route):
+    results.append(smoother.observe(t, kind, data))
+    assert len(smoother.window) <= lag + chunk
+  results.append(smoother.flush())
+  t, states, covs = zip(*[r for r in results if r is not None])
+  return np.concatenate(t), np.concatenate(states), np.concatenate(covs)
+
+
+class TestFixedLagSmoother(unittest.TestCase):
+  def test_full_lag(self):
+    t_ref, (states_ref, covs_ref) = full_smooth(0)
+    t, states, covs = fixed_lag_smooth(0, lag=1000, chunk=100)
+    np.testing.assert_equal(t, t_ref)
+    np.testing.assert_equal(states, states_ref)
+    np.testing.assert_equal(covs, covs_ref)
+
+  def test_fixed_lag(self):
+    t_ref, (states_ref, covs_ref) = full_smooth(0)
+    t, states, covs = fixed_lag_smooth(0, lag=200, chunk=150)
+    np.testing.assert_equal(t, t_ref)
+
+    # the last window is smoothed like the full drive
+    tail = len(t) - (len(t) - 200) % 150 - 200
+    np.testing.assert_equal(states[tail:], states_ref[tail:])
+    np.testing.assert_equal(covs[tail:], covs_ref[tail:])
+
+    # before that a chunk is smoothed like a drive that ends lag estimates after it
+    for start in range(0, tail, 150):
+      chunk = slice(start, start + 150)
+      _, (states_ref, covs_ref) = full_smooth(0, start + 150 + 200)
+      np.testing.assert_equal(states[chunk], states_ref[chunk])
+      np.testing.assert_equal(covs[chunk], covs_ref[chunk])
+
+
+class TestSmoothRoutes(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_parallel(self):
+    routes = [1, 2, 3]
+    files = smooth_routes(LiveKalman, load_observations, routes, self.tmpdir, lag=200, chunk=150, processes=2)
+    self.assertEqual(sorted(files), routes)
+    self.assertEqual(sorted(os.listdir(self.tmpdir)), ["1.npz", "2.npz", "3.npz"])
+
+    for route in routes:
+      fn = os.path.join(self.tmpdir, "serial.npz")
+      smooth_route(LiveKalman, load_observations(route), fn, lag=200, chunk=150)
+      t, states, covs = fixed_lag_smooth(route, lag=200, chunk=150)
+      with np.load(files[route]) as out, np.load(fn) as serial:
+        self.assertEqual(sorted(out.keys()), ["std", "t", "x"])
+        for k in ["t", "x", "std"]:
+          np.testing.assert_equal(out[k], serial[k])
+        np.testing.assert_equal(out["t"], t)
+        np.testing.assert_equal(out["x"], states)
+        np.testing.assert_equal(out["std"], np.sqrt(np.diagonal(covs, axis1=1, axis2=2)))
+
+  def test_failed_route(self):
+    def observations():
+      for i, obs in enumerate(load_observations(0)):
+        if i == 450:
+          raise ValueError("broken log")
+        yield obs
+
+    fn = os.path.join(self.tmpdir, "0.npz")
+    with self.assertRaises(ValueError):
+      smooth_route(LiveKalman, observations(), fn, lag=200, chunk=150)
+    self.assertEqual(os.listdir(self.tmpdir), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""Streaming reader for rlog/qlog files (optionally bz2 compressed).
+
+Messages are decompressed and decoded lazily while iterating. The first full pass over a log builds
+an index with the byte offset, size, logMonoTime and service of every message in the decompressed
+stream, which is saved next to the log (<log>.idx.npz) for later readers. LogReader.filter uses that
+index to only decode the requested services in a logMonoTime window, and for uncompressed logs to
+seek straight to them. A LogReader made with services only ever yields those, through the index
+once there is one.
+
+Only local files are read, routes and URLs are handled by tools.lib.logreader from the tools repo.
+"""
+import os
+import sys
+import bz2
+import struct
+import tempfile
+import numpy as np
+
+from cereal import log as capnp_log
+
+CHUNK_SIZE = 1 << 20
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx.npz"
+
+
+def message_size(buf, offset):
+  """Size in bytes of the capnp message starting at offset in buf, None if its header is incomplete"""
+  if len(buf) - offset < 4:
+    return None
+  seg_count = struct.unpack_from("<I", buf, offset)[0] + 1
+  header_size = 4 * (seg_count + 1)
+  header_size += header_size % 8  # segment table is padded to a full word
+  if len(buf) - offset < header_size:
+    return None
+  seg_sizes = struct.unpack_from("<%dI" % seg_count, buf, offset + 4)
+  return header_size + 8 * sum(seg_sizes)
+
+
+def read_chunks(fn):
+  """Yields the decompressed contents of fn in chunks"""
+  compressed = fn.endswith(".bz2")
+  with open(fn, "rb") as f:
+    decompressor = bz2.BZ2Decompressor() if compressed else None
+    while True:
+      dat = f.read(CHUNK_SIZE)
+      if not dat:
+        break
+      if not compressed:
+        yield dat
+        continue
+
+      while dat:
+        out = decompressor.decompress(dat)
+        if out:
+          yield out
+        dat = b""
+        if decompressor.eof:
+          # concatenated bz2 streams
+          dat = decompressor.unused_data
+          decompressor = bz2.BZ2Decompressor()
+
+
+def iter_raw_messages(chunks):
+  """Yields (offset, raw message bytes) for every message in a stream of chunks"""
+  buf = bytearray()
+  buf_offset = 0
+  for chunk in chunks:
+    buf += chunk
+    pos = 0
+    while True:
+      size = message_size(buf, pos)
+      if size is None or len(buf) - pos < size:
+        break
+      yield buf_offset + pos, bytes(buf[pos:pos+size])
+      pos += size
+    del buf[:pos]
+    buf_offset += pos
+
+  if len(buf):
+    print("Warning: %d trailing bytes in log" % len(buf), file=sys.stderr)
+
+
+class LogIndex():
+  def __init__(self, offsets, sizes, mono_times, service_ids, services):
+    self.offsets = offsets
+    self.sizes = sizes
+    self.mono_times = mono_times
+    self.service_ids = service_ids
+    self.services = list(services)
+
+  def __len__(self):
+    return len(self.offsets)
+
+  def select(self, services=None, start_time=None, end_time=None):
+    """Returns the positions in the log of the messages matching all given conditions"""
+    mask = np.ones(len(self), dtype=bool)
+    if services is not None:
+      ids = [self.services.index(s) for s in services if s in self.services]
+      mask &= np.isin(self.service_ids, ids)
+    if start_time is not None:
+      mask &= self.mono_times >= start_time
+    if end_time is not None:
+      mask &= self.mono_times <= end_time
+    return np.flatnonzero(mask)
+
+  @staticmethod
+  def load(path, src_stat):
+    try:
+      with np.load(path) as dat:
+        if int(dat['version']) != INDEX_VERSION or int(dat['src_size']) != src_stat.st_size or \
+           int(dat['src_mtime_ns']) != src_stat.st_mtime_ns:
+          return None
+        return LogIndex(dat['offsets'], dat['sizes'], dat['mono_times'], dat['service_ids'], dat['services'].tolist())
+    except (OSError, IOError, KeyError, ValueError):
+      return None
+
+  def save(self, path, src_stat):
+    """Atomically writes the index, silently skipped if the log directory is not writable"""
+    try:
+      fd, tmp_path = tempfile.mkstemp(prefix=".tmp", suffix=".npz", dir=os.path.dirname(os.path.abspath(path)))
+    except OSError:
+      return
+    try:
+      with os.fdopen(fd, "wb") as f:
+        np.savez(f, version=INDEX_VERSION, src_size=src_stat.st_size, src_mtime_ns=src_stat.st_mtime_ns,
+                 offsets=self.offsets, sizes=self.sizes, mono_times=self.mono_times,
+                 service_ids=self.service_ids, services=np.array(self.services))
+      os.rename(tmp_path, path)
+    except OSError:
+      os.remove(tmp_path)
+
+
+class LogReader():
+  def __init__(self, fn, services=None, write_index=True):
+    self.fn = fn
+    self.compressed = fn.endswith(".bz2")
+    self.index_path = fn + INDEX_SUFFIX
+    self.services = None if services is None else set(services)
+    self.write_index = write_index
+    self._index = None
+
+  def __iter__(self):
+    if self._index is None and os.path.isfile(self.index_path):
+      self._index = LogIndex.load(self.index_path, os.stat(self.fn))
+    if self._index is not None and self.services is not None:
+      yield from self.filter(self.services)
+      return
+
+    offsets, sizes, mono_times, service_ids = [], [], [], []
+    services = {}
+
+    for offset, dat in iter_raw_messages(read_chunks(self.fn)):
+      msg = capnp_log.Event.from_bytes(dat)
+      which = msg.which()
+      if self._index is None:
+        offsets.append(offset)
+        sizes.append(len(dat))
+        mono_times.append(msg.logMonoTime)
+        service_ids.append(services.setdefault(which, len(services)))
+      if self.services is None or which in self.services:
+        yield msg
+
+    # only reached when the whole log was read
+    if self._index is None:
+      self._index = LogIndex(np.array(offsets, dtype=np.int64), np.array(sizes, dtype=np.uint32),
+                             np.array(mono_times, dtype=np.uint64), np.array(service_ids, dtype=np.uint16),
+                             sorted(services, key=services.get))
+      if self.write_index:
+        self._index.save(self.index_path, os.stat(self.fn))
+
+  @property
+  def index(self):
+    if self._index is None:
+      self._index = LogIndex.load(self.index_path, os.stat(self.fn))
+    if self._index is None:
+      for _ in self:
+        pass
+    return self._index
+
+  def filter(self, services=None, start_time=None, end_time=None):
+    """Yields only the messages of the given services with start_time <= logMonoTime <= end_time,
+    without decoding anything else"""
+    idx = self.index
+    sel = idx.select(services, start_time, end_time)
+    if len(sel) == 0:
+      return
+
+    if not self.compressed:
+      with open(self.fn, "rb") as f:
+        for i in sel:
+          f.seek(int(idx.offsets[i]))
+          yield capnp_log.Event.from_bytes(f.read(int(idx.sizes[i])))
+      return
+
+    # compressed logs can't be seeked, but decompression stops after the last selected message
+    wanted = iter(sel)
+    i = next(wanted)
+    for offset, dat in iter_raw_messages(read_chunks(self.fn)):
+      if offset == idx.offsets[i]:
+        yield capnp_log.Event.from_bytes(dat)
+        i = next(wanted, None)
+        if i is None:
+          break
+
+
+if __name__ == "__main__":
+  for msg in LogReader(sys.argv[1], services=sys.argv[2:] or None):
+    print(msg)
@@ -0,0 +1,80 @@
+import os
+import bz2
+import shutil
+import tempfile
+import unittest
+
+from cereal import log
+from selfdrive.loggerd.logreader import LogReader, INDEX_SUFFIX
+
+
+def make_msgs():
+  msgs = []
+  for i in range(300):
+    service = ["can", "sendcan", "thermal"][i % 3]
+    msg = log.Event.new_message()
+    msg.logMonoTime = i * 1000
+    if service == "thermal":
+      msg.init(service)
+      msg.thermal.freeSpace = i
+    else:
+      msg.init(service, 1)
+      getattr(msg, service)[0].address = i
+    msgs.append(msg.to_bytes())
+  return msgs
+
+
+class TestLogReader(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.msgs = make_msgs()
+
+    self.raw_fn = os.path.join(self.tmpdir, "rlog")
+    with open(self.raw_fn, "wb") as f:
+      f.write(b"".join(self.msgs))
+
+    # two concatenated bz2 streams, like a log that was appended to
+    self.bz2_fn = os.path.join(self.tmpdir, "rlog.bz2")
+    with open(self.bz2_fn, "wb") as f:
+      f.write(bz2.compress(b"".join(self.msgs[:100])))
+      f.write(bz2.compress(b"".join(self.msgs[100:])))
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_iterate(self):
+    for fn in [self.raw_fn, self.bz2_fn]:
+      lr = LogReader(fn, write_index=False)
+      self.assertEqual([m.as_builder().to_bytes() for m in lr], self.msgs)
+      self.assertFalse(os.path.isfile(fn + INDEX_SUFFIX))
+      self.assertEqual(len(lr.index), len(self.msgs))
+
+      # the index is saved by default
+      self.assertEqual([m.as_builder().to_bytes() for m in LogReader(fn)], self.msgs)
+      self.assertTrue(os.path.isfile(fn + INDEX_SUFFIX))
+
+  def test_services(self):
+    expected = [m for i, m in enumerate(self.msgs) if i % 3 != 2]
+    for fn in [self.raw_fn, self.bz2_fn]:
+      # without the index every message is decoded once, then only the requested ones
+      for _ in range(2):
+        lr = LogReader(fn, services=["can", "sendcan"])
+        for _ in range(2):
+          self.assertEqual([m.as_builder().to_bytes() for m in lr], expected)
+        self.assertTrue(os.path.isfile(fn + INDEX_SUFFIX))
+
+  def test_filter(self):
+    for fn in [self.raw_fn, self.bz2_fn]:
+      # index is built on the first call, then loaded from the sidecar file
+      for _ in range(2):
+        msgs = list(LogReader(fn).filter(["can", "sendcan"], start_time=30000, end_time=60000))
+        self.assertEqual([m.logMonoTime for m in msgs], [t * 1000 for t in range(30, 61) if t % 3 != 2])
+        self.assertTrue(all(m.which() in ["can", "sendcan"] for m in msgs))
+        self.assertEqual(msgs[0].can[0].address, 30)
+        self.assertTrue(os.path.isfile(fn + INDEX_SUFFIX))
+
+      self.assertEqual(list(LogReader(fn).filter(["carState"])), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
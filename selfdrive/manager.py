@@ -524,9 +524,9 @@ def main():
   ]
 
   # set unset params
-  for k, v in default_params:
-    if params.get(k) is None:
-      params.put(k, v)
+  unset_params = {k: v for k, v in default_params if params.get(k) is None}
+  if unset_params:
+    params.put_many(unset_params)
 
   # is this chffrplus?
   if os.getenv("PASSIVE") is not None:
@@ -1,69 +1,164 @@
 #!/usr/bin/env python3
 import bz2
+import math
 import os
 import sys
 import numbers
 
-import dictdiffer
+import capnp
+from cereal import log
 if "CI" in os.environ:
   tqdm = lambda x: x
 else:
   from tqdm import tqdm
 
-from tools.lib.logreader import LogReader
+from selfdrive.loggerd.logreader import LogReader
 
-def save_log(dest, log_msgs):
-  dat = b""
-  for msg in tqdm(log_msgs):
-    dat += msg.as_builder().to_bytes()
-  dat = bz2.compress(dat)
+StructReader = capnp.lib.capnp._DynamicStructReader
+ListReader = capnp.lib.capnp._DynamicListReader
 
+def save_log(dest, log_msgs):
+  compressor = bz2.BZ2Compressor()
   with open(dest, "wb") as f:
-   f.write(dat)
+    for msg in tqdm(log_msgs):
+      f.write(compressor.compress(msg.as_builder().to_bytes()))
+    f.write(compressor.flush())
 
-def remove_ignored_fields(msg, ignore):
-  msg = msg.as_builder()
-  for key in ignore:
-    attr = msg
+def compile_ignore_fields(ignore_fields):
+  """Compile dotted field paths into a nested dict, a True leaf masks the whole subtree"""
+  tree = {}
+  for key in ignore_fields:
+    node = tree
     keys = key.split(".")
-    if msg.which() not in key and len(keys) > 1:
+    for k in keys[:-1]:
+      node = node.setdefault(k, {})
+      if node is True:
+        break
+    else:
+      node[keys[-1]] = True
+  return tree
+
+def _compile_align_paths(schema, tree):
+  """Resolve the masked field paths against a struct schema. Each path becomes a list
+  of (field, is_union_member) steps and a flag telling if its leaf is a primitive."""
+  paths = []
+  for k, sub in tree.items():
+    if k not in schema.fields:
       continue
+    field = schema.fields[k]
+    step = (k, k in schema.union_fields)
+    is_struct = field.proto.which() == 'group' or field.proto.slot.type.which() == 'struct'
+    if sub is True:
+      primitive = field.proto.which() == 'slot' and field.proto.slot.type.which() not in ('struct', 'list', 'anyPointer')
+      paths.append(([step], primitive))
+    elif is_struct:
+      paths.extend(([step] + steps, primitive) for steps, primitive in _compile_align_paths(field.schema, sub))
+  return paths
 
-    for k in keys[:-1]:
-      try:
-        attr = getattr(msg, k)
-      except:
+def _align_ignored(r1, b2, paths):
+  """Copy masked fields from r1 into b2 so they can't affect a byte comparison.
+  Returns False if a masked field present in the message can't be copied."""
+  for steps, primitive in paths:
+    r, b = r1, b2
+    for i, (k, is_union) in enumerate(steps):
+      if is_union and (r.which() != k or b.which() != k):
         break
+      if i < len(steps) - 1:
+        r, b = getattr(r, k), getattr(b, k)
+    else:
+      if not primitive:
+        return False
+      setattr(b, k, _to_python(getattr(r, k)))
+  return True
+
+def _format_path(path):
+  # same path format as dictdiffer
+  if all(isinstance(k, str) for k in path):
+    return ".".join(path)
+  return list(path)
+
+def _to_python(v):
+  if isinstance(v, StructReader):
+    return v.to_dict(verbose=True)
+  elif isinstance(v, ListReader):
+    return [_to_python(x) for x in v]
+  elif isinstance(v, capnp.lib.capnp._DynamicEnum):
+    return str(v)
+  return v
+
+def _is_different(v1, v2, tolerance):
+  if v1 == v2:
+    return False
+  if isinstance(v1, numbers.Number) and isinstance(v2, numbers.Number):
+    if isinstance(v1, float) and isinstance(v2, float) and math.isnan(v1) and math.isnan(v2):
+      return False
+    return not math.isclose(v1, v2, rel_tol=tolerance)
+  return True
+
+def _diff_struct(r1, r2, path, ignore, tolerance, diff):
+  fields = r1.schema.non_union_fields
+  if r1.schema.union_fields:
+    w1, w2 = r1.which(), r2.which()
+    if w1 != w2:
+      if not (ignore and (ignore.get(w1) is True or ignore.get(w2) is True)):
+        diff.append(('remove', _format_path(path), [(w1, _to_python(getattr(r1, w1)))]))
+        diff.append(('add', _format_path(path), [(w2, _to_python(getattr(r2, w2)))]))
     else:
-      v = getattr(attr, keys[-1])
-      if isinstance(v, bool):
-        val = False
-      elif isinstance(v, numbers.Number):
-        val = 0
-      else:
-        raise NotImplementedError
-      setattr(attr, keys[-1], val)
-  return msg.as_reader()
-
-def compare_logs(log1, log2, ignore_fields=[], ignore_msgs=[]):
+      fields = fields + (w1,)
+
+  for name in fields:
+    sub = ignore.get(name) if ignore else None
+    if sub is True:
+      continue
+    _diff_value(getattr(r1, name), getattr(r2, name), path + (name,), sub, tolerance, diff)
+
+def _diff_list(l1, l2, path, ignore, tolerance, diff):
+  n = min(len(l1), len(l2))
+  for i in range(n):
+    _diff_value(l1[i], l2[i], path + (i,), ignore, tolerance, diff)
+
+  if len(l1) > n:
+    diff.append(('remove', _format_path(path), [(i, _to_python(l1[i])) for i in range(n, len(l1))]))
+  elif len(l2) > n:
+    diff.append(('add', _format_path(path), [(i, _to_python(l2[i])) for i in range(n, len(l2))]))
+
+def _diff_value(v1, v2, path, ignore, tolerance, diff):
+  if isinstance(v1, StructReader):
+    _diff_struct(v1, v2, path, ignore, tolerance, diff)
+  elif isinstance(v1, ListReader):
+    _diff_list(v1, v2, path, ignore, tolerance, diff)
+  elif _is_different(v1, v2, tolerance):
+    diff.append(('change', _format_path(path), (_to_python(v1), _to_python(v2))))
+
+def diff_msgs(msg1, msg2, ignore=None, tolerance=0):
+  """Walk two events in parallel and return their differences as dictdiffer style tuples.
+  ignore is a tree from compile_ignore_fields, tolerance is relative."""
+  diff = []
+  _diff_struct(msg1, msg2, (), ignore, tolerance, diff)
+  return diff
+
+def compare_logs(log1, log2, ignore_fields=[], ignore_msgs=[], tolerance=0):
   filter_msgs = lambda m: m.which() not in ignore_msgs
   log1, log2 = [list(filter(filter_msgs, log)) for log in (log1, log2)]
   assert len(log1) == len(log2), "logs are not same length: " + str(len(log1)) + " VS " + str(len(log2))
 
+  ignore = compile_ignore_fields(ignore_fields)
+  align_paths = _compile_align_paths(log.Event.schema, ignore)
+
   diff = []
   for msg1, msg2 in tqdm(zip(log1, log2)):
     if msg1.which() != msg2.which():
       print(msg1, msg2)
       raise Exception("msgs not aligned between logs")
 
-    msg1_bytes = remove_ignored_fields(msg1, ignore_fields).as_builder().to_bytes()
-    msg2_bytes = remove_ignored_fields(msg2, ignore_fields).as_builder().to_bytes()
+    # fast path: identical encodings once the masked fields are made equal, every message is
+    # serialized once and only differing ones are walked
+    msg2_builder = msg2.as_builder()
+    if _align_ignored(msg1, msg2_builder, align_paths):
+      if msg1.as_builder().to_bytes() == msg2_builder.to_bytes():
+        continue
 
-    if msg1_bytes != msg2_bytes:
-      msg1_dict = msg1.to_dict(verbose=True)
-      msg2_dict = msg2.to_dict(verbose=True)
-      dd = dictdiffer.diff(msg1_dict, msg2_dict, ignore=ignore_fields, tolerance=0)
-      diff.extend(dd)
+    diff.extend(diff_msgs(msg1, msg2, ignore, tolerance))
   return diff
 
 if __name__ == "__main__":
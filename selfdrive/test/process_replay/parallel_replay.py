@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Runs process replay jobs in parallel.
+
+Every (rlog, process) job runs in its own interpreter with an isolated params directory
+(PARAMS_PATH) and messaging prefix (OPENPILOT_PREFIX). The job compares the replayed output
+against the reference log itself and only hands the differences back, so the caller never holds
+more than one job's result at a time.
+"""
+import os
+import sys
+import json
+import pickle
+import shutil
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+
+from common.basedir import BASEDIR
+
+JOB_TIMEOUT = 30 * 60
+
+
+def run_job(rlog_fn, proc_name, cmp_log_fn, ignore_fields, ignore_msgs, result_fn):
+  # imported here so everything picks up the job's environment
+  from selfdrive.loggerd.logreader import LogReader
+  from selfdrive.test.process_replay.process_replay import CONFIGS, replay_services
+  from selfdrive.test.process_replay.test_processes import test_process
+
+  cfg = next(c for c in CONFIGS if c.proc_name == proc_name)
+  lr = LogReader(rlog_fn, services=replay_services(cfg))
+  diff = test_process(cfg, lr, cmp_log_fn, ignore_fields, ignore_msgs)
+  with open(result_fn, "wb") as f:
+    pickle.dump(diff, f)
+
+
+def replay_job(job, timeout=JOB_TIMEOUT):
+  """Replays and compares one (rlog_fn, proc_name, cmp_log_fn, ignore_fields, ignore_msgs) job in a
+  subprocess. Returns the differences to the reference log, or an error string"""
+  job_dir = tempfile.mkdtemp(prefix="replay_")
+  result_fn = os.path.join(job_dir, "result.pkl")
+  env = dict(os.environ,
+             CI="1",
+             PARAMS_PATH=os.path.join(job_dir, "params"),
+             OPENPILOT_PREFIX=os.path.basename(job_dir) + "_")
+
+  try:
+    proc = subprocess.run([sys.executable, "-m", "selfdrive.test.process_replay.parallel_replay",
+                           json.dumps(list(job) + [result_fn])],
+                          cwd=BASEDIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          encoding='utf8', timeout=timeout)
+    if proc.returncode != 0:
+      return "replay failed:\n%s" % proc.stdout[-2000:]
+    with open(result_fn, "rb") as f:
+      return pickle.load(f)
+  except subprocess.TimeoutExpired:
+    return "replay timed out after %d s" % timeout
+  finally:
+    shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def replay_parallel(jobs, workers=None):
+  """Replays and compares a list of jobs across workers processes, see replay_job.
+  Returns a dict mapping each (rlog_fn, proc_name) to its differences, or an error string"""
+  if workers is None:
+    workers = cpu_count()
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    return {job[:2]: result for job, result in zip(jobs, executor.map(replay_job, jobs))}
+
+
+if __name__ == "__main__":
+  run_job(*json.loads(sys.argv[1]))
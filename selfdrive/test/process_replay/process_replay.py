@@ -17,7 +17,7 @@ from common.params import Params
 from cereal.services import service_list
 from collections import namedtuple
 
-ProcessConfig = namedtuple('ProcessConfig', ['proc_name', 'pub_sub', 'ignore', 'init_callback', 'should_recv_callback'])
+ProcessConfig = namedtuple('ProcessConfig', ['proc_name', 'pub_sub', 'ignore', 'init_callback', 'should_recv_callback', 'step_class'])
 
 def wait_for_event(evt):
   if not evt.wait(15):
@@ -45,6 +45,12 @@ class FakeSocket:
       self.recv_ready.clear()
     return self.data.pop()
 
+  def receive_many(self, max_msgs=0, wait_for_one=False, contiguous=True):
+    return [self.receive()] if wait_for_one else []
+
+  def receive_latest(self, wait=False):
+    return self.receive(non_blocking=not wait)
+
   def send(self, data):
     if self.wait:
       wait_for_event(self.recv_called)
@@ -67,6 +73,12 @@ class DumbSocket:
   def receive(self, non_blocking=False):
     return self.data
 
+  def receive_many(self, max_msgs=0, wait_for_one=False, contiguous=True):
+    return [self.data]
+
+  def receive_latest(self, wait=False):
+    return self.data
+
   def send(self, dat):
     pass
 
@@ -133,6 +145,31 @@ class FakePubMaster(messaging.PubMaster):
     self.get_called.set()
     return dat
 
+class SyncSubMaster(messaging.SubMaster):
+  """SubMaster for synchronous replay, the harness calls update_msgs before every step"""
+  def __init__(self, services):
+    super(SyncSubMaster, self).__init__(services, addr=None)
+    self.sock = {s: DumbSocket(s) for s in services}
+
+  def update(self, timeout=-1):
+    pass
+
+class SyncPubMaster(messaging.PubMaster):
+  """PubMaster for synchronous replay, collects everything sent during a step"""
+  def __init__(self, services):
+    self.sock = {s: DumbSocket() for s in services}
+    self.msgs = []
+
+  def send(self, s, dat):
+    # copy, processes may reuse their builders for the next message
+    if not isinstance(dat, bytes):
+      dat = dat.to_bytes()
+    self.msgs.append(log.Event.from_bytes(dat))
+
+  def pop_msgs(self):
+    msgs, self.msgs = self.msgs, []
+    return msgs
+
 def fingerprint(msgs, fsm, can_sock):
   print("start fingerprinting")
   fsm.wait_on_getitem = True
@@ -201,6 +238,7 @@ CONFIGS = [
     ignore=["logMonoTime", "valid", "controlsState.startMonoTime", "controlsState.cumLagMs"],
     init_callback=fingerprint,
     should_recv_callback=None,
+    step_class="Controlsd",
   ),
   ProcessConfig(
     proc_name="radard",
@@ -211,6 +249,7 @@ CONFIGS = [
     ignore=["logMonoTime", "valid", "radarState.cumLagMs"],
     init_callback=get_car_params,
     should_recv_callback=radar_rcv_callback,
+    step_class="Radard",
   ),
   ProcessConfig(
     proc_name="plannerd",
@@ -221,6 +260,7 @@ CONFIGS = [
     ignore=["logMonoTime", "valid", "plan.processingDelay"],
     init_callback=get_car_params,
     should_recv_callback=None,
+    step_class="Plannerd",
   ),
   ProcessConfig(
     proc_name="calibrationd",
@@ -230,6 +270,7 @@ CONFIGS = [
     ignore=["logMonoTime", "valid"],
     init_callback=get_car_params,
     should_recv_callback=calibration_rcv_callback,
+    step_class="Calibrationd",
   ),
   ProcessConfig(
     proc_name="dmonitoringd",
@@ -240,10 +281,102 @@ CONFIGS = [
     ignore=["logMonoTime", "valid"],
     init_callback=get_car_params,
     should_recv_callback=None,
+    step_class=None,
   ),
 ]
 
-def replay_process(cfg, lr):
+def get_step_class(cfg):
+  """Returns the class that exposes a step function for the process, None if it has none"""
+  if cfg.step_class is None:
+    return None
+  mod = importlib.import_module(manager.managed_processes[cfg.proc_name])
+  return getattr(mod, cfg.step_class)
+
+def replay_services(cfg):
+  """Services of the log that replaying the process reads, the init callbacks use the CAN msgs"""
+  services = set(cfg.pub_sub.keys())
+  if cfg.init_callback is not None:
+    services.add('can')
+  return services
+
+def setup_params():
+  params = Params()
+  params.clear_all()
+  params.manager_start()
+  params.put("OpenpilotEnabledToggle", "1")
+  params.put("Passive", "0")
+  params.put("CommunityFeaturesToggle", "1")
+  return params
+
+def get_recv_socks(cfg, msg, CP, fsm):
+  if cfg.should_recv_callback is not None:
+    return cfg.should_recv_callback(msg, CP, cfg, fsm)
+
+  recv_socks = [s for s in cfg.pub_sub[msg.which()] if
+                  (fsm.frame + 1) % int(service_list[msg.which()].frequency / service_list[s].frequency) == 0]
+  return recv_socks, bool(len(recv_socks))
+
+def replay_process(cfg, lr, sync=True):
+  """Replays the log through the process. Processes that expose a step function are driven
+  synchronously from this thread, otherwise the process runs in a thread fed through fake sockets."""
+  if sync and get_step_class(cfg) is not None:
+    return replay_process_sync(cfg, lr)
+  return replay_process_threaded(cfg, lr)
+
+def replay_process_sync(cfg, lr):
+  sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]
+  pub_sockets = [s for s in cfg.pub_sub.keys() if s != 'can']
+
+  fsm = SyncSubMaster(pub_sockets)
+  fpm = SyncPubMaster(sub_sockets)
+  args = (fsm, fpm)
+  can_sock = None
+  if 'can' in list(cfg.pub_sub.keys()):
+    can_sock = FakeSocket(wait=False)
+    args = (fsm, fpm, can_sock)
+
+  all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
+  pub_msgs = [msg for msg in all_msgs if msg.which() in list(cfg.pub_sub.keys())]
+
+  params = setup_params()
+
+  os.environ['NO_RADAR_SLEEP'] = "1"
+  manager.prepare_managed_process(cfg.proc_name)
+
+  if cfg.init_callback == fingerprint:
+    # the process fingerprints from the CAN msgs while it is constructed
+    canmsgs = [msg for msg in all_msgs if msg.which() == "can"]
+    can_sock.data = [msg.as_builder().to_bytes() for msg in canmsgs[:300]]
+  elif cfg.init_callback is not None:
+    cfg.init_callback(all_msgs, fsm, can_sock)
+
+  proc = get_step_class(cfg)(*args)
+  fpm.pop_msgs()
+  if can_sock is not None:
+    can_sock.data = []
+
+  CP = car.CarParams.from_bytes(params.get("CarParams", block=True))
+
+  log_msgs, msg_queue = [], []
+  for msg in tqdm(pub_msgs):
+    recv_socks, should_recv = get_recv_socks(cfg, msg, CP, fsm)
+
+    if msg.which() == 'can':
+      can_sock.data = [msg.as_builder().to_bytes()]
+    else:
+      msg_queue.append(msg.as_builder())
+
+    if should_recv:
+      fsm.update_msgs(0, msg_queue)
+      msg_queue = []
+
+    # CAN driven processes consume every CAN packet
+    if should_recv or msg.which() == 'can':
+      proc.step()
+      log_msgs += fpm.pop_msgs()
+  return log_msgs
+
+def replay_process_threaded(cfg, lr):
   sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]
   pub_sockets = [s for s in cfg.pub_sub.keys() if s != 'can']
 
@@ -257,12 +390,7 @@ def replay_process(cfg, lr):
   all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
   pub_msgs = [msg for msg in all_msgs if msg.which() in list(cfg.pub_sub.keys())]
 
-  params = Params()
-  params.clear_all()
-  params.manager_start()
-  params.put("OpenpilotEnabledToggle", "1")
-  params.put("Passive", "0")
-  params.put("CommunityFeaturesToggle", "1")
+  params = setup_params()
 
   os.environ['NO_RADAR_SLEEP'] = "1"
   manager.prepare_managed_process(cfg.proc_name)
@@ -286,12 +414,7 @@ def replay_process(cfg, lr):
 
   log_msgs, msg_queue = [], []
   for msg in tqdm(pub_msgs):
-    if cfg.should_recv_callback is not None:
-      recv_socks, should_recv = cfg.should_recv_callback(msg, CP, cfg, fsm)
-    else:
-      recv_socks = [s for s in cfg.pub_sub[msg.which()] if
-                      (fsm.frame + 1) % int(service_list[msg.which()].frequency / service_list[s].frequency) == 0]
-      should_recv = bool(len(recv_socks))
+    recv_socks, should_recv = get_recv_socks(cfg, msg, CP, fsm)
 
     if msg.which() == 'can':
       can_sock.send(msg.as_builder().to_bytes())
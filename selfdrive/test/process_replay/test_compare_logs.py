@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import math
+import unittest
+
+from cereal import log
+from selfdrive.test.process_replay.compare_logs import compare_logs
+
+
+def controls_state(v_ego=10., v_pid=0.5, cum_lag_ms=1.):
+  msg = log.Event.new_message()
+  msg.logMonoTime = 1
+  msg.init('controlsState')
+  msg.controlsState.vEgo = v_ego
+  msg.controlsState.vPid = v_pid
+  msg.controlsState.cumLagMs = cum_lag_ms
+  return msg.as_reader()
+
+
+def car_state(v_ego=10., cruise_speed=20.):
+  msg = log.Event.new_message()
+  msg.init('carState')
+  msg.carState.vEgo = v_ego
+  msg.carState.cruiseState.speed = cruise_speed
+  return msg.as_reader()
+
+
+def can(addresses):
+  msg = log.Event.new_message()
+  msg.init('can', len(addresses))
+  for c, address in zip(msg.can, addresses):
+    c.address = address
+  return msg.as_reader()
+
+
+class TestCompareLogs(unittest.TestCase):
+  def test_equal(self):
+    log1 = [controls_state(), car_state(), can([1, 2])]
+    log2 = [controls_state(), car_state(), can([1, 2])]
+    self.assertEqual(compare_logs(log1, log2), [])
+
+  def test_change(self):
+    diff = compare_logs([controls_state(v_ego=10.)], [controls_state(v_ego=11.)])
+    self.assertEqual(diff, [('change', 'controlsState.vEgo', (10., 11.))])
+
+  def test_ignored_fields(self):
+    log1 = [controls_state(cum_lag_ms=1.), car_state(cruise_speed=20.)]
+    log2 = [controls_state(cum_lag_ms=2.), car_state(cruise_speed=25.)]
+
+    # a nested primitive, and a whole struct which can't be aligned for the byte comparison
+    self.assertEqual(compare_logs(log1, log2, ["controlsState.cumLagMs", "carState.cruiseState"]), [])
+    self.assertEqual(compare_logs(log1, log2, ["controlsState.cumLagMs"]),
+                     [('change', 'carState.cruiseState.speed', (20., 25.))])
+
+    # ignored fields don't hide other differences
+    log2 = [controls_state(v_ego=11., cum_lag_ms=2.)]
+    self.assertEqual(compare_logs(log1[:1], log2, ["controlsState.cumLagMs"]),
+                     [('change', 'controlsState.vEgo', (10., 11.))])
+
+  def test_ignored_msgs(self):
+    log1 = [controls_state(v_ego=10.), can([1])]
+    log2 = [controls_state(v_ego=11.), can([1])]
+    self.assertEqual(compare_logs(log1, log2, ignore_msgs=["controlsState"]), [])
+
+  def test_tolerance(self):
+    log1 = [controls_state(v_ego=10.)]
+    log2 = [controls_state(v_ego=10.0001)]
+    self.assertEqual(compare_logs(log1, log2, tolerance=1e-4), [])
+    self.assertEqual(len(compare_logs(log1, log2)), 1)
+    self.assertEqual(len(compare_logs(log1, [controls_state(v_ego=10.01)], tolerance=1e-4)), 1)
+
+  def test_list_add_remove(self):
+    diff = compare_logs([can([1, 2])], [can([1, 2, 3])])
+    self.assertEqual(len(diff), 1)
+    self.assertEqual(diff[0][:2], ('add', 'can'))
+    self.assertEqual([(i, c['address']) for i, c in diff[0][2]], [(2, 3)])
+
+    diff = compare_logs([can([1, 2, 3])], [can([1])])
+    self.assertEqual(len(diff), 1)
+    self.assertEqual(diff[0][:2], ('remove', 'can'))
+    self.assertEqual([(i, c['address']) for i, c in diff[0][2]], [(1, 2), (2, 3)])
+
+    # a change and an add in the same list
+    diff = compare_logs([can([1])], [can([4, 5])])
+    self.assertEqual(diff[0], ('change', ['can', 0, 'address'], (1, 4)))
+    self.assertEqual(diff[1][:2], ('add', 'can'))
+
+  def test_nan(self):
+    nan = float('nan')
+    self.assertEqual(compare_logs([controls_state(v_ego=nan)], [controls_state(v_ego=nan)]), [])
+
+    diff = compare_logs([controls_state(v_ego=nan)], [controls_state(v_ego=1.)])
+    self.assertEqual(len(diff), 1)
+    self.assertEqual(diff[0][:2], ('change', 'controlsState.vEgo'))
+    self.assertTrue(math.isnan(diff[0][2][0]))
+
+  def test_not_aligned(self):
+    with self.assertRaises(AssertionError):
+      compare_logs([can([1])], [])
+    with self.assertRaises(Exception):
+      compare_logs([can([1])], [car_state()])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -6,9 +6,10 @@ import sys
 import tempfile
 
 from selfdrive.car.car_helpers import interface_names
-from selfdrive.test.process_replay.process_replay import replay_process, CONFIGS
+from selfdrive.loggerd.logreader import LogReader, INDEX_SUFFIX
+from selfdrive.test.process_replay.process_replay import replay_process, replay_services, CONFIGS
 from selfdrive.test.process_replay.compare_logs import compare_logs
-from tools.lib.logreader import LogReader
+from selfdrive.test.process_replay.parallel_replay import replay_parallel
 
 
 INJECT_MODEL = 0
@@ -51,6 +52,12 @@ def get_segment(segment_name, original=True):
     f.write(req.content)
     return f.name
 
+def remove_segment(rlog_fn):
+  """Removes a log from get_segment, and the index the LogReader saved next to it"""
+  for fn in [rlog_fn, rlog_fn + INDEX_SUFFIX]:
+    if os.path.isfile(fn):
+      os.remove(fn)
+
 def test_process(cfg, lr, cmp_log_fn, ignore_fields=[], ignore_msgs=[]):
   if not os.path.isfile(cmp_log_fn):
     req = requests.get(BASE_URL + os.path.basename(cmp_log_fn))
@@ -60,7 +67,7 @@ def test_process(cfg, lr, cmp_log_fn, ignore_fields=[], ignore_msgs=[]):
       f.write(req.content)
       f.flush()
       f.seek(0)
-      cmp_log_msgs = list(LogReader(f.name))
+      cmp_log_msgs = list(LogReader(f.name, write_index=False))
   else:
     cmp_log_msgs = list(LogReader(cmp_log_fn))
 
@@ -126,6 +133,8 @@ if __name__ == "__main__":
                         help="Extra fields or msgs to ignore (e.g. carState.events)")
   parser.add_argument("--ignore-msgs", type=str, nargs="*", default=[],
                         help="Msgs to ignore (e.g. carEvents)")
+  parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of (segment, process) replays to run in parallel")
   args = parser.parse_args()
 
   cars_whitelisted = len(args.whitelist_cars) > 0
@@ -146,27 +155,45 @@ if __name__ == "__main__":
     untested = (set(interface_names) - set(excluded_interfaces)) - tested_cars
     assert len(untested) == 0, "Cars missing routes: %s" % (str(untested))
 
-  results = {}
-  for car_brand, segment in segments:
-    if (cars_whitelisted and car_brand.upper() not in args.whitelist_cars) or \
-        (not cars_whitelisted and car_brand.upper() in args.blacklist_cars):
-      continue
+  tested_segments = [segment for car_brand, segment in segments if not
+                     ((cars_whitelisted and car_brand.upper() not in args.whitelist_cars) or
+                      (not cars_whitelisted and car_brand.upper() in args.blacklist_cars))]
+  tested_configs = [cfg for cfg in CONFIGS if not
+                    ((procs_whitelisted and cfg.proc_name not in args.whitelist_procs) or
+                     (not procs_whitelisted and cfg.proc_name in args.blacklist_procs))]
+
+  def cmp_log_fn(segment, cfg):
+    return os.path.join(process_replay_dir, "%s_%s_%s.bz2" % (segment, cfg.proc_name, ref_commit))
+
+  # replay and compare everything up front across a process pool
+  parallel_results = {}
+  if args.jobs > 1:
+    rlog_fns = {segment: get_segment(segment) for segment in tested_segments}
+    # index every log once, so the jobs only decode the services their process reads
+    for rlog_fn in rlog_fns.values():
+      LogReader(rlog_fn).index
+    jobs = [(rlog_fns[segment], cfg.proc_name, cmp_log_fn(segment, cfg), args.ignore_fields, args.ignore_msgs)
+            for segment in tested_segments for cfg in tested_configs]
+    print("***** replaying %d jobs across %d workers *****\n" % (len(jobs), args.jobs))
+    parallel_results = replay_parallel(jobs, workers=args.jobs)
 
+  results = {}
+  for segment in tested_segments:
     print("***** testing route segment %s *****\n" % segment)
 
     results[segment] = {}
 
-    rlog_fn = get_segment(segment)
-    lr = LogReader(rlog_fn)
-
-    for cfg in CONFIGS:
-      if (procs_whitelisted and cfg.proc_name not in args.whitelist_procs) or \
-          (not procs_whitelisted and cfg.proc_name in args.blacklist_procs):
-        continue
-
-      cmp_log_fn = os.path.join(process_replay_dir, "%s_%s_%s.bz2" % (segment, cfg.proc_name, ref_commit))
-      results[segment][cfg.proc_name] = test_process(cfg, lr, cmp_log_fn, args.ignore_fields, args.ignore_msgs)
-    os.remove(rlog_fn)
+    if args.jobs > 1:
+      rlog_fn = rlog_fns[segment]
+      for cfg in tested_configs:
+        results[segment][cfg.proc_name] = parallel_results[(rlog_fn, cfg.proc_name)]
+    else:
+      rlog_fn = get_segment(segment)
+      for cfg in tested_configs:
+        lr = LogReader(rlog_fn, services=replay_services(cfg))
+        results[segment][cfg.proc_name] = test_process(cfg, lr, cmp_log_fn(segment, cfg), args.ignore_fields,
+                                                       args.ignore_msgs)
+    remove_segment(rlog_fn)
 
   diff1, diff2, failed = format_diff(results, ref_commit)
   with open(os.path.join(process_replay_dir, "diff.txt"), "w") as f:
@@ -2,12 +2,12 @@
 import os
 import sys
 
+from selfdrive.loggerd.logreader import LogReader
 from selfdrive.test.openpilotci_upload import upload_file
 from selfdrive.test.process_replay.compare_logs import save_log
-from selfdrive.test.process_replay.process_replay import replay_process, CONFIGS
-from selfdrive.test.process_replay.test_processes import segments, get_segment
+from selfdrive.test.process_replay.process_replay import replay_process, replay_services, CONFIGS
+from selfdrive.test.process_replay.test_processes import segments, get_segment, remove_segment
 from selfdrive.version import get_git_commit
-from tools.lib.logreader import LogReader
 
 if __name__ == "__main__":
 
@@ -27,16 +27,14 @@ if __name__ == "__main__":
       print("failed to get segment %s" % segment)
       sys.exit(1)
 
-    lr = LogReader(rlog_fn)
-
     for cfg in CONFIGS:
-      log_msgs = replay_process(cfg, lr)
+      log_msgs = replay_process(cfg, LogReader(rlog_fn, services=replay_services(cfg)))
       log_fn = os.path.join(process_replay_dir, "%s_%s_%s.bz2" % (segment, cfg.proc_name, ref_commit))
       save_log(log_fn, log_msgs)
 
       if not no_upload:
         upload_file(log_fn, os.path.basename(log_fn))
         os.remove(log_fn)
-    os.remove(rlog_fn)
+    remove_segment(rlog_fn)
 
   print("done")
@@ -110,20 +110,20 @@ def set_consistent_flag():
 
 
 def set_update_available_params(new_version=False):
-  params = Params()
-
   t = datetime.datetime.now().isoformat()
-  params.put("LastUpdateTime", t.encode('utf8'))
+  update_params = {"LastUpdateTime": t.encode('utf8')}
 
   if new_version:
     try:
       with open(os.path.join(FINALIZED, "RELEASES.md"), "rb") as f:
         r = f.read()
       r = r[:r.find(b'\n\n')]  # Slice latest release notes
-      params.put("ReleaseNotes", r + b"\n")
+      update_params["ReleaseNotes"] = r + b"\n"
     except Exception:
-      params.put("ReleaseNotes", "")
-    params.put("UpdateAvailable", "1")
+      update_params["ReleaseNotes"] = ""
+    update_params["UpdateAvailable"] = "1"
+
+  Params().put_many(update_params)
 
 
 def dismount_ovfs():